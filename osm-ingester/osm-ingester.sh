@@ -6,7 +6,7 @@ VERBOSE=1
 say() {
 
     if [ "$VERBOSE" -eq 1 ]; then
-        echo "$1"
+        echo "$1" >&2
     fi
 }
 
@@ -32,36 +32,20 @@ read_etag() {
 
     fi
 
-    say "$etag"
+    echo "$etag"
 }
 
 #
-# Convert the given Unix timestamp to an Overpass augmented diff sequence number
+# Outputs CSV data to update the Kamu Node data store. The output is the data from the
+# Overpass augmented diffs starting at the given sequence number up to the latest one
+# published (at most MAX_BATCH diffs if that is set), processed in a single run. With FOLLOW
+# set, keeps running instead and converts every new diff as it is published, updating the
+# sequence number at the output path after each one.
 #
 # Arguments:
-#    timestamp - Unix timestamp value in milliseconds since the start of the Unix epoch
-#
-# Returns:
-#    The Overpass augmented diff sequence number identifying the first minutely
-#    update that occurred after the given timestamp
-#
-timestamp_to_sequence_number() {
-    local timestamp="$1"
-    say "timestamp=$timestamp" >&2
-    utc_date=$(python3 -c "import time; print(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime($timestamp/1000)))")
-    say "utc_date=$utc_date" >&2
-    local seconds_since_epoch
-    seconds_since_epoch=$(date --date="$utc_date" +%s)
-    local sequence_number=$(( (seconds_since_epoch + 59) / 60 - 22457216 ))
-    say "$sequence_number"
-}
-
-#
-# Outputs CSV data to update the Kamu Node data store. The output is the data from the given
-# Overpass augmented diff, as specified by its sequence number.
-#
-# Arguments:
-#    sequence_number - The sequence number of the minutely augmented diff to download
+#    sequence_number - The sequence number of the first minutely augmented diff to download,
+#                      or an etag of minus a snapshot timestamp, which consumer.py converts to
+#                      the sequence number of the first diff after that time
 #    sequence_number_output_path - The path where the next sequence number should be written
 #
 update() {
@@ -69,8 +53,14 @@ update() {
     local sequence_number="$1"
     local sequence_number_output_path="$2"
 
-    say "Downloading minutely augmented diff #$sequence_number from Overpass..."
-    python3 /app/consumer.py "$sequence_number" "$sequence_number_output_path"
+    if [ -n "$FOLLOW" ]; then
+        say "Following minutely augmented diffs from #$sequence_number on Overpass..."
+        python3 /app/consumer.py --follow "$sequence_number" "$sequence_number_output_path"
+        return
+    fi
+
+    say "Downloading minutely augmented diffs from #$sequence_number from Overpass..."
+    python3 /app/consumer.py --workers "${WORKERS:-1}" "$sequence_number" "$sequence_number_output_path" latest
     say "Next sequence number was written to $sequence_number_output_path"
     say "Done"
 }
@@ -85,13 +75,22 @@ show_environment_variables() {
     say "RELATIONS = $RELATIONS"
     say "TAGS = $TAGS"
     say "MEMBERS = $MEMBERS"
+    say "DELETIONS = $DELETIONS"
+    say "CHANGESETS = $CHANGESETS"
 }
 
 #
-# Ensures that one and only one environment variable that controls output is set
+# Ensures that one and only one environment variable that controls output is set. When
+# OUTPUT_DIR is set, each type is written to its own file in that directory, so any number
+# of them (or none, meaning all) may be set.
 #
 check_environment_variables() {
 
+    if [ -n "$OUTPUT_DIR" ]; then
+        say "OUTPUT_DIR = $OUTPUT_DIR"
+        return
+    fi
+
     local variables=0
 
     if [ -n "$NODES" ]; then
@@ -109,14 +108,20 @@ check_environment_variables() {
     if [ -n "$MEMBERS" ]; then
         variables=$((variables + 1))
     fi
+    if [ -n "$DELETIONS" ]; then
+        variables=$((variables + 1))
+    fi
+    if [ -n "$CHANGESETS" ]; then
+        variables=$((variables + 1))
+    fi
 
     if [ "$variables" -eq 0 ]; then
-        say "Error: None of the environment variables (NODES, WAYS, RELATIONS, TAGS, MEMBERS) are set. Please set at least one." >&2
+        say "Error: None of the environment variables (NODES, WAYS, RELATIONS, TAGS, MEMBERS, DELETIONS, CHANGESETS) are set. Please set at least one." >&2
         exit 1
     fi
 
     if [ "$variables" -gt 1 ]; then
-        say "Error: More than one environment variable (NODES, WAYS, RELATIONS, TAGS, MEMBERS) is set. Please set only one." >&2
+        say "Error: More than one environment variable (NODES, WAYS, RELATIONS, TAGS, MEMBERS, DELETIONS, CHANGESETS) is set. Please set only one." >&2
         exit 1
     fi
 }
@@ -180,27 +185,12 @@ main() {
 
     else
 
-        local sequence_number
-
-        # otherwise, if ODF_ETAG < 0,
-        if [ "$ODF_ETAG" -lt 0 ]; then
-
-            # it's a Unix timestamp written out by initialize() when the PBF snapshot was read,
-            local timestamp="${ODF_ETAG#-}"
-
-            # so we need to convert the timestamp to an Overpass augmented diff sequence number,
-            sequence_number=$(timestamp_to_sequence_number "$timestamp")
-
-        else
-
-            # but if ODF_ETA >= 0, then ODF_ETAG is the sequence number.
-            sequence_number="$ODF_ETAG"
-
-        fi
-
-        # Use the sequence number to get the next minutely update from Overpass
-        # (this process writes the next sequence number to the etag path).
-        update "$sequence_number" "$ODF_NEW_ETAG_PATH"
+        # otherwise ODF_ETAG is the next sequence number or, if it is negative, minus the
+        # Unix timestamp written out by initialize() when the PBF snapshot was read. Either
+        # way, use it to get the next minutely updates from Overpass (consumer.py converts
+        # a timestamp to the sequence number of the first diff after it, and writes the
+        # next sequence number to the etag path).
+        update "$ODF_ETAG" "$ODF_NEW_ETAG_PATH"
 
         # Make a note that the etag file now contains a sequence number.
         etag_type="sequence number"
@@ -0,0 +1,33 @@
+"""Files that are replaced as a whole, so a reader never sees a partial file.
+
+The etag, the tag key dictionary, the metrics file and the memory-mapped tables
+are all written to a temporary file next to their path, which then replaces
+the path. A crash halfway leaves the old file as it was.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    """Yield a file, opened with mode and kwargs as by open(), that replaces path.
+
+    The file is a temporary file in the directory of path. Once the block
+    completes, it is flushed to disk and renamed to path; if the block raises,
+    it is removed and path is left alone.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        # mkstemp creates the file readable by its owner only
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, mode, **kwargs) as fh:
+            yield fh
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Compare CSV, Parquet and Arrow IPC output of the same converted rows.
+
+The rows of every output type are built once from a synthetic augmented diff and
+then written with OutputFiles (CSV) and ColumnarOutputFiles (Parquet, Arrow) to a
+temporary directory. Only the writing is timed. Prints one JSON object per format
+with the write time and the size of each file in KiB.
+
+Requires pyarrow.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import columnar  # noqa: E402
+import consumer  # noqa: E402
+from synthetic import write_synthetic_diff  # noqa: E402
+
+FORMATS = ("csv", "parquet", "arrow")
+
+
+def open_files(directory, format):
+    if format == "csv":
+        return consumer.OutputFiles(directory)
+    return columnar.ColumnarOutputFiles(directory, consumer.output_types(), format)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--ways", type=int, default=5000)
+    parser.add_argument("--relations", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=3, help="tags per entity")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as fh:
+        write_synthetic_diff(fh, args.nodes, args.ways, args.relations, args.tags)
+    try:
+        adiff = consumer.osmdiff.AugmentedDiff(file=fh.name)
+    finally:
+        os.unlink(fh.name)
+
+    rows = consumer.process_diff_data(
+        adiff, {name: [] for name, _, _ in consumer.output_types()}
+    )
+
+    for format in FORMATS:
+        directory = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            with open_files(directory, format) as files:
+                for name, sink in files.sinks.items():
+                    sink.extend(rows[name])
+            elapsed = time.perf_counter() - start
+            sizes = {
+                name: round(os.path.getsize(os.path.join(directory, name)) / 1024)
+                for name in sorted(os.listdir(directory))
+            }
+        finally:
+            shutil.rmtree(directory)
+        print(
+            json.dumps(
+                {"format": format, "write_s": round(elapsed, 3), "size_kib": sizes}
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Compare CSV writing throughput of dictionary rows with DictWriter and tuple rows with csv.writer.
+
+The rows come from a synthetic augmented diff. For each output type the same rows
+are written twice to /dev/null through a 1 MiB buffer:
+
+- dictwriter: dictionary rows, copied and pruned per row, then csv.DictWriter
+  (the way write_csv_stdout used to work)
+- writer: tuple rows in schema order with csv.writer.writerows (write_csv_stdout)
+
+Only the writing is timed. Prints one JSON object per output type with rows/sec
+for both paths.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import consumer  # noqa: E402
+from synthetic import write_synthetic_diff  # noqa: E402
+
+
+def write_dictwriter(rows, fieldnames):
+    writer = csv.DictWriter(
+        sys.stdout, fieldnames=fieldnames, quoting=csv.QUOTE_MINIMAL
+    )
+    writer.writeheader()
+    for row in rows:
+        filtered_row = {k: row.get(k, "") for k in fieldnames}
+        for k in list(row.keys()):
+            if k not in fieldnames:
+                del row[k]
+        writer.writerow(filtered_row)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    sys.stdout.flush()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--ways", type=int, default=5000)
+    parser.add_argument("--relations", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=3, help="tags per entity")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as fh:
+        write_synthetic_diff(fh, args.nodes, args.ways, args.relations, args.tags)
+    try:
+        adiff = consumer.osmdiff.AugmentedDiff(file=fh.name)
+    finally:
+        os.unlink(fh.name)
+    outputs = zip(
+        ("nodes", "ways", "relations", "members", "tags"),
+        (
+            consumer.NODE_FIELDS,
+            consumer.WAY_FIELDS,
+            consumer.RELATION_FIELDS,
+            consumer.MEMBER_FIELDS,
+            consumer.TAG_FIELDS,
+        ),
+        consumer.process_diff_data(adiff),
+    )
+
+    stdout = sys.stdout
+    sys.stdout = io.TextIOWrapper(
+        io.BufferedWriter(io.FileIO(os.devnull, "w"), 1 << 20), newline=""
+    )
+    results = []
+    try:
+        for name, fieldnames, rows in outputs:
+            dict_rows = [dict(zip(fieldnames, row)) for row in rows]
+            dictwriter = timed(write_dictwriter, dict_rows, fieldnames)
+            writer = timed(consumer.write_csv_stdout, rows, fieldnames)
+            results.append(
+                {
+                    "output": name,
+                    "rows": len(rows),
+                    "dictwriter_rows_per_sec": round(len(rows) / dictwriter),
+                    "writer_rows_per_sec": round(len(rows) / writer),
+                    "speedup": round(dictwriter / writer, 2),
+                }
+            )
+    finally:
+        sys.stdout = stdout
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
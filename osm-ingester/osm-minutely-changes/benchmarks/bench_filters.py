@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Measure the work a FILTER saves at different selectivities.
+
+A synthetic augmented diff is parsed once, and then converted with
+process_diff_data into CSV writers on /dev/null for every output type, once
+without a filter and once with each filter expression. Prints one JSON object
+per filter with the share of entities kept, the rows written, the best time of
+--repeat conversions and its speedup over converting without a filter.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import consumer  # noqa: E402
+from synthetic import write_synthetic_diff  # noqa: E402
+
+# From keeping everything to keeping nothing
+FILTERS = [
+    "",
+    "nwr/",
+    "highway building name",
+    "highway building",
+    "highway",
+    "w/highway",
+    "r/",
+    "highway=motorway",
+]
+
+
+def convert(adiff, expression, repeat):
+    best = float("inf")
+    sinks = {}
+    with mock.patch.object(consumer, "FILTER", expression), open(
+        os.devnull, "w"
+    ) as devnull:
+        for _ in range(repeat):
+            sinks = {
+                name: consumer.CsvRowWriter(devnull, fields, header=False)
+                for name, _, fields in consumer.output_types()
+            }
+            # Start every conversion without garbage left over by the last one
+            gc.collect()
+            start = time.perf_counter()
+            consumer.process_diff_data(adiff, sinks)
+            elapsed = time.perf_counter() - start
+            best = min(best, elapsed)
+        keep = consumer.entity_filter()
+        rejected = keep.rejected // repeat if keep is not None else 0
+    return best, sum(len(sink) for sink in sinks.values()), rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--ways", type=int, default=5000)
+    parser.add_argument("--relations", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=2, help="tags per entity")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as fh:
+        write_synthetic_diff(fh, args.nodes, args.ways, args.relations, args.tags)
+    try:
+        adiff = consumer.osmdiff.AugmentedDiff(file=fh.name)
+    finally:
+        os.unlink(fh.name)
+    entities = args.nodes + args.ways + args.relations
+
+    baseline = None
+    for expression in FILTERS:
+        # A new filter, whose rejected count starts at 0
+        consumer._services.pop("entity_filter", None)
+        seconds, rows, rejected = convert(adiff, expression, args.repeat)
+        if baseline is None:
+            baseline = seconds
+        print(
+            json.dumps(
+                {
+                    "filter": expression or None,
+                    "kept": round(1 - rejected / entities, 3),
+                    "rows": rows,
+                    "seconds": round(seconds, 3),
+                    "speedup": round(baseline / seconds, 2),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Compare uncompressed, gzip- and zstd-framed CSV output of the same converted rows.
+
+The rows of every output type are built once from example/343.osc, a real
+minutely osmChange file, and then written with OutputFiles as the frames of
+--diffs consecutive sequence numbers, once per OUTPUT_COMPRESSION. Every frame
+is compressed on its own, so repeating the same rows does not help
+compression. Prints one JSON object per compression with the write time, the
+size of each file in KiB, its size relative to CSV, and the time to read the
+rows of one sequence number from the middle of the tags file, through the
+index or by decompressing the whole file.
+
+zstd needs zstandard.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import consumer  # noqa: E402
+import framing  # noqa: E402
+
+EXAMPLE = os.path.join(HERE, "..", "..", "..", "example", "343.osc")
+COMPRESSIONS = ("", "gzip", "zstd")
+
+
+def read_all(path, compression):
+    if compression == "gzip":
+        with gzip.open(path, "rb") as fh:
+            return fh.read()
+    if compression == "zstd":
+        with open(path, "rb") as fh:
+            return (
+                framing.zstandard.ZstdDecompressor()
+                .stream_reader(fh, read_across_frames=True)
+                .read()
+            )
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def measure(rows, compression, diffs):
+    directory = tempfile.mkdtemp()
+    try:
+        with mock.patch.object(consumer, "OUTPUT_COMPRESSION", compression):
+            start = time.perf_counter()
+            with consumer.OutputFiles(directory) as files:
+                for sequence_number in range(diffs):
+                    for name, sink in files.sinks.items():
+                        sink.extend(rows[name])
+                    files.end_frame(sequence_number)
+            elapsed = time.perf_counter() - start
+        sizes = {
+            name: os.path.getsize(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory))
+            if not name.endswith(framing.INDEX_SUFFIX)
+        }
+        tags = os.path.join(directory, "tags.csv" + framing.CODECS.get(compression, ""))
+        start = time.perf_counter()
+        read_all(tags, compression)
+        whole = time.perf_counter() - start
+        one = None
+        if compression:
+            start = time.perf_counter()
+            b"".join(framing.read_range(tags, diffs // 2))
+            one = round((time.perf_counter() - start) * 1000, 2)
+    finally:
+        shutil.rmtree(directory)
+    return elapsed, sizes, round(whole * 1000, 2), one
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--diffs", type=int, default=60, help="frames per file")
+    args = parser.parse_args()
+
+    rows = consumer.process_diff_data(
+        consumer.OsmChangeFile(EXAMPLE),
+        {name: [] for name, _, _ in consumer.output_types()},
+    )
+
+    csv_sizes = None
+    for compression in COMPRESSIONS:
+        if compression == "zstd" and framing.zstandard is None:
+            continue
+        elapsed, sizes, whole_ms, one_ms = measure(rows, compression, args.diffs)
+        totals = sum(sizes.values())
+        if csv_sizes is None:
+            csv_sizes = totals
+        print(
+            json.dumps(
+                {
+                    "compression": compression or "none",
+                    "write_s": round(elapsed, 3),
+                    "size_kib": {
+                        name: round(size / 1024) for name, size in sizes.items()
+                    },
+                    "size_vs_csv": round(totals / csv_sizes, 3),
+                    "read_all_tags_ms": whole_ms,
+                    "read_one_frame_of_tags_ms": one_ms,
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Compare the size and conversion time of the ways output with each GEOMETRY_FORMAT.
+
+The ways of a synthetic augmented diff (longer than the synthetic default, like
+the residential streets and buildings of a busy minute) are converted to rows
+and written as CSV to memory once per geometry format, with full and with
+reduced coordinate precision. Prints one JSON object per format with the bytes
+of ways.csv, bytes per way and ways/sec of building and writing the rows.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import consumer  # noqa: E402
+import geometry  # noqa: E402
+from synthetic import write_synthetic_diff  # noqa: E402
+
+
+def convert(ways, encoder):
+    """Return the ways output of ways as CSV text and the seconds it took."""
+    start = time.perf_counter()
+    rows = []
+    for way in ways:
+        consumer.process_way(way, rows, encoder)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(consumer.WAY_FIELDS[:-1] + encoder.fields)
+    writer.writerows(rows)
+    return out.getvalue(), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ways", type=int, default=20000)
+    parser.add_argument("--nodes-per-way", type=int, default=20)
+    parser.add_argument("--precision", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as fh:
+        write_synthetic_diff(
+            fh,
+            nodes=args.ways * 2,
+            ways=args.ways,
+            relations=0,
+            nodes_per_way=args.nodes_per_way,
+        )
+    try:
+        adiff = consumer.osmdiff.AugmentedDiff(file=fh.name)
+    finally:
+        os.unlink(fh.name)
+    ways = [
+        entity
+        for _, entity in consumer.iter_entities(adiff)
+        if isinstance(entity, consumer.osmdiff.Way)
+    ]
+
+    baseline = None
+    for format in geometry.FORMATS:
+        for precision in (None, args.precision):
+            if format == "none" and precision is not None:
+                continue
+            text, seconds = convert(ways, geometry.GeometryEncoder(format, precision))
+            size = len(text.encode("utf-8"))
+            baseline = baseline or size
+            print(
+                json.dumps(
+                    {
+                        "format": format,
+                        "precision": precision,
+                        "bytes": size,
+                        "bytes_per_way": round(size / len(ways), 1),
+                        "size_vs_wkt": round(size / baseline, 3),
+                        "ways_per_sec": round(len(ways) / seconds),
+                    }
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Compare peak memory of the row-list and streaming conversion pipelines.
+
+Each mode runs in its own interpreter on the same synthetic augmented diff:
+
+- lists: process_diff_data() into five row lists, then output_csv_data()
+- streaming: stream_csv_data(), which writes every row as it is converted
+
+Reported per mode: the Python heap peak during conversion (tracemalloc) and the
+process RSS high-water mark (ru_maxrss), both in MiB. The RSS figure includes
+parsing the diff with osmdiff, which is the same for both modes.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+MODES = ("lists", "streaming")
+
+
+def run_mode(mode, diff_path):
+    import consumer
+
+    for flag in ("NODES", "WAYS", "RELATIONS", "MEMBERS", "TAGS"):
+        setattr(consumer, flag, 1)
+    consumer.VERBOSE = 0
+    adiff = consumer.osmdiff.AugmentedDiff(file=diff_path)
+
+    sys.stdout = open(os.devnull, "w")
+    tracemalloc.start()
+    if mode == "lists":
+        rows = consumer.process_diff_data(adiff)
+        consumer.output_csv_data(*rows)
+    else:
+        consumer.stream_csv_data(adiff)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sys.stdout = sys.__stdout__
+
+    maxrss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "mode": mode,
+                "entities": len(adiff.create),
+                "conversion_peak_mib": round(peak / 2**20, 1),
+                "max_rss_mib": round(maxrss_kib / 1024, 1),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--ways", type=int, default=5000)
+    parser.add_argument("--relations", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=3, help="tags per entity")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--diff", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.diff)
+        return
+
+    from synthetic import write_synthetic_diff
+
+    with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as fh:
+        write_synthetic_diff(fh, args.nodes, args.ways, args.relations, args.tags)
+    try:
+        for mode in MODES:
+            subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--diff", fh.name],
+                check=True,
+            )
+    finally:
+        os.unlink(fh.name)
+
+
+if __name__ == "__main__":
+    main()
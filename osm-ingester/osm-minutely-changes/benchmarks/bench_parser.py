@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Compare retrieving a diff with osmdiff and with the streaming parser.
+
+A synthetic augmented diff is served from a local HTTP server and converted with
+stream_csv_data() in each mode, each in its own interpreter:
+
+- osmdiff: AugmentedDiff.retrieve() parses the whole diff into objects first
+- stream: AugmentedDiffStream parses the response body while it downloads
+
+Reported per mode: the time until the first row is written, the total time, the
+Python heap peak (tracemalloc) and the process RSS high-water mark (ru_maxrss).
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+MODES = ("osmdiff", "stream")
+
+
+class DiffHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        assert isinstance(server, DiffServer)
+        with open(server.diff_path, "rb") as fh:
+            body = fh.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DiffServer(ThreadingHTTPServer):
+    """Serves the diff at diff_path with DiffHandler on a free local port."""
+
+    def __init__(self, diff_path):
+        super().__init__(("127.0.0.1", 0), DiffHandler)
+        self.diff_path = diff_path
+
+
+class FirstRowStream:
+    """A null output that records when the first row was written."""
+
+    def __init__(self):
+        self.first_write = None
+
+    def write(self, data):
+        if self.first_write is None:
+            self.first_write = time.perf_counter()
+        return len(data)
+
+
+def run_mode(mode, diff_path):
+    import consumer
+
+    for flag in ("NODES", "WAYS", "RELATIONS", "MEMBERS", "TAGS"):
+        setattr(consumer, flag, 1)
+    consumer.VERBOSE = 0
+    consumer.STREAM_PARSER = int(mode == "stream")
+
+    server = DiffServer(diff_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    consumer.OVERPASS_URL = (
+        f"http://127.0.0.1:{server.server_port}/augmented_diff?id={{sequence_number}}"
+    )
+
+    out = FirstRowStream()
+    sys.stdout = out
+    tracemalloc.start()
+    start = time.perf_counter()
+    adiff, status = consumer.retrieve_diff(1)
+    sinks = consumer.stream_csv_data(adiff)
+    end = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sys.stdout = sys.__stdout__
+    server.shutdown()
+
+    maxrss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "mode": mode,
+                "status": status,
+                "rows": sum(len(rows) for rows in sinks.values()),
+                "first_row_s": (
+                    None
+                    if out.first_write is None
+                    else round(out.first_write - start, 3)
+                ),
+                "total_s": round(end - start, 3),
+                "heap_peak_mib": round(peak / 2**20, 1),
+                "max_rss_mib": round(maxrss_kib / 1024, 1),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--ways", type=int, default=5000)
+    parser.add_argument("--relations", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=3, help="tags per entity")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--diff", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.diff)
+        return
+
+    from synthetic import write_synthetic_diff
+
+    with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as fh:
+        write_synthetic_diff(fh, args.nodes, args.ways, args.relations, args.tags)
+    try:
+        for mode in MODES:
+            subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--diff", fh.name],
+                check=True,
+            )
+    finally:
+        os.unlink(fh.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Compare routing entities to regions with the grid index and with a linear scan.
+
+Random region boxes (a few degrees wide, like cities and states) are indexed with
+regions.GridIndex, and random points and small boxes (nodes and ways) are looked
+up in the index and by checking every region. Prints one JSON object per region
+count with lookups/sec for both.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import regions  # noqa: E402
+
+
+def linear_query(boxes, bbox):
+    minlon, minlat, maxlon, maxlat = bbox
+    return [
+        index
+        for index, region in enumerate(boxes)
+        if minlon <= region.bbox[2]
+        and region.bbox[0] <= maxlon
+        and minlat <= region.bbox[3]
+        and region.bbox[1] <= maxlat
+    ]
+
+
+def rate(function, queries):
+    start = time.perf_counter()
+    for bbox in queries:
+        function(bbox)
+    return round(len(queries) / (time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--regions", type=int, nargs="+", default=[3, 30, 300, 3000])
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--cell", type=float, default=1.0, help="grid cell degrees")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    queries = []
+    for _ in range(args.lookups):
+        lon, lat = rng.uniform(-180, 180), rng.uniform(-60, 70)
+        size = rng.choice([0, 0, 0, 0.01])
+        queries.append((lon, lat, lon + size, lat + size))
+
+    for count in args.regions:
+        boxes = []
+        for i in range(count):
+            lon, lat = rng.uniform(-180, 175), rng.uniform(-60, 65)
+            width, height = rng.uniform(0.2, 5), rng.uniform(0.2, 5)
+            boxes.append(regions.Region(f"r{i}", (lon, lat, lon + width, lat + height)))
+        index = regions.GridIndex(boxes, args.cell)
+        print(
+            json.dumps(
+                {
+                    "regions": count,
+                    "grid_lookups_per_sec": rate(index.query, queries),
+                    "linear_lookups_per_sec": rate(
+                        lambda bbox: linear_query(boxes, bbox), queries
+                    ),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""Measure the throughput of the consumer hot paths on a fixed set of inputs.
+
+Scenarios, each run in its own interpreter:
+
+- synthetic: a synthetic augmented diff of the given size, served from a local
+  HTTP server and retrieved with osmdiff (STREAM_PARSER=0)
+- synthetic-stream: the same diff retrieved with the streaming parser
+- osc: the osmChange files given with --osc (example/343.osc by default)
+
+Every scenario is timed in three stages, as a catch-up batch runs them:
+
+- retrieve: retrieve_diff(), or opening the osmChange files
+- process: process_diff_data() into row lists for every output type
+- output: output_csv_data() (and the deletions) to /dev/null
+
+The streaming parser and osmChange files parse while process_diff_data() reads
+them, so for those scenarios parsing is part of the process stage.
+
+Prints one JSON object per scenario with entities/sec and rows/sec (over all
+three stages), the time of each stage (the fastest of --repeat runs) and the
+process RSS high-water mark. --output also saves the results together with the
+git revision and Python version, and --baseline compares against such a file
+to track regressions across releases.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+SCENARIOS = ("synthetic", "synthetic-stream", "osc")
+EXAMPLE_OSC = os.path.join(HERE, "..", "..", "..", "example", "343.osc")
+STAGES = ("retrieve", "process", "output")
+
+
+class DiffHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        assert isinstance(server, DiffServer)
+        with open(server.diff_path, "rb") as fh:
+            body = fh.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DiffServer(ThreadingHTTPServer):
+    """Serves the diff at diff_path with DiffHandler on a free local port."""
+
+    def __init__(self, diff_path):
+        super().__init__(("127.0.0.1", 0), DiffHandler)
+        self.diff_path = diff_path
+
+
+def convert_once(consumer, retrieve):
+    """Run the three stages once; return (stage times, entities, rows)."""
+    entities = 0
+
+    def count(changes):
+        nonlocal entities
+        for change in changes:
+            entities += 1
+            yield change
+
+    times = {}
+    start = time.perf_counter()
+    diffs = retrieve()
+    times["retrieve"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = {name: [] for name, _, _ in consumer.output_types()}
+    for diff in diffs:
+        consumer.process_diff_data(diff, rows, count)
+    times["process"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    consumer.output_csv_data(
+        rows["nodes"], rows["ways"], rows["relations"], rows["members"], rows["tags"]
+    )
+    consumer.write_csv_stdout(rows["deletions"], consumer.DELETION_FIELDS)
+    sys.stdout.flush()
+    times["output"] = time.perf_counter() - start
+
+    return times, entities, sum(len(sink) for sink in rows.values())
+
+
+def run_scenario(scenario, args):
+    import consumer
+
+    for flag in ("NODES", "WAYS", "RELATIONS", "MEMBERS", "TAGS", "DELETIONS"):
+        setattr(consumer, flag, 1)
+    consumer.VERBOSE = 0
+    consumer.DIFF_CACHE_DIR = ""
+
+    server = None
+    if scenario != "osc":
+        consumer.STREAM_PARSER = int(scenario == "synthetic-stream")
+        server = DiffServer(args.diff)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        consumer.OVERPASS_URL = (
+            f"http://127.0.0.1:{server.server_port}/augmented_diff"
+            "?id={sequence_number}"
+        )
+
+    def retrieve():
+        if server is None:
+            return [consumer.OsmChangeFile(path) for path in args.osc]
+        adiff, status = consumer.retrieve_diff(1)
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}")
+        return [adiff]
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        runs = [convert_once(consumer, retrieve) for _ in range(args.repeat)]
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        if server is not None:
+            server.shutdown()
+
+    stage_s = {stage: min(times[stage] for times, _, _ in runs) for stage in STAGES}
+    total = sum(stage_s.values())
+    _, entities, rows = runs[0]
+    maxrss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "scenario": scenario,
+                "entities": entities,
+                "rows": rows,
+                "entities_per_s": round(entities / total),
+                "rows_per_s": round(rows / total),
+                "stage_s": {stage: round(s, 3) for stage, s in stage_s.items()},
+                "max_rss_mib": round(maxrss_kib / 1024, 1),
+            }
+        )
+    )
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline):
+    """Add the ratio of each rate to the baseline run of the same scenario."""
+    for key in ("entities_per_s", "rows_per_s"):
+        if baseline.get(key):
+            result[f"{key}_vs_baseline"] = round(result[key] / baseline[key], 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--ways", type=int, default=5000)
+    parser.add_argument("--relations", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=3, help="tags per entity")
+    parser.add_argument("--osc", nargs="+", default=[EXAMPLE_OSC])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --output")
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--diff", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_scenario(args.scenario, args)
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = {r["scenario"]: r for r in json.load(fh)["results"]}
+
+    from synthetic import write_synthetic_diff
+
+    with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as fh:
+        write_synthetic_diff(fh, args.nodes, args.ways, args.relations, args.tags)
+    results = []
+    try:
+        for scenario in args.scenarios:
+            command = [sys.executable, __file__, "--scenario", scenario]
+            command += ["--diff", fh.name, "--repeat", str(args.repeat)]
+            command += ["--osc", *args.osc]
+            output = subprocess.run(
+                command, check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output)
+            if scenario in baseline:
+                compare(result, baseline[scenario])
+            results.append(result)
+            print(json.dumps(result))
+    finally:
+        os.unlink(fh.name)
+
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(
+                {
+                    "revision": git_revision(),
+                    "python": platform.python_version(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "size": {
+                        "nodes": args.nodes,
+                        "ways": args.ways,
+                        "relations": args.relations,
+                        "tags": args.tags,
+                    },
+                    "results": results,
+                },
+                out,
+                indent=2,
+            )
+            out.write("\n")
+
+
+if __name__ == "__main__":
+    main()
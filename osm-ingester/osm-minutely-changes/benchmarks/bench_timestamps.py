@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Compare timestamp conversion with strptime and with consumer.to_epoch_millis.
+
+The timestamps are those of a diff: --timestamps of them, sharing --distinct
+values, as the entities of a minutely diff share the few seconds they were
+uploaded in. They are converted to epoch milliseconds once with
+datetime.strptime (the way to_epoch_millis used to work) and once with
+to_epoch_millis, whose memo is cleared first, as process_diff_data does for
+every diff. Prints a JSON object with timestamps/sec of both and the speedup.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import consumer  # noqa: E402
+
+
+def strptime_millis(ts):
+    dt = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ")
+    return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def timed(convert, timestamps, repeat):
+    best = float("inf")
+    result = []
+    for _ in range(repeat):
+        consumer._epoch_millis_memo.clear()
+        start = time.perf_counter()
+        result = [convert(ts) for ts in timestamps]
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--timestamps", type=int, default=30000)
+    parser.add_argument(
+        "--distinct", type=int, default=60, help="distinct timestamps, at most 3600"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    timestamps = [
+        "2025-06-07T20:%02d:%02dZ"
+        % (i % args.distinct // 60 % 60, i % args.distinct % 60)
+        for i in range(args.timestamps)
+    ]
+    expected, strptime_seconds = timed(strptime_millis, timestamps, args.repeat)
+    actual, fast_seconds = timed(consumer.to_epoch_millis, timestamps, args.repeat)
+    if actual != expected:
+        raise SystemExit("to_epoch_millis disagrees with strptime")
+
+    print(
+        json.dumps(
+            {
+                "timestamps": len(timestamps),
+                "distinct": len(set(timestamps)),
+                "strptime_per_sec": round(len(timestamps) / strptime_seconds),
+                "to_epoch_millis_per_sec": round(len(timestamps) / fast_seconds),
+                "speedup": round(strptime_seconds / fast_seconds, 2),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
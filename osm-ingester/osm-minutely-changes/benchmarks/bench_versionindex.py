@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Measure the version index (versionindex.py) for a city- and a country-sized ID space.
+
+For each size, an index is filled with that many node, way and relation ids
+(spread over the id range of today's OSM data, as the entities of a region are)
+one diff-sized commit at a time, and then a minutely diff of lookups (half of
+them known entities with a newer version, half new ones) is checked against it.
+Every size runs in its own process so that peak RSS is its own. Prints one JSON
+object per size with ids/sec of filling, lookups/sec of a diff, the file size
+and the peak RSS, both in MiB.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import versionindex  # noqa: E402
+
+# Roughly the highest ids in use, and the share of each type among entities
+ID_RANGES = {"node": 13_000_000_000, "way": 1_400_000_000, "relation": 19_000_000}
+SHARES = {"node": 0.88, "way": 0.115, "relation": 0.005}
+DIFF_SIZE = 50_000
+
+
+def entities(count, rng):
+    for osm_type, share in SHARES.items():
+        top = ID_RANGES[osm_type]
+        for _ in range(int(count * share)):
+            yield osm_type, rng.randrange(1, top)
+
+
+def measure(count, directory):
+    path = os.path.join(directory, "versions.idx")
+    index = versionindex.VersionIndex(path, capacity=count)
+
+    # The ids are generated again from the seed rather than kept in memory
+    start = time.perf_counter()
+    filled = 0
+    for osm_type, osm_id in entities(count, random.Random(count)):
+        index.record(osm_type, osm_id, 1, 1)
+        filled += 1
+        if filled % DIFF_SIZE == 0:
+            index.commit()
+    index.commit()
+    fill = time.perf_counter() - start
+
+    step = max(filled // (DIFF_SIZE // 2), 1)
+    diff = list(itertools.islice(entities(count, random.Random(count)), 0, None, step))
+    diff += entities(DIFF_SIZE // 2, random.Random(count + 1))
+    start = time.perf_counter()
+    newer = 0
+    for osm_type, osm_id in diff:
+        if index.is_newer(osm_type, osm_id, 2):
+            index.record(osm_type, osm_id, 2, 2)
+            newer += 1
+    lookup = time.perf_counter() - start
+    index.commit()
+
+    maxrss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "ids": filled,
+        "fill_ids_per_sec": round(filled / fill),
+        "diff_lookups": len(diff),
+        "diff_newer": newer,
+        "diff_lookups_per_sec": round(len(diff) / lookup),
+        "file_mib": round(os.path.getsize(path) / (1 << 20), 1),
+        "max_rss_mib": round(maxrss_kib / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--ids",
+        type=int,
+        nargs="+",
+        default=[2_000_000, 40_000_000],
+        help="index sizes; the defaults are about Berlin and Germany",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with tempfile.TemporaryDirectory() as directory:
+            print(json.dumps(measure(args.ids[0], directory)))
+        return
+    for count in args.ids:
+        command = [sys.executable, __file__, "--child", "--ids", str(count)]
+        subprocess.run(command, check=True)
+
+
+if __name__ == "__main__":
+    main()
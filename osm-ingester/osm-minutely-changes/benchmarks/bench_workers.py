@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Time a catch-up batch with a growing number of --workers processes.
+
+A synthetic augmented diff is served from a local HTTP server for every sequence
+number, and `consumer.py --workers N` converts a batch of them to OUTPUT_DIR
+once per worker count. Prints one JSON object per worker count with the wall
+time, the diffs converted per second and the speedup over a single worker.
+
+The speedup is bounded by the number of CPUs (reported as "cpus"): with one CPU
+the workers only take turns.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from synthetic import write_synthetic_diff  # noqa: E402
+
+CONSUMER = os.path.join(os.path.dirname(HERE), "consumer.py")
+
+
+class DiffHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        assert isinstance(server, DiffServer)
+        body = server.body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DiffServer(ThreadingHTTPServer):
+    """Serves body with DiffHandler on a free local port."""
+
+    def __init__(self, body):
+        super().__init__(("127.0.0.1", 0), DiffHandler)
+        self.body = body
+
+
+def run_batch(url, workers, diffs, directory):
+    env = dict(
+        os.environ,
+        OVERPASS_URL=url,
+        OUTPUT_DIR=os.path.join(directory, "out"),
+        NODES="1",
+        WAYS="1",
+        RELATIONS="1",
+        MEMBERS="1",
+        TAGS="1",
+        DELETIONS="1",
+        VERBOSE="",
+    )
+    etag_path = os.path.join(directory, "etag.txt")
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            CONSUMER,
+            "--workers",
+            str(workers),
+            "1",
+            etag_path,
+            str(diffs),
+        ],
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    elapsed = time.perf_counter() - start
+    with open(etag_path) as fh:
+        if int(fh.read()) != diffs + 1:
+            raise RuntimeError(f"batch with {workers} workers did not complete")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--diffs", type=int, default=16, help="diffs per batch")
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--ways", type=int, default=500)
+    parser.add_argument("--relations", type=int, default=50)
+    parser.add_argument("--tags", type=int, default=3, help="tags per entity")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w+b", suffix=".xml") as fh:
+        with open(fh.name, "w") as text:
+            write_synthetic_diff(text, args.nodes, args.ways, args.relations, args.tags)
+        body = fh.read()
+
+    server = DiffServer(body)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/augmented_diff?id={{sequence_number}}"
+
+    baseline = None
+    try:
+        for workers in args.workers:
+            directory = tempfile.mkdtemp()
+            try:
+                elapsed = run_batch(url, workers, args.diffs, directory)
+            finally:
+                shutil.rmtree(directory)
+            baseline = baseline or elapsed
+            print(
+                json.dumps(
+                    {
+                        "workers": workers,
+                        "cpus": os.cpu_count(),
+                        "diffs": args.diffs,
+                        "total_s": round(elapsed, 3),
+                        "diffs_per_s": round(args.diffs / elapsed, 1),
+                        "speedup": round(baseline / elapsed, 2),
+                    }
+                )
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
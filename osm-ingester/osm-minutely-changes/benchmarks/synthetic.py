@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Generate synthetic Overpass augmented diffs for benchmarks."""
+
+import argparse
+import random
+import sys
+
+TAG_KEYS = ["highway", "building", "name", "surface", "source", "addr:street"]
+TAG_VALUES = ["residential", "yes", "Main Street", "asphalt", "survey", "house"]
+
+
+def write_synthetic_diff(
+    fh,
+    nodes=10000,
+    ways=1000,
+    relations=100,
+    tags_per_entity=2,
+    nodes_per_way=8,
+    members_per_relation=5,
+    seed=0,
+):
+    """Write an augmented diff with the given number of created entities to fh."""
+    rng = random.Random(seed)
+    write = fh.write
+    write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    write('<osm version="0.6" generator="synthetic">\n')
+    write('<meta osm_base="2025-06-07T20:26:00Z"/>\n')
+
+    def meta(i):
+        # A minutely diff only spans a handful of distinct timestamps
+        return (
+            f'version="{1 + i % 7}" timestamp="2025-06-07T20:25:{i % 60:02d}Z" '
+            f'changeset="{167326000 + i % 50}" uid="{1000 + i % 50}" user="user{i % 50}"'
+        )
+
+    def tags(i):
+        return "".join(
+            f'    <tag k="{TAG_KEYS[(i + t) % len(TAG_KEYS)]}" '
+            f'v="{TAG_VALUES[(i * 7 + t) % len(TAG_VALUES)]}"/>\n'
+            for t in range(tags_per_entity)
+        )
+
+    coords = []
+    for i in range(nodes):
+        lat = 52.3 + rng.random() * 0.4
+        lon = 13.0 + rng.random() * 0.8
+        coords.append((lat, lon))
+        write('<action type="create">\n')
+        write(f'  <node id="{1 + i}" lat="{lat:.7f}" lon="{lon:.7f}" {meta(i)}>\n')
+        write(tags(i))
+        write("  </node>\n</action>\n")
+
+    for i in range(ways):
+        refs = [rng.randrange(nodes) for _ in range(nodes_per_way)] if nodes else []
+        write('<action type="create">\n')
+        write(f'  <way id="{1 + i}" {meta(i)}>\n')
+        if refs:
+            lats = [coords[r][0] for r in refs]
+            lons = [coords[r][1] for r in refs]
+            write(
+                f'    <bounds minlat="{min(lats):.7f}" minlon="{min(lons):.7f}" '
+                f'maxlat="{max(lats):.7f}" maxlon="{max(lons):.7f}"/>\n'
+            )
+        for r in refs:
+            write(
+                f'    <nd ref="{1 + r}" lat="{coords[r][0]:.7f}" '
+                f'lon="{coords[r][1]:.7f}"/>\n'
+            )
+        write(tags(i))
+        write("  </way>\n</action>\n")
+
+    for i in range(relations):
+        write('<action type="create">\n')
+        write(f'  <relation id="{1 + i}" {meta(i)}>\n')
+        for m in range(members_per_relation):
+            write(
+                f'    <member type="way" ref="{1 + (i + m) % max(ways, 1)}" '
+                f'role="outer"/>\n'
+            )
+        write(tags(i))
+        write("  </relation>\n</action>\n")
+
+    write("</osm>\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--ways", type=int, default=1000)
+    parser.add_argument("--relations", type=int, default=100)
+    parser.add_argument("--tags", type=int, default=2, help="tags per entity")
+    args = parser.parse_args()
+    write_synthetic_diff(sys.stdout, args.nodes, args.ways, args.relations, args.tags)
+
+
+if __name__ == "__main__":
+    main()
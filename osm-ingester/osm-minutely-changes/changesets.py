@@ -0,0 +1,112 @@
+"""Per-changeset rollups of the entities of a diff, for the changesets output of consumer.py.
+
+Downstream, edit counts, users, bounding boxes and time spans per changeset
+were computed with GROUP BY changeset queries over the nodes, ways, relations
+and deletions datasets. consumer.process_diff_data adds every entity it
+converts to a ChangesetRollup instead, in the same pass, and the rollup writes
+one row per changeset of the diff, laid out like consumer.ChangesetRow:
+
+    changeset, uid, username, minEpochMillis, maxEpochMillis,
+    nodesCreated, nodesModified, nodesDeleted, waysCreated, ...,
+    minlon, minlat, maxlon, maxlat
+
+The rows are those of one diff. A changeset that is still open, or whose
+edits fall on both sides of a minute, has a row in each diff it appears in,
+so queries sum the counts and take the min and max of the rest per changeset
+over those rows. The bounding box covers the entities of the changeset that
+have a location in the diff (see consumer.entity_bounds), and is empty when
+none has.
+"""
+
+TYPES = ("node", "way", "relation")
+ACTIONS = ("create", "modify", "delete")
+COUNT_FIELDS = [
+    f"{osm_type}s{suffix}"
+    for osm_type in TYPES
+    for suffix in ("Created", "Modified", "Deleted")
+]
+FIELDS = (
+    ["changeset", "uid", "username", "minEpochMillis", "maxEpochMillis"]
+    + COUNT_FIELDS
+    + ["minlon", "minlat", "maxlon", "maxlat"]
+)
+# Position of the count of each (type, action) in a rollup
+COUNT_INDEX = {
+    (osm_type, action): 5 + 3 * i + j
+    for i, osm_type in enumerate(TYPES)
+    for j, action in enumerate(ACTIONS)
+}
+BBOX_INDEX = 5 + len(COUNT_FIELDS)
+
+
+class ChangesetRollup:
+    """The rollups of the changesets of one diff, written to sink by write().
+
+    When sink is a regions.RoutedSink, the entities of each region are rolled
+    up on their own and every region gets the rows of its own entities.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.routed = hasattr(sink, "targets")
+        # (id of the sink, changeset) -> rollup, as a list laid out like a row
+        self.rollups = {}
+        self.sinks = {}
+
+    def add(self, action, osm_type, changeset, uid, username, epoch_millis, bounds):
+        """Add one entity of changeset, an int, with bounds (minlon, minlat, maxlon,
+        maxlat) or None."""
+        count = COUNT_INDEX[osm_type, action]
+        targets = self.sink.targets if self.routed else (self.sink,)
+        for target in targets:
+            key = (id(target), changeset)
+            rollup = self.rollups.get(key)
+            if rollup is None:
+                self.sinks[id(target)] = target
+                rollup = [changeset, uid, username, epoch_millis, epoch_millis]
+                rollup += [0] * len(COUNT_FIELDS)
+                rollup += bounds or (None, None, None, None)
+                self.rollups[key] = rollup
+            else:
+                if epoch_millis is not None:
+                    if rollup[3] is None or epoch_millis < rollup[3]:
+                        rollup[3] = epoch_millis
+                    if rollup[4] is None or epoch_millis > rollup[4]:
+                        rollup[4] = epoch_millis
+                if bounds is not None:
+                    extend_bbox(rollup, bounds)
+            rollup[count] += 1
+
+    def write(self):
+        """Add a row for every changeset to the sinks, by changeset id, and start over."""
+        rows = {}
+        for key in sorted(self.rollups):
+            rows.setdefault(key[0], []).append(tuple(self.rollups[key]))
+        for sink_id, sink_rows in rows.items():
+            # Straight to the sink of the region, leaving the targets of the routed
+            # sink to the rows being converted
+            self.sinks[sink_id].extend(sink_rows)
+            if self.routed:
+                self.sink.count += len(sink_rows)
+        self.rollups.clear()
+        self.sinks.clear()
+
+    def __len__(self):
+        return len(self.rollups)
+
+
+def extend_bbox(rollup, bounds):
+    """Grow the bounding box of a rollup to cover bounds."""
+    minlon, minlat, maxlon, maxlat = bounds
+    i = BBOX_INDEX
+    if rollup[i] is None:
+        rollup[i : i + 4] = bounds
+        return
+    if minlon < rollup[i]:
+        rollup[i] = minlon
+    if minlat < rollup[i + 1]:
+        rollup[i + 1] = minlat
+    if maxlon > rollup[i + 2]:
+        rollup[i + 2] = maxlon
+    if maxlat > rollup[i + 3]:
+        rollup[i + 3] = maxlat
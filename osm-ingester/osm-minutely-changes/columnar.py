@@ -0,0 +1,179 @@
+"""Columnar (Parquet or Arrow IPC) output for the rows built by consumer.py.
+
+Rows are buffered and converted to typed Arrow record batches, one file per
+output type, with the columns of the CSV output. Column types follow the Kamu
+dataset schemas (data/*/*.yaml), except that coordinates are kept as 64-bit
+floats so that no precision is lost.
+
+pyarrow is an optional dependency, only needed when this output is used.
+"""
+
+import os
+from typing import TYPE_CHECKING
+
+import changesets
+
+if TYPE_CHECKING:
+    # Type checked as installed; at run time require_pyarrow guards its use
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+else:
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:  # pragma: no cover - depends on the environment
+        pyarrow = None
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# Arrow type of every column of the CSV outputs, by column name
+FIELD_TYPES = {
+    "epochMillis": "int64",
+    "type": "string",
+    "id": "int64",
+    "version": "int32",
+    "changeset": "int32",
+    "username": "string",
+    "uid": "int32",
+    "lat": "float64",
+    "lon": "float64",
+    "geometry": "string",
+    "minEpochMillis": "int64",
+    "maxEpochMillis": "int64",
+    **{name: "int32" for name in changesets.COUNT_FIELDS},
+    "minlon": "float64",
+    "minlat": "float64",
+    "maxlon": "float64",
+    "maxlat": "float64",
+    "relationId": "int64",
+    "memberId": "int64",
+    "memberRole": "string",
+    "memberType": "string",
+    "key": "string",
+    "keyId": "int32",
+    "value": "string",
+}
+
+BATCH_ROWS = 65536
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise RuntimeError("columnar output requires pyarrow (pip install pyarrow)")
+
+
+def arrow_schema(fieldnames):
+    """Return the Arrow schema of rows with the given columns."""
+    require_pyarrow()
+    return pyarrow.schema(
+        [(name, pyarrow.type_for_alias(FIELD_TYPES[name])) for name in fieldnames]
+    )
+
+
+def record_batch(rows, schema):
+    """Convert row tuples to a record batch, parsing numeric columns from their text."""
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pyarrow.types.is_string(field.type):
+            arrays.append(pyarrow.array(values, pyarrow.string()))
+            continue
+        try:
+            arrays.append(pyarrow.array(values, field.type))
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # Attribute values are strings; let Arrow parse the whole column at once
+            arrays.append(pyarrow.array(values, pyarrow.string()).cast(field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ColumnarRowWriter:
+    """Append row tuples to a Parquet or Arrow IPC file in record batches.
+
+    Works as a row sink like CsvRowWriter: rows are collected until batch_rows
+    of them are pending, then converted and written as one batch. close()
+    writes the remaining rows and finishes the file.
+    """
+
+    def __init__(self, path, fieldnames, format="parquet", batch_rows=BATCH_ROWS):
+        self.schema = arrow_schema(fieldnames)
+        if format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        elif format == "arrow":
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+        else:
+            raise ValueError(f"unknown columnar format: {format}")
+        self.batch_rows = batch_rows
+        self.pending = []
+        self.count = 0
+
+    def append(self, row):
+        self.pending.append(row)
+        self.count += 1
+        if len(self.pending) >= self.batch_rows:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return self.count
+
+    def flush(self):
+        """Write the pending rows as a record batch."""
+        if self.pending and self.writer is not None:
+            self.writer.write_batch(record_batch(self.pending, self.schema))
+            self.pending = []
+
+    def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.writer.close()
+            self.writer = None
+
+
+class ColumnarOutputFiles:
+    """One Parquet or Arrow IPC file per output type in a directory.
+
+    The columnar counterpart of consumer.OutputFiles: types is a list of
+    (name, enabled, fieldnames) as returned by consumer.output_types, and the
+    file of each enabled type (all types if none is enabled) is
+    <directory>/<type>.parquet or <directory>/<type>.arrow. sinks maps the names
+    of the types written to their ColumnarRowWriter.
+    """
+
+    def __init__(self, directory, types, format="parquet"):
+        require_pyarrow()
+        if format not in FORMATS:
+            raise ValueError(f"unknown columnar format: {format}")
+        os.makedirs(directory, exist_ok=True)
+        write_all = not any(enabled for _, enabled, _ in types)
+        self.sinks = {}
+        try:
+            for name, enabled, fieldnames in types:
+                if not (enabled or write_all):
+                    continue
+                path = os.path.join(directory, name + FORMATS[format])
+                self.sinks[name] = ColumnarRowWriter(path, fieldnames, format)
+        except BaseException:
+            self.close()
+            raise
+
+    def flush(self):
+        for sink in self.sinks.values():
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks.values():
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,9 +1,42 @@
 #!/usr/bin/env python3
+import argparse
 import time
 import csv
+import gzip
+import io
+import itertools
+import re
+import shutil
 import sys
 import os
+import tempfile
+import signal
+import threading
+from collections import deque, namedtuple
+from contextlib import closing
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable, Iterator, TypeVar, cast
+import requests
+import urllib3
 import osmdiff
+from osmdiff.config import API_CONFIG
+from osmdiff.osm import OSMObject
+import atomicfile
+import changesets
+import columnar
+import diffcache
+import filters
+import framing
+import geometry
+import metrics
+import nodestore
+import regions
+import sequence
+import tagkeys
+import versionindex
 
 # epoch in seconds
 current_epoch = int(time.time())
@@ -14,278 +47,1849 @@ WAYS = os.getenv("WAYS", 0)
 RELATIONS = os.getenv("RELATIONS", 0)
 MEMBERS = os.getenv("MEMBERS", 0)
 TAGS = os.getenv("TAGS", 0)
+DELETIONS = os.getenv("DELETIONS", 0)
+CHANGESETS = os.getenv("CHANGESETS", 0)
+FILTER = os.getenv("FILTER", "")
 MINLON = float(os.getenv("MINLON", 0.0))
 MINLAT = float(os.getenv("MINLAT", 0.0))
 MAXLON = float(os.getenv("MAXLON", 0.0))
 MAXLAT = float(os.getenv("MAXLAT", 0.0))
+MAX_BATCH = int(os.getenv("MAX_BATCH", 0))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 4))
+FETCH_WINDOW = int(os.getenv("FETCH_WINDOW", 8))
+OVERPASS_URL = os.getenv("OVERPASS_URL", "")
+OVERPASS_STATE_URL = os.getenv("OVERPASS_STATE_URL", "")
+STATE_MAX_AGE = float(os.getenv("STATE_MAX_AGE", 30))
+STREAM_PARSER = int(os.getenv("STREAM_PARSER", 1))
+FETCH_TIMEOUT = int(os.getenv("FETCH_TIMEOUT", 120))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", 3))
+FOLLOW_MIN_INTERVAL = float(os.getenv("FOLLOW_MIN_INTERVAL", 5))
+FOLLOW_MAX_INTERVAL = float(os.getenv("FOLLOW_MAX_INTERVAL", 30))
+ROTATE_SEQUENCES = int(os.getenv("ROTATE_SEQUENCES", 60))
+OUTPUT_BUFFER_SIZE = int(os.getenv("OUTPUT_BUFFER_SIZE", 1 << 20))
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "")
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")
+OUTPUT_COMPRESSION = os.getenv("OUTPUT_COMPRESSION", "")
+DIFF_CACHE_DIR = os.getenv("DIFF_CACHE_DIR", "")
+DIFF_CACHE_SIZE = int(os.getenv("DIFF_CACHE_SIZE", 1 << 30))
+REGIONS = os.getenv("REGIONS", "")
+METRICS = os.getenv("METRICS", "")
+METRICS_FORMAT = os.getenv("METRICS_FORMAT", "json")
+TAG_KEY_DICTIONARY = os.getenv("TAG_KEY_DICTIONARY", "")
+VERSION_INDEX = os.getenv("VERSION_INDEX", "")
+VERSION_INDEX_CAPACITY = int(os.getenv("VERSION_INDEX_CAPACITY", 1 << 20))
+NODE_LOCATIONS = os.getenv("NODE_LOCATIONS", "")
+NODE_LOCATIONS_CAPACITY = int(os.getenv("NODE_LOCATIONS_CAPACITY", 1 << 24))
+GEOMETRY_FORMAT = os.getenv("GEOMETRY_FORMAT", "wkt")
+GEOMETRY_PRECISION = os.getenv("GEOMETRY_PRECISION", "")
+REGION_GRID_DEGREES = float(os.getenv("REGION_GRID_DEGREES", 1.0))
 
 max_changeset_id = 0
 
+UNIX_EPOCH = datetime(1970, 1, 1)
+ONE_MILLISECOND = timedelta(milliseconds=1)
+_epoch_millis_memo = {}
 
-def write_csv_stdout(rows, fieldnames):
-    """Write rows (a list of dictionaries) as CSV to stdout, filtering only allowed fields."""
-    writer = csv.DictWriter(
-        sys.stdout, fieldnames=fieldnames, quoting=csv.QUOTE_MINIMAL
+# One record type per output, whose fields are the columns of the output in
+# order. The converters build rows as plain tuples laid out like these records:
+# the garbage collector stops tracking a tuple of strings, but not a namedtuple,
+# which makes collections over large row lists several times slower. Use
+# NodeRow._make(row) and so on for named access to a row.
+NodeRow = namedtuple(
+    "NodeRow",
+    ["epochMillis", "id", "version", "changeset", "username", "uid", "lat", "lon"],
+)
+WayRow = namedtuple(
+    "WayRow",
+    ["epochMillis", "id", "version", "changeset", "username", "uid", "geometry"],
+)
+RelationRow = namedtuple("RelationRow", WayRow._fields)
+MemberRow = namedtuple(
+    "MemberRow", ["relationId", "memberId", "memberRole", "memberType"]
+)
+TagRow = namedtuple("TagRow", ["epochMillis", "type", "id", "key", "value"])
+# The tags output with TAG_KEY_DICTIONARY set, see tagkeys
+KeyedTagRow = namedtuple("KeyedTagRow", ["epochMillis", "type", "id", "keyId", "value"])
+DeletionRow = namedtuple(
+    "DeletionRow",
+    ["epochMillis", "type", "id", "version", "changeset", "username", "uid"],
+)
+# One row per changeset of a diff, see changesets
+ChangesetRow = namedtuple("ChangesetRow", changesets.FIELDS)
+
+NODE_FIELDS = list(NodeRow._fields)
+WAY_FIELDS = list(WayRow._fields)
+RELATION_FIELDS = list(RelationRow._fields)
+MEMBER_FIELDS = list(MemberRow._fields)
+TAG_FIELDS = list(TagRow._fields)
+KEYED_TAG_FIELDS = list(KeyedTagRow._fields)
+DELETION_FIELDS = list(DeletionRow._fields)
+CHANGESET_FIELDS = list(ChangesetRow._fields)
+
+
+def write_csv_stdout(rows, fieldnames, header=True):
+    """Write rows (tuples in fieldnames order) as CSV to stdout."""
+    writer = csv.writer(sys.stdout, quoting=csv.QUOTE_MINIMAL)
+    if header:
+        writer.writerow(fieldnames)
+    writer.writerows(rows)
+
+
+def buffered_stdout(buffer_size=OUTPUT_BUFFER_SIZE):
+    """Return a text stream on stdout's file descriptor with a large write buffer.
+
+    Returns sys.stdout unchanged when it is not backed by a file descriptor.
+    """
+    try:
+        fileno = sys.stdout.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        return sys.stdout
+    sys.stdout.flush()
+    raw = metrics.TimedWriter(io.FileIO(fileno, "w", closefd=False))
+    return io.TextIOWrapper(
+        io.BufferedWriter(raw, buffer_size), encoding="utf-8", newline=""
     )
-    writer.writeheader()
-    if rows and VERBOSE:
-        print("DEBUG: first row keys:", list(rows[0].keys()), file=sys.stderr)
-    for row in rows:
-        # Remove all keys not in fieldnames
-        filtered_row = {k: row.get(k, "") for k in fieldnames}
-        # Remove extra keys if any exist
-        for k in list(row.keys()):
-            if k not in fieldnames:
-                del row[k]
-        writer.writerow(filtered_row)
 
 
-def to_epoch_millis(ts):
-    from datetime import datetime, timezone
+def open_text_output(path, mode="w", compression="", index_path=None):
+    """Open path for writing text with an OUTPUT_BUFFER_SIZE buffer.
+
+    The writes that reach the file are timed for the write stage of the metrics.
+    With compression, "gzip" or "zstd", the text is compressed in frames indexed
+    in index_path, and stream.buffer.raw is the framing.FramedWriter.
+    """
+    raw = metrics.TimedWriter(io.FileIO(path, mode))
+    if compression:
+        raw = framing.FramedWriter(
+            io.BufferedWriter(raw, OUTPUT_BUFFER_SIZE), index_path, compression
+        )
+    return io.TextIOWrapper(
+        io.BufferedWriter(raw, OUTPUT_BUFFER_SIZE), encoding="utf-8", newline=""
+    )
+
+
+class CsvRowWriter:
+    """Row sink that writes each appended row (a tuple) as CSV straight away.
+
+    It stands in for a row list in process_diff_data, so rows are written as the
+    entities are converted instead of being collected first. len() is the number
+    of rows written.
+    """
+
+    def __init__(self, stream, fieldnames, header=True):
+        self.stream = stream
+        self.writer = csv.writer(stream, quoting=csv.QUOTE_MINIMAL)
+        self.count = 0
+        if header:
+            self.writer.writerow(fieldnames)
+
+    def append(self, row):
+        self.writer.writerow(row)
+        self.count += 1
+
+    def extend(self, rows):
+        rows = list(rows)
+        self.writer.writerows(rows)
+        self.count += len(rows)
+
+    def __len__(self):
+        return self.count
+
+    def write_csv(self, text, count):
+        """Write count rows that were already formatted as CSV elsewhere."""
+        self.stream.write(text)
+        self.count += count
+
+
+def parse_osm_timestamp(ts):
+    """Convert an OSM timestamp ('2025-03-03T11:55:24Z') to epoch milliseconds.
 
+    Returns None if ts is not in that exact form.
+    """
+    if len(ts) != 20 or ts[19] != "Z" or ts[10] != "T":
+        return None
+    try:
+        return (datetime.fromisoformat(ts[:19]) - UNIX_EPOCH) // ONE_MILLISECOND
+    except ValueError:
+        return None
+
+
+def to_epoch_millis(ts):
     if ts is None:
         return None
     if isinstance(ts, (int, float)):
         # Assume already ms
         return int(ts)
-    # Try ISO8601 parsing (e.g. '2025-03-03T11:55:24Z')
+    # The entities of a diff share a few distinct timestamps, so most calls are
+    # answered from the memo (cleared for every diff by process_diff_data).
     try:
-        dt = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ")
-        return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
-    except Exception:
+        return _epoch_millis_memo[ts]
+    except KeyError:
         pass
-    # Try as float seconds
-    try:
-        return int(float(ts) * 1000)
-    except Exception:
-        return None
+    # Try ISO8601 parsing (e.g. '2025-03-03T11:55:24Z')
+    millis = parse_osm_timestamp(ts)
+    if millis is None:
+        # Try as float seconds
+        try:
+            millis = int(float(ts) * 1000)
+        except Exception:
+            return None
+    _epoch_millis_memo[ts] = millis
+    return millis
 
 
-def main():
-    global max_changeset_id
+def parse_args(argv):
+    """Parse the command line into a sequence range and an etag output path.
 
-    if len(sys.argv) != 3:
-        print("Usage: consumer.py <sequence_number> <etag_output_path>")
-        sys.exit(1)
+    With --osc, local osmChange files are read instead and the positional
+    arguments are not needed. With --follow there is no end of the range.
+    """
+    parser = argparse.ArgumentParser(
+        prog="consumer.py",
+        description="Convert Overpass augmented diffs to CSV on stdout.",
+    )
+    parser.add_argument(
+        "sequence_number",
+        type=start_sequence,
+        nargs="?",
+        help="first augmented diff sequence number, or an etag of minus a snapshot "
+        "timestamp in epoch milliseconds to start after that time",
+    )
+    parser.add_argument(
+        "etag_output_path",
+        nargs="?",
+        help="path where the next sequence number is written",
+    )
+    parser.add_argument(
+        "end_sequence",
+        nargs="?",
+        default=None,
+        help='last sequence number to process (inclusive), or "latest"',
+    )
+    parser.add_argument(
+        "--osc",
+        nargs="+",
+        metavar="PATH",
+        help="read local osmChange files (.osc or .osc.gz) or directories of them",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="keep running and convert every new diff as soon as it is published",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="convert the diffs of a batch in N worker processes",
+    )
+    args = parser.parse_args(argv)
+    if not args.osc and (args.sequence_number is None or not args.etag_output_path):
+        parser.error("sequence_number and etag_output_path are required")
+    if args.follow and args.end_sequence is not None:
+        parser.error("end_sequence cannot be combined with --follow")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and (args.follow or args.osc):
+        parser.error("--workers cannot be combined with --follow or --osc")
+    return args
 
-    sequence_number = int(sys.argv[1])
-    etag_output_path = sys.argv[2]
 
-    adiff = None
+def start_sequence(text):
+    """Parse the sequence_number argument, which may be an etag (see sequence.parse_etag)."""
+    try:
+        return sequence.parse_etag(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-    print(f"MINLON: {MINLON}, MAXLON: {MAXLON}, MINLAT: {MINLAT}, MAXLAT: {MAXLAT}")
 
+def build_adiff(sequence_number):
+    """Create an AugmentedDiff for the given sequence number and configured bbox."""
+    base_url = OVERPASS_URL or None
     if MINLON == 0 and MINLAT == 0 and MAXLON == 0 and MAXLAT == 0:
-        adiff = osmdiff.AugmentedDiff()
+        adiff = osmdiff.AugmentedDiff(base_url=base_url)
     elif MAXLON <= MINLON or MAXLAT <= MINLAT:
         raise ValueError("max lon / MAXLAT needs to be greater than MINLON / MINLAT")
     elif MINLON < -90 or MINLAT < -180 or MAXLON > 90 or MAXLAT > 180:
         raise ValueError("bounds need to be within valid coordinate range")
     else:
-        print(f"instantiating adiff with bbox {MINLON}, {MINLAT}, {MAXLON}, {MAXLAT}")
         adiff = osmdiff.AugmentedDiff(
-            minlon=MINLON, minlat=MINLAT, maxlon=MAXLON, maxlat=MAXLAT
+            minlon=MINLON,
+            minlat=MINLAT,
+            maxlon=MAXLON,
+            maxlat=MAXLAT,
+            base_url=base_url,
         )
     adiff.sequence_number = sequence_number
-    adiff.retrieve()
+    return adiff
+
+
+def retrieve_diff(sequence_number, read_ahead=False):
+    """Request one augmented diff, returning (diff, HTTP status).
+
+    With STREAM_PARSER set (the default) the diff is an AugmentedDiffStream, which
+    is parsed while its body downloads, or read from the diff cache when it is
+    there. With read_ahead, its body is downloaded before this returns and parsed
+    from a temporary file later (see AugmentedDiffStream.download). Otherwise
+    osmdiff downloads and parses the whole diff before this returns, without the
+    cache.
+    """
+    adiff = build_adiff(sequence_number)
+    if not STREAM_PARSER:
+        status = adiff.retrieve(auto_increment=False)
+        return adiff, status
+    url = adiff.base_url.format(sequence_number=sequence_number)
+    key = diffcache.cache_key(sequence_number, (MINLON, MINLAT, MAXLON, MAXLAT))
+    diff = AugmentedDiffStream(url, sequence_number, cache=diff_cache(), cache_key=key)
+    if read_ahead:
+        diff.download()
+    return diff, diff.status
+
+
+# Objects built from the settings, by name: (settings, object), see cached_service
+_services = {}
+_services_lock = threading.RLock()
+
+
+def cached_service(name, factory, *settings):
+    """Return factory(*settings), built once and again only when settings change.
+
+    The prefetch threads share the objects, so they are built under a lock.
+    """
+    with _services_lock:
+        cached = _services.get(name)
+        if cached is None or cached[0] != settings:
+            cached = _services[name] = (settings, factory(*settings))
+        return cached[1]
+
+
+def diff_cache():
+    """Return the DiffCache in DIFF_CACHE_DIR, or None when caching is disabled."""
+    if not DIFF_CACHE_DIR:
+        return None
+    return cached_service(
+        "diff_cache", diffcache.DiffCache, DIFF_CACHE_DIR, DIFF_CACHE_SIZE
+    )
+
+
+def metrics_writer():
+    """Return the MetricsWriter for METRICS, or None when metrics are disabled."""
+    if not METRICS:
+        return None
+    return cached_service(
+        "metrics_writer", metrics.MetricsWriter, METRICS, METRICS_FORMAT
+    )
+
+
+def tag_key_dictionary():
+    """Return the TagKeyDictionary in TAG_KEY_DICTIONARY, or None when it is not set."""
+    if not TAG_KEY_DICTIONARY:
+        return None
+    return cached_service(
+        "tag_key_dictionary", tagkeys.TagKeyDictionary, TAG_KEY_DICTIONARY
+    )
+
+
+def entity_filter():
+    """Return the EntityFilter of FILTER, or None when it is not set."""
+    if not FILTER:
+        return None
+    return cached_service("entity_filter", filters.EntityFilter, FILTER)
+
+
+def geometry_encoder():
+    """Return the GeometryEncoder for GEOMETRY_FORMAT and GEOMETRY_PRECISION.
+
+    Locations missing from a diff are looked up in the NODE_LOCATIONS store.
+    """
+    precision = int(GEOMETRY_PRECISION) if GEOMETRY_PRECISION != "" else None
+    return cached_service(
+        "geometry_encoder",
+        geometry.GeometryEncoder,
+        GEOMETRY_FORMAT,
+        precision,
+        node_store(),
+    )
+
+
+def node_store():
+    """Return the NodeStore in NODE_LOCATIONS, or None when it is not set."""
+    if not NODE_LOCATIONS:
+        return None
+    return cached_service(
+        "node_store", nodestore.NodeStore, NODE_LOCATIONS, NODE_LOCATIONS_CAPACITY
+    )
+
+
+def version_index():
+    """Return the VersionIndex in VERSION_INDEX, or None when it is not set."""
+    if not VERSION_INDEX:
+        return None
+    return cached_service(
+        "version_index",
+        versionindex.VersionIndex,
+        VERSION_INDEX,
+        VERSION_INDEX_CAPACITY,
+    )
+
+
+# What process_diff_data keeps or looks up across diffs, see diff_services
+Services = namedtuple(
+    "Services", ["tag_keys", "versions", "locations", "keep", "encoder"]
+)
+
+
+def diff_services():
+    """Return the Services of the current settings, each None when it is not set."""
+    return Services(
+        tag_key_dictionary(),
+        version_index(),
+        node_store(),
+        entity_filter(),
+        geometry_encoder(),
+    )
 
-    # hello
+
+def commit_versions():
+    """Record the versions of the rows written out; call once they are flushed and
+    before writing the etag."""
+    index = version_index()
+    if index is not None:
+        index.commit()
+
+
+def rollback_versions():
+    """Forget the versions of the rows of a diff that failed before it was written out."""
+    index = version_index()
+    if index is not None:
+        index.rollback()
+
+
+def save_state():
+    """Save the tag key dictionary, node locations and version index.
+
+    Call once the output is flushed and before writing the etag.
+    """
+    save_tag_keys()
+    store = node_store()
+    if store is not None:
+        store.flush()
+    commit_versions()
+
+
+def save_tag_keys():
+    """Save the keys added to the tag key dictionary; call before writing the etag."""
+    dictionary = tag_key_dictionary()
+    if dictionary is not None:
+        dictionary.save()
+
+
+_http = threading.local()
+
+
+def http_session():
+    """Return this thread's requests session, so connections are reused per thread."""
+    session = getattr(_http, "session", None)
+    if session is None:
+        session = _http.session = requests.Session()
+        session.headers["User-Agent"] = "osm-minutely-changes"
+    return session
+
+
+def state_url():
+    """Return the URL of the newest published sequence number.
+
+    OVERPASS_STATE_URL if set, else the augmented_diff_status endpoint next to
+    OVERPASS_URL, else the one of osmdiff.
+    """
+    if OVERPASS_STATE_URL:
+        return OVERPASS_STATE_URL
+    if "augmented_diff?" in OVERPASS_URL:
+        return OVERPASS_URL.split("augmented_diff?")[0] + "augmented_diff_status"
+    return API_CONFIG["overpass"]["state_url"]
+
+
+def replication_state():
+    """Return the ReplicationState of state_url(), cached for STATE_MAX_AGE seconds."""
+    return cached_service(
+        "replication_state",
+        sequence.ReplicationState,
+        state_url(),
+        STATE_MAX_AGE,
+        FETCH_TIMEOUT,
+    )
+
+
+def prefetch_diffs(sequence_numbers, workers=None, window=None):
+    """Yield (sequence_number, adiff, status) for each sequence number, in order.
+
+    Up to `workers` diffs are downloaded concurrently in a thread pool, and at most
+    `window` diffs are in flight or waiting to be consumed at any time, so the next
+    diffs download while the caller is busy converting the current one. The pool
+    reads the bodies of streamed diffs completely (retrieve_diff with read_ahead),
+    so no response is left open while it waits. Pending downloads are cancelled
+    when the caller stops iterating early.
+    """
+    workers = FETCH_WORKERS if workers is None else workers
+    window = max(FETCH_WINDOW if window is None else window, 1)
+
+    if workers <= 1:
+        for sequence_number in sequence_numbers:
+            adiff, status = retrieve_diff(sequence_number)
+            yield sequence_number, adiff, status
+        return
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+    try:
+        retrieve = partial(retrieve_diff, read_ahead=True)
+        for sequence_number, future in submit_in_order(
+            pool, retrieve, sequence_numbers, window
+        ):
+            adiff, status = future.result()
+            yield sequence_number, adiff, status
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def submit_in_order(
+    pool: Executor, function: Callable[[T], R], items: Iterable[T], window
+) -> Iterator[tuple[T, Future[R]]]:
+    """Submit function(item) to pool for the items, yielding (item, future) in order.
+
+    At most `window` calls are submitted and not yet consumed at any time. The next
+    item is only submitted once the future being yielded is done, so the pool
+    keeps working on the following items while the caller handles this one.
+    """
+    upcoming = iter(items)
+    in_flight = deque(
+        (item, pool.submit(function, item))
+        for item in itertools.islice(upcoming, window)
+    )
+    while in_flight:
+        item, future = in_flight.popleft()
+        future.exception()  # wait for it without raising
+        for next_item in itertools.islice(upcoming, 1):
+            in_flight.append((next_item, pool.submit(function, next_item)))
+        yield item, future
+
+
+def resolve_end_sequence(start_sequence, end_sequence):
+    """Return the last sequence number (inclusive) of the batch starting at start_sequence.
+
+    end_sequence may be None (process only start_sequence), an integer string, or
+    "latest" to catch up to the newest augmented diff published by Overpass. The
+    batch is capped at MAX_BATCH sequence numbers when MAX_BATCH is set.
+    """
+    if end_sequence is None:
+        end = start_sequence
+    elif end_sequence == "latest":
+        end = replication_state().latest(http_session())
+    else:
+        end = int(end_sequence)
+    if MAX_BATCH:
+        end = min(end, start_sequence + MAX_BATCH - 1)
+    return end
+
+
+def write_diffs(diffs):
+    """Convert every diff of an iterable and write the rows out.
+
+    Rows go to stdout, or to one file per type in OUTPUT_DIR when that is set;
+    either way each type gets a single header for all the diffs. Files are CSV
+    or, with OUTPUT_FORMAT set to "parquet" or "arrow", columnar. With REGIONS,
+    each region gets its own files in a subdirectory of OUTPUT_DIR. With
+    OUTPUT_COMPRESSION, the rows of each diff are a frame of their own.
+    On stdout, the sections of the types are laid out by a StdoutSections.
+    """
+    if not OUTPUT_DIR and OUTPUT_FORMAT != "csv":
+        raise ValueError(f"OUTPUT_FORMAT={OUTPUT_FORMAT} requires OUTPUT_DIR")
+    if not OUTPUT_DIR and OUTPUT_COMPRESSION:
+        raise ValueError("OUTPUT_COMPRESSION requires OUTPUT_DIR")
+    if not OUTPUT_DIR and REGIONS:
+        raise ValueError("REGIONS requires OUTPUT_DIR")
+    files = open_output_files(OUTPUT_DIR) if OUTPUT_DIR else StdoutSections()
+    route = files.route if isinstance(files, regions.RegionOutputFiles) else None
+    framed = isinstance(files, (OutputFiles, regions.RegionOutputFiles))
+
+    try:
+        for diff in diffs:
+            convert_diff(diff, files.sinks, route)
+            if OUTPUT_COMPRESSION and framed:
+                files.end_frame(getattr(diff, "sequence_number", None))
+    finally:
+        files.close()
+
+    if isinstance(files, regions.RegionOutputFiles):
+        for name, sinks in files.region_sinks():
+            log_processing_results(sinks, f"{name}: ")
+    else:
+        log_processing_results(files.sinks)
+
+
+def convert_diff(adiff, sinks=None, route=None, header=True, flush=None):
+    """Convert a diff into sinks, or to stdout with stream_csv_data without sinks.
+
+    route is passed on to process_diff_data, and flush, if given, is called once
+    the diff is converted. With METRICS set, the metrics of the diff are written
+    out after that. Returns the sinks the rows went to. When converting fails,
+    the versions recorded for the diff are rolled back.
+    """
+    writer = metrics_writer()
+    measure = None
+    if writer is not None:
+        measure = metrics.DiffMetrics(getattr(adiff, "sequence_number", None))
+        measure.start(sinks)
+        if route is None:
+            route = measure.count
+        else:
+            inner_route = route
+
+            def counted_route(changes):
+                # Count every change, then route it as asked
+                return inner_route(measure.count(changes))
+
+            route = counted_route
+
+    services = diff_services()
+    try:
+        if sinks is None:
+            sinks = stream_csv_data(adiff, header, route, services)
+        else:
+            process_diff_data(adiff, sinks, route, services)
+        if flush is not None:
+            flush()
+    except BaseException:
+        rollback_versions()
+        raise
+    if writer is not None and measure is not None:
+        measure.finish(adiff, sinks, max_changeset_id)
+        writer.write(measure)
+    return sinks
+
+
+def run_batch(start_sequence, end_sequence):
+    """Convert the diffs start_sequence..end_sequence and write them out.
+
+    Returns the next sequence number to process: end_sequence + 1, or the first
+    sequence number that could not be retrieved.
+    """
+    next_sequence = start_sequence
+
+    def retrieved_diffs():
+        nonlocal next_sequence
+        sequence_numbers = range(start_sequence, end_sequence + 1)
+        with closing(prefetch_diffs(sequence_numbers)) as diffs:
+            for sequence_number, adiff, status in diffs:
+                if status != 200:
+                    # Not published yet (or unavailable): stop here and resume from
+                    # this sequence number on the next run.
+                    print(
+                        f"Stopping at sequence {sequence_number}: HTTP {status}",
+                        file=sys.stderr,
+                    )
+                    return
+                yield adiff
+                next_sequence = sequence_number + 1
+
+    write_diffs(retrieved_diffs())
+    return next_sequence
+
+
+# Settings that worker processes of run_parallel_batch take over from the parent
+WORKER_SETTINGS = (
+    "NODES",
+    "WAYS",
+    "RELATIONS",
+    "MEMBERS",
+    "TAGS",
+    "DELETIONS",
+    "CHANGESETS",
+    "FILTER",
+    "MINLON",
+    "MINLAT",
+    "MAXLON",
+    "MAXLAT",
+    "OVERPASS_URL",
+    "STREAM_PARSER",
+    "FETCH_TIMEOUT",
+    "FETCH_RETRIES",
+    "DIFF_CACHE_DIR",
+    "DIFF_CACHE_SIZE",
+    "GEOMETRY_FORMAT",
+    "GEOMETRY_PRECISION",
+    "METRICS",
+)
+
+
+def run_parallel_batch(start_sequence, end_sequence, workers):
+    """Convert the diffs start_sequence..end_sequence in a pool of worker processes.
+
+    Every worker downloads and converts whole diffs to CSV text (convert_sequence),
+    and the text is written out here in sequence order, laid out as run_batch
+    writes it. At most twice as many diffs as workers are converted ahead of the
+    one being written. The batch ends at the first diff that could not be
+    retrieved or converted, so the returned next sequence number always follows a
+    contiguous run of completed diffs. Only CSV output without REGIONS is
+    supported.
+    """
+    global max_changeset_id
+
+    if OUTPUT_FORMAT != "csv" or REGIONS:
+        raise ValueError("--workers only supports CSV output without REGIONS")
+    if TAG_KEY_DICTIONARY:
+        # Every worker would number the new keys on its own
+        raise ValueError("--workers does not support TAG_KEY_DICTIONARY")
+    if VERSION_INDEX or NODE_LOCATIONS:
+        raise ValueError("--workers does not support VERSION_INDEX or NODE_LOCATIONS")
+    if OUTPUT_COMPRESSION and not OUTPUT_DIR:
+        raise ValueError("OUTPUT_COMPRESSION requires OUTPUT_DIR")
+    files = OutputFiles(OUTPUT_DIR) if OUTPUT_DIR else StdoutSections()
+    names = list(files.sinks)
+    settings = {name: globals()[name] for name in WORKER_SETTINGS}
+
+    next_sequence = start_sequence
+    pool = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(settings,))
     try:
-        nodes_rows, ways_rows, relations_rows, members_rows, tags_rows = (
-            process_diff_data(adiff)
+        convert = partial(convert_sequence, names=names)
+        sequence_numbers = range(start_sequence, end_sequence + 1)
+        for sequence_number, future in submit_in_order(
+            pool, convert, sequence_numbers, 2 * workers
+        ):
+            try:
+                status, sections, changeset_id, measure = future.result()
+            except Exception as e:
+                print(f"Stopping at sequence {sequence_number}: {e}", file=sys.stderr)
+                break
+            if status != 200:
+                print(
+                    f"Stopping at sequence {sequence_number}: HTTP {status}",
+                    file=sys.stderr,
+                )
+                break
+            max_changeset_id = max(max_changeset_id, changeset_id)
+            write_before = metrics.WRITE_TIME.seconds
+            for name in names:
+                files.sinks[name].write_csv(*sections[name])
+            if OUTPUT_COMPRESSION and isinstance(files, OutputFiles):
+                files.end_frame(sequence_number)
+            writer = metrics_writer()
+            if writer is not None and measure is not None:
+                measure.seconds["write"] += metrics.WRITE_TIME.seconds - write_before
+                measure.max_changeset_id = max_changeset_id
+                writer.write(measure)
+            next_sequence = sequence_number + 1
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        files.close()
+
+    log_processing_results(files.sinks)
+    return next_sequence
+
+
+def init_worker(settings):
+    """Set up a worker process of run_parallel_batch with the settings of the parent."""
+    global _http
+    globals().update(settings)
+    # HTTP connections and the cache index are not shared with the parent process
+    _http = threading.local()
+    _services.clear()
+
+
+def convert_sequence(sequence_number, names):
+    """Download and convert one diff in a worker process of run_parallel_batch.
+
+    Returns (status, sections, max_changeset_id, metrics), where sections maps each
+    of the output names to (CSV text of its rows without a header, number of rows)
+    and metrics is the DiffMetrics of the diff when METRICS is set, without the
+    write stage, which happens in the parent.
+    """
+    adiff, status = retrieve_diff(sequence_number)
+    if status != 200:
+        return status, {}, 0, None
+    fieldnames = {name: fields for name, _, fields in output_types()}
+    buffers = {name: io.StringIO() for name in names}
+    sinks = {
+        name: CsvRowWriter(buffers[name], fieldnames[name], header=False)
+        for name in names
+    }
+    measure = None
+    if METRICS:
+        measure = metrics.DiffMetrics(sequence_number)
+        measure.start()
+    process_diff_data(adiff, sinks, measure.count if measure else None, diff_services())
+    if measure is not None:
+        measure.finish(adiff, sinks, max_changeset_id)
+    sections = {name: (buffers[name].getvalue(), len(sinks[name])) for name in names}
+    return status, sections, max_changeset_id, measure
+
+
+def osc_paths(paths):
+    """Expand files and directories into the list of osmChange files to read.
+
+    Directories are searched recursively for .osc and .osc.gz files, in path
+    order, which is sequence order for replication directories (000/001/343.osc.gz).
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for directory, subdirectories, names in os.walk(path):
+            subdirectories.sort()
+            files.extend(
+                os.path.join(directory, name)
+                for name in sorted(names)
+                if name.endswith((".osc", ".osc.gz"))
+            )
+    return files
+
+
+def main():
+    global max_changeset_id
+
+    args = parse_args(sys.argv[1:])
+    start_sequence = args.sequence_number
+    etag_output_path = args.etag_output_path
+
+    if args.osc:
+        run_osc_files(args.osc)
+        return
+
+    print(
+        f"MINLON: {MINLON}, MAXLON: {MAXLON}, MINLAT: {MINLAT}, MAXLAT: {MAXLAT}",
+        file=sys.stderr,
+    )
+
+    if args.follow:
+        run_follow(start_sequence, etag_output_path)
+        return
+
+    stdout = sys.stdout
+    sys.stdout = buffered_stdout()
+    try:
+        end_sequence = resolve_end_sequence(start_sequence, args.end_sequence)
+        if args.workers > 1:
+            next_sequence = run_parallel_batch(
+                start_sequence, end_sequence, args.workers
+            )
+        else:
+            next_sequence = run_batch(start_sequence, end_sequence)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        sys.stdout.flush()
+        sys.stdout = stdout
+
+    if VERBOSE:
+        print(f"max changeset id: {max_changeset_id}", file=sys.stderr)
+        print(
+            f"sequence numbers: {start_sequence}..{next_sequence - 1}", file=sys.stderr
         )
+        print(f"etag output path: {etag_output_path}", file=sys.stderr)
+        cache = diff_cache()
+        if cache is not None:
+            print(f"diff cache: {cache.stats()}", file=sys.stderr)
+        versions = version_index()
+        if versions is not None:
+            print(f"versions written before: {versions.skipped}", file=sys.stderr)
+        keep = entity_filter()
+        if keep is not None:
+            print(f"filtered out: {keep.rejected}", file=sys.stderr)
+    save_state()
+    write_etag(etag_output_path, next_sequence)
+
+
+def write_etag(path, next_sequence):
+    """Write the next sequence number to path atomically.
+
+    The number is written to a temporary file next to path, which then replaces
+    path, so a reader (or a restart after a crash) never sees a partial etag.
+    """
+    with atomicfile.atomic_write(path) as fh:
+        fh.write(str(next_sequence))
 
-        output_csv_data(nodes_rows, ways_rows, relations_rows, members_rows, tags_rows)
 
-        log_processing_results(
-            nodes_rows, ways_rows, relations_rows, members_rows, tags_rows
+def run_follow(start_sequence, etag_output_path):
+    """Follow the minutely feed until SIGTERM or SIGINT, then exit after the current diff."""
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    stdout = sys.stdout
+    sys.stdout = buffered_stdout()
+    try:
+        follow(start_sequence, etag_output_path, stop)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        sys.stdout.flush()
+        sys.stdout = stdout
+
+
+def follow(start_sequence, etag_output_path, stop):
+    """Convert every diff from start_sequence on as soon as it is published, until stop is set.
+
+    While behind, diffs are prefetched as in run_batch, up to the newest published
+    one (see replication_state). Once caught up, the next
+    sequence number is polled for, waiting FOLLOW_MIN_INTERVAL seconds at first and
+    twice as long after every miss, up to FOLLOW_MAX_INTERVAL. Failed requests are
+    retried the same way.
+
+    Rows go to stdout, which takes a single enabled type, or to files in
+    OUTPUT_DIR that are rotated every ROTATE_SEQUENCES sequence numbers (see
+    RotatingOutputFiles). After every diff the output is flushed and the next
+    sequence number is written to etag_output_path, so a restart resumes from the
+    first diff not yet converted.
+    The rows of a diff interrupted halfway are written again when it is retried.
+
+    Returns the next sequence number to process.
+    """
+    if OUTPUT_FORMAT != "csv":
+        raise ValueError("--follow only writes CSV output")
+    if REGIONS:
+        raise ValueError("--follow does not support REGIONS")
+    if OUTPUT_COMPRESSION and not OUTPUT_DIR:
+        raise ValueError("OUTPUT_COMPRESSION requires OUTPUT_DIR")
+    enabled_types = [name for name, enabled, _ in output_types() if enabled]
+    if not OUTPUT_DIR and len(enabled_types) > 1:
+        # The sections after the first would only be written out when it stops
+        raise ValueError(
+            "--follow writes a single type to stdout, or all to OUTPUT_DIR"
         )
+    next_sequence = start_sequence
+    files = RotatingOutputFiles(OUTPUT_DIR, ROTATE_SEQUENCES) if OUTPUT_DIR else None
+    # A single type needs no spool, so its rows reach stdout diff by diff
+    stdout_sinks = StdoutSections().sinks if files is None else None
+    delay = FOLLOW_MIN_INTERVAL
+
+    def published_diffs():
+        # Ask for the next diff on its own, so that polling while caught up takes a
+        # single request. Once it is published, prefetch the ones after it up to
+        # the newest published diff, which takes one more request when caught up.
+        sequence_number = next_sequence
+        adiff, status = retrieve_diff(sequence_number)
+        yield sequence_number, adiff, status
+        if status != 200:
+            return
+        state = replication_state()
+        latest = state.latest(http_session())
+        if latest <= sequence_number:
+            latest = state.latest(http_session(), refresh=True)
+        upcoming = range(sequence_number + 1, latest + 1)
+        with closing(prefetch_diffs(upcoming)) as diffs:
+            yield from diffs
+
+    try:
+        while not stop.is_set():
+            try:
+                for sequence_number, adiff, status in published_diffs():
+                    if status != 200:
+                        break
+                    delay = FOLLOW_MIN_INTERVAL
+                    if files is None:
+                        convert_diff(adiff, stdout_sinks, flush=sys.stdout.flush)
+                    else:
+                        convert_diff(
+                            adiff,
+                            files.sinks(sequence_number),
+                            flush=partial(files.flush, sequence_number),
+                        )
+                    next_sequence = sequence_number + 1
+                    save_state()
+                    write_etag(etag_output_path, next_sequence)
+                    if stop.is_set():
+                        break
+            except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+                # Includes connections dropped while a diff body is being read, whose
+                # entities are converted again from the start
+                rollback_versions()
+                print(f"Retrying sequence {next_sequence}: {e}", file=sys.stderr)
+            if stop.is_set():
+                break
+            if VERBOSE:
+                print(
+                    f"Waiting {delay:g}s for sequence {next_sequence}", file=sys.stderr
+                )
+                cache = diff_cache()
+                if cache is not None:
+                    print(f"diff cache: {cache.stats()}", file=sys.stderr)
+            stop.wait(delay)
+            delay = min(delay * 2, FOLLOW_MAX_INTERVAL)
+    finally:
+        if files is not None:
+            files.close()
+    return next_sequence
+
+
+def run_osc_files(paths):
+    """Convert local osmChange files and write the rows out, without any etag."""
+    stdout = sys.stdout
+    sys.stdout = buffered_stdout()
+    try:
+        write_diffs(OsmChangeFile(path) for path in osc_paths(paths))
+        save_state()
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        sys.stdout.flush()
+        sys.stdout = stdout
 
-    if VERBOSE:
-        print(f"max changeset id: {max_changeset_id}")
-        print(f"sequence number: {sequence_number}")
-        print(f"etag output path: {etag_output_path}")
-    with open(etag_output_path, "w") as fh:
-        fh.write(str(sequence_number + 1))
 
+class OsmChangeFile:
+    """A local osmChange file (.osc, or gzip-compressed .osc.gz).
 
-def process_diff_data(adiff):
-    """Process OSM diff data and extract rows for each entity type."""
-    global max_changeset_id
+    Iterating yields (action, entity) pairs like iter_entities, parsing the file
+    incrementally: each element is cleared as soon as its entity has been
+    processed, so memory stays flat however large the file is. Every iteration
+    reads the file again.
+    """
+
+    ACTIONS = ("create", "modify", "delete")
+    ENTITIES = ("node", "way", "relation")
+
+    def __init__(self, path):
+        self.path = path
+
+    def open(self):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, "rb")
+        return open(self.path, "rb")
+
+    def __iter__(self):
+        with self.open() as fh:
+            action_elem = None
+            depth = 0
+            for event, elem in ElementTree.iterparse(fh, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if depth == 2 and elem.tag in self.ACTIONS:
+                        action_elem = elem
+                    continue
+                depth -= 1
+                if depth == 2 and action_elem is not None and elem.tag in self.ENTITIES:
+                    yield action_elem.tag, OSMObject.from_xml(elem)
+                    # Drop the processed entity from the tree
+                    action_elem.clear()
+                elif depth == 1:
+                    action_elem = None
+                    elem.clear()
+
+
+class AugmentedDiffStream:
+    """An augmented diff that is parsed while its HTTP response downloads.
+
+    The request is sent on construction, so status is known right away. Iterating
+    yields (action, entity) pairs like iter_entities, reading the response body
+    incrementally and clearing each <action> element as soon as its entity has been
+    processed: no more than one action is held in memory, and the first rows are
+    written before the rest of the diff has arrived. The body can only be read once.
+
+    With a cache (a diffcache.DiffCache), a body cached under cache_key is read
+    from disk without any request, and a downloaded body is added to the cache
+    once it has been read completely.
+
+    download() reads the whole body ahead of parsing instead, into a temporary
+    file that stays in memory up to SPOOL_SIZE bytes; the prefetch workers do
+    this, so that the body downloads while an earlier diff is being converted.
+
+    For the metrics, request_seconds is the time until the response headers,
+    read_seconds the time spent waiting for the body, parse_seconds the time spent
+    parsing it and bytes_downloaded the size of the body as sent.
+    """
+
+    CHUNK_SIZE = 1 << 16
+    SPOOL_SIZE = 1 << 24
+
+    def __init__(
+        self, url, sequence_number=None, session=None, cache=None, cache_key=None
+    ):
+        self.url = url
+        self.sequence_number = sequence_number
+        self.cache = cache
+        self.cache_key = cache_key
+        self.response = None
+        self.request_seconds = self.read_seconds = self.parse_seconds = 0.0
+        self.bytes_downloaded = 0
+        self.body = cache.open(cache_key) if cache is not None else None
+        if self.body is not None:
+            self.status = 200
+            return
+        start = time.perf_counter()
+        self.response = self.request(session or http_session())
+        self.request_seconds = time.perf_counter() - start
+        self.status = self.response.status_code
+        if self.status != 200:
+            self.close()
+            return
+        self.body = self.response.raw
+        self.body.decode_content = True
+
+    def request(self, session):
+        # At least one attempt, whatever FETCH_RETRIES says
+        attempts = max(FETCH_RETRIES, 1)
+        for attempt in range(1, attempts):
+            try:
+                return session.get(self.url, stream=True, timeout=FETCH_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout):
+                time.sleep(2**attempt)
+        return session.get(self.url, stream=True, timeout=FETCH_TIMEOUT)
 
-    nodes_rows = []
-    ways_rows = []
-    relations_rows = []
-    members_rows = []
-    tags_rows = []
+    def download(self):
+        """Read the rest of the response body now, to be parsed from a temporary file.
 
+        The response is closed afterwards and the body cached. Does nothing for a
+        diff read from the cache or not published.
+        """
+        body = self.body
+        if self.response is None or body is None:
+            return
+        spool = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE)
+        store = None
+        if self.cache is not None:
+            store = self.cache.writer(self.cache_key)
+        start = time.perf_counter()
+        try:
+            while True:
+                data = body.read1(self.CHUNK_SIZE)
+                if not data:
+                    break
+                spool.write(data)
+                if store is not None:
+                    store.write(data)
+            if store is not None:
+                store.commit()
+                store = None
+            self.bytes_downloaded = body.tell()
+        except BaseException:
+            spool.close()
+            raise
+        finally:
+            if store is not None:
+                store.abort()
+            self.read_seconds += time.perf_counter() - start
+            self.close()
+        spool.seek(0)
+        self.body = spool
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+    def __iter__(self):
+        if self.body is None:
+            raise RuntimeError(f"augmented diff {self.url} has already been read")
+        body = self.body
+        store = None
+        if self.cache is not None and self.response is not None:
+            store = self.cache.writer(self.cache_key)
+        parser = ElementTree.XMLPullParser(events=("start", "end"))
+        root = None
+        depth = 0
+        clock = time.perf_counter
+        try:
+            while True:
+                start = clock()
+                # read1 returns whatever has arrived instead of waiting for a full chunk
+                data = body.read1(self.CHUNK_SIZE)
+                if store is not None:
+                    store.write(data)
+                self.read_seconds += clock() - start
+                start = clock()
+                if data:
+                    parser.feed(data)
+                else:
+                    parser.close()
+                # Only start and end events are asked for, each with its element
+                events = cast(
+                    Iterator[tuple[str, ElementTree.Element]], parser.read_events()
+                )
+                for event, elem in events:
+                    if event == "start":
+                        depth += 1
+                        if root is None:
+                            root = elem
+                        continue
+                    depth -= 1
+                    if depth == 1 and root is not None and elem.tag == "action":
+                        change = self.action_entity(elem)
+                        if change is not None:
+                            self.parse_seconds += clock() - start
+                            yield change
+                            start = clock()
+                        # Drop the processed action (and anything before it) from the tree
+                        root.clear()
+                self.parse_seconds += clock() - start
+                if not data:
+                    break
+            if store is not None:
+                # Only a body that was read and parsed completely is cached
+                store.commit()
+                store = None
+        finally:
+            if store is not None:
+                store.abort()
+            if self.response is not None:
+                self.bytes_downloaded = body.tell()
+            self.close()
+
+    @staticmethod
+    def action_entity(elem):
+        """Return the (action, entity) of an <action> element, as iter_entities does."""
+        action = elem.get("type")
+        if action == "create":
+            version = elem
+        elif action == "modify":
+            version = elem.find("new")
+        elif action == "delete":
+            version = elem.find("new")
+            old = elem.find("old")
+            if version is None or not len(version):
+                version = old
+            elif old is not None and len(old):
+                entity = OSMObject.from_xml(version[0])
+                return action, inherit_location(entity, OSMObject.from_xml(old[0]))
+        else:
+            return None
+        if version is None or not len(version):
+            return None
+        return action, OSMObject.from_xml(version[0])
+
+
+def iter_entities(adiff):
+    """Yield (action, entity) for every change in a diff, one at a time.
+
+    action is "create", "modify" or "delete". A modified entity is yielded in its
+    new version. A deleted entity is yielded in the version that deleted it when the
+    diff has one (with the version, changeset and user of the deletion), otherwise
+    in its last version.
+    """
+    if isinstance(adiff, (OsmChangeFile, AugmentedDiffStream)):
+        yield from adiff
+        return
     for o in adiff.create:
+        yield "create", o
+    for change in adiff.modify:
+        yield "modify", change["new"]
+    for change in adiff.delete:
+        if change["new"] is None:
+            yield "delete", change["old"]
+        else:
+            yield "delete", inherit_location(change["new"], change["old"])
+
+
+def entity_bounds(entity):
+    """Return the (minlon, minlat, maxlon, maxlat) of an entity as floats.
+
+    Nodes have their coordinates, ways and relations the bounds given by the
+    augmented diff. Returns None when the diff has no location for the entity.
+    """
+    get = entity.attribs.get
+    lon = get("lon")
+    lat = get("lat")
+    if lon is not None and lat is not None:
+        lon = float(lon)
+        lat = float(lat)
+        return lon, lat, lon, lat
+    if entity.bounds:
+        return tuple(float(value) for value in entity.bounds)
+    return None
+
+
+def inherit_location(entity, old):
+    """Give a deleted entity the location of its last version when it has none.
+
+    The version of a deletion carries no coordinates or bounds, so it could not
+    be placed otherwise. The location only goes into the bounds attribute, which
+    no row is built from.
+    """
+    if old is not None and entity_bounds(entity) is None:
+        entity.bounds = entity_bounds(old)
+    return entity
+
+
+def process_diff_data(adiff, sinks=None, route=None, services=None):
+    """Process OSM diff data and extract rows for each entity type.
+
+    sinks maps output names (see output_types) to row sinks, which can be lists or
+    anything else with append and extend methods such as CsvRowWriter. Rows of an
+    output without a sink are not built at all. Created and modified entities go
+    to the nodes, ways, relations, members and tags outputs; deleted entities only
+    to deletions. Every entity, whatever its action, is also rolled up into the
+    changesets output, which gets one row per changeset once the diff is
+    converted (see changesets). Returns the sinks.
+
+    route, when given, filters the (action, entity) pairs of the diff before
+    their rows are built, as regions.RegionOutputFiles.route does. services are
+    the Services to convert with, by default those of the current settings
+    (diff_services).
+
+    With VERSION_INDEX set, entities whose version is not newer than the one
+    last written out (see versionindex) get no rows at all.
+    With NODE_LOCATIONS set, the location of every node is recorded (see
+    nodestore), and ways without coordinates get their geometry from it.
+    With FILTER set, entities the filter does not match (see filters) get no
+    rows, and are neither rolled up into changesets nor recorded in the version
+    index. Deleted entities are only
+    filtered by their type, since the version that deletes them has no tags.
+
+    Without sinks, the rows of every output are collected into new lists and
+    returned as a (nodes, ways, relations, members, tags) tuple.
+    """
+    global max_changeset_id
+
+    if sinks is None:
+        lists = {name: [] for name in ("nodes", "ways", "relations", "members", "tags")}
+        process_diff_data(adiff, lists, services=services)
+        return (
+            lists["nodes"],
+            lists["ways"],
+            lists["relations"],
+            lists["members"],
+            lists["tags"],
+        )
+
+    nodes_rows = sinks.get("nodes")
+    ways_rows = sinks.get("ways")
+    relations_rows = sinks.get("relations")
+    members_rows = sinks.get("members")
+    tags_rows = sinks.get("tags")
+    deletions_rows = sinks.get("deletions")
+    changesets_rows = sinks.get("changesets")
+    rollup = None
+    if changesets_rows is not None:
+        rollup = changesets.ChangesetRollup(changesets_rows)
+    if services is None:
+        services = diff_services()
+    key_ids = services.tag_keys if tags_rows is not None else None
+    versions = services.versions
+    locations = services.locations
+    keep = services.keep
+    encoder = services.encoder
+    _epoch_millis_memo.clear()
+    relation_sinks = relations_rows is not None or members_rows is not None
+
+    changes = iter_entities(adiff)
+    if route is not None:
+        changes = route(changes)
+    for action, o in changes:
+        get = o.attribs.get
         # Update max changeset ID
-        max_changeset_id = max(max_changeset_id, int(o.attribs.get("changeset", 0)))
+        max_changeset_id = max(max_changeset_id, int(get("changeset", 0)))
+
+        # Skip versions already written out by an earlier run
+        if versions is not None:
+            if not versions.is_newer(entity_type(o), get("id"), get("version")):
+                continue
+
+        # Locations are recorded for every node, tagged or not, since the ways
+        # that are kept need them
+        if locations is not None and action != "delete" and isinstance(o, osmdiff.Node):
+            locations.update(o)
+
+        if keep is not None and not keep.matches(
+            entity_type(o), o.tags if action != "delete" else None
+        ):
+            keep.rejected += 1
+            continue
+
+        # Only versions that get rows are recorded as written out
+        if versions is not None:
+            versions.record(entity_type(o), get("id"), get("version"), get("changeset"))
+
+        if rollup is not None:
+            changeset = get("changeset")
+            if changeset is not None:
+                rollup.add(
+                    action,
+                    entity_type(o),
+                    int(changeset),
+                    get("uid"),
+                    get("user"),
+                    to_epoch_millis(get("timestamp")),
+                    entity_bounds(o),
+                )
+
+        if action == "delete":
+            if deletions_rows is not None:
+                process_deletion(o, deletions_rows)
+            continue
 
         # Process by entity type
         if isinstance(o, osmdiff.Node):
-            process_node(o, nodes_rows)
+            osm_type = "node"
+            if nodes_rows is not None:
+                process_node(o, nodes_rows)
         elif isinstance(o, osmdiff.Way):
-            process_way(o, ways_rows)
+            osm_type = "way"
+            if ways_rows is not None:
+                process_way(o, ways_rows, encoder)
         elif isinstance(o, osmdiff.Relation):
-            process_relation(o, relations_rows, members_rows)
+            osm_type = "relation"
+            if relation_sinks:
+                process_relation(o, relations_rows, members_rows, encoder)
+        else:
+            osm_type = "node"
 
         # Process tags for all entity types
-        process_tags(o, tags_rows)
+        if tags_rows is not None:
+            process_tags(o, tags_rows, osm_type, key_ids)
+
+    if rollup is not None:
+        rollup.write()
+    return sinks
+
 
-    return nodes_rows, ways_rows, relations_rows, members_rows, tags_rows
+def entity_type(entity):
+    """Return the OSM type name ("node", "way" or "relation") of an entity."""
+    if isinstance(entity, osmdiff.Way):
+        return "way"
+    if isinstance(entity, osmdiff.Relation):
+        return "relation"
+    return "node"
 
 
 def process_node(node, nodes_rows):
-    """Process a single node and add it to nodes_rows."""
-    row = {
-        "epochMillis": to_epoch_millis(node.attribs.get("timestamp")),
-        "id": node.attribs.get("id"),
-        "version": node.attribs.get("version"),
-        "changeset": node.attribs.get("changeset"),
-        "username": node.attribs.get("user"),
-        "uid": node.attribs.get("uid"),
-        "lat": node.attribs.get("lat"),
-        "lon": node.attribs.get("lon"),
-    }
-    nodes_rows.append(row)
-
-
-def process_way(way, ways_rows):
-    """Process a single way and add it to ways_rows."""
-    row = {
-        "epochMillis": to_epoch_millis(way.attribs.get("timestamp")),
-        "id": way.attribs.get("id"),
-        "version": way.attribs.get("version"),
-        "changeset": way.attribs.get("changeset"),
-        "username": way.attribs.get("user"),
-        "uid": way.attribs.get("uid"),
-        "geometry": way.attribs.get("geometry"),
-    }
-    ways_rows.append(row)
-
-
-def process_relation(relation, relations_rows, members_rows):
-    """Process a single relation and add it to relations_rows and its members to members_rows."""
-    row = {
-        "epochMillis": to_epoch_millis(relation.attribs.get("timestamp")),
-        "id": relation.attribs.get("id"),
-        "version": relation.attribs.get("version"),
-        "changeset": relation.attribs.get("changeset"),
-        "username": relation.attribs.get("user"),
-        "uid": relation.attribs.get("uid"),
-        "geometry": relation.attribs.get("geometry"),
-    }
-    relations_rows.append(row)
+    """Process a single node and add it to nodes_rows as a NodeRow tuple."""
+    get = node.attribs.get
+    nodes_rows.append(
+        (
+            to_epoch_millis(get("timestamp")),
+            get("id"),
+            get("version"),
+            get("changeset"),
+            get("user"),
+            get("uid"),
+            get("lat"),
+            get("lon"),
+        )
+    )
+
+
+def process_way(way, ways_rows, encoder=None):
+    """Process a single way and add it to ways_rows as a WayRow tuple.
+
+    The geometry columns are those of encoder, by default geometry_encoder().
+    """
+    get = way.attribs.get
+    ways_rows.append(
+        (
+            to_epoch_millis(get("timestamp")),
+            get("id"),
+            get("version"),
+            get("changeset"),
+            get("user"),
+            get("uid"),
+            *(encoder or geometry_encoder()).way(way),
+        )
+    )
+
+
+def process_relation(relation, relations_rows, members_rows, encoder=None):
+    """Process a single relation and add it to relations_rows and its members to members_rows.
+
+    Rows are RelationRow and MemberRow tuples. Either sink may be None to
+    skip that output. The geometry columns are those of encoder, by default
+    geometry_encoder().
+    """
+    get = relation.attribs.get
+    relation_id = get("id")
+    if relations_rows is not None:
+        relations_rows.append(
+            (
+                to_epoch_millis(get("timestamp")),
+                relation_id,
+                get("version"),
+                get("changeset"),
+                get("user"),
+                get("uid"),
+                *(encoder or geometry_encoder()).relation(relation),
+            )
+        )
+
+    if members_rows is None:
+        return
 
     # Process relation members
-    for m in getattr(relation, "members", []):
-        members_rows.append(
-            {
-                "relationId": relation.attribs.get("id"),
-                "memberId": m.attribs.get("ref"),
-                "memberRole": m.attribs.get("role"),
-                "memberType": m.attribs.get("type"),
-            }
+    members_rows.extend(
+        (
+            relation_id,
+            m.attribs.get("ref"),
+            m.attribs.get("role"),
+            m.attribs.get("type"),
         )
+        for m in getattr(relation, "members", [])
+    )
 
 
-def process_tags(entity, tags_rows):
-    """Process tags for an entity and add them to tags_rows."""
-    for k, v in entity.attribs.items():
-        if k == "id":
-            continue
+def process_deletion(entity, deletions_rows):
+    """Process a deleted entity and add it to deletions_rows as a DeletionRow tuple."""
+    get = entity.attribs.get
+    deletions_rows.append(
+        (
+            to_epoch_millis(get("timestamp")),
+            entity_type(entity),
+            get("id"),
+            get("version"),
+            get("changeset"),
+            get("user"),
+            get("uid"),
+        )
+    )
 
-        osm_type = "node"
-        if isinstance(entity, osmdiff.Way):
-            osm_type = "way"
-        elif isinstance(entity, osmdiff.Relation):
-            osm_type = "relation"
 
-        tags_rows.append(
-            {
-                "epochMillis": to_epoch_millis(entity.attribs.get("timestamp")),
-                "type": osm_type,
-                "id": entity.attribs.get("id"),
-                "key": k,
-                "value": v,
-            }
+def process_tags(entity, tags_rows, osm_type=None, key_ids=None):
+    """Process the tags of an entity and add them to tags_rows as TagRow tuples.
+
+    The timestamp, type and id are resolved once per entity and all of its rows
+    are added in one batch. osm_type is the entity_type of the entity, when the
+    caller already knows it. With key_ids, a tagkeys.TagKeyDictionary, the rows
+    are KeyedTagRow tuples, with the id of each key in place of the key.
+    """
+    tags = entity.tags
+    if not tags:
+        return
+    get = entity.attribs.get
+    epoch_millis = to_epoch_millis(get("timestamp"))
+    osm_id = get("id")
+    if osm_type is None:
+        osm_type = entity_type(entity)
+    if key_ids is None:
+        tags_rows.extend(
+            [
+                (epoch_millis, osm_type, osm_id, key, value)
+                for key, value in tags.items()
+            ]
         )
+        return
+    ids = key_ids.ids
+    key_id = key_ids.key_id
+    tags_rows.extend(
+        [
+            (epoch_millis, osm_type, osm_id, ids.get(key) or key_id(key), value)
+            for key, value in tags.items()
+        ]
+    )
+
 
+def output_csv_data(
+    nodes_rows, ways_rows, relations_rows, members_rows, tags_rows, header=True
+):
+    """Output CSV data for all OSM entity types.
 
-def output_csv_data(nodes_rows, ways_rows, relations_rows, members_rows, tags_rows):
-    """Output CSV data for all OSM entity types."""
+    The header row of each type is only written when header is True, so that the
+    rows of consecutive diffs in a catch-up batch form one CSV stream per type.
+    """
     if VERBOSE:
-        print("\n--- nodes.csv ---")
+        print("\n--- nodes.csv ---", file=sys.stderr)
 
     if NODES:
-        node_fields = [
-            "epochMillis",
-            "id",
-            "version",
-            "changeset",
-            "username",
-            "uid",
-            "lat",
-            "lon",
-        ]
-        write_csv_stdout(nodes_rows, node_fields)
+        write_csv_stdout(nodes_rows, NODE_FIELDS, header)
 
     if WAYS:
-        way_fields = [
-            "epochMillis",
-            "id",
-            "version",
-            "changeset",
-            "username",
-            "uid",
-            "geometry",
-        ]
-        write_csv_stdout(ways_rows, way_fields)
+        write_csv_stdout(ways_rows, way_fields(), header)
 
     if RELATIONS:
-        relation_fields = [
-            "epochMillis",
-            "id",
-            "version",
-            "changeset",
-            "username",
-            "uid",
-            "geometry",
-        ]
-        write_csv_stdout(relations_rows, relation_fields)
+        write_csv_stdout(relations_rows, way_fields(), header)
 
     if MEMBERS:
-        members_fields = ["relationId", "memberId", "memberRole", "memberType"]
-        write_csv_stdout(members_rows, members_fields)
+        write_csv_stdout(members_rows, MEMBER_FIELDS, header)
 
     if TAGS:
-        tags_fields = ["epochMillis", "type", "id", "key", "value"]
-        write_csv_stdout(tags_rows, tags_fields)
+        write_csv_stdout(tags_rows, tag_fields(), header)
 
 
-def log_processing_results(
-    nodes_rows, ways_rows, relations_rows, members_rows, tags_rows
-):
-    """Log processing results if in verbose mode."""
+def output_types():
+    """Return (name, enabled, fieldnames) for each output type, in output order."""
+    return (
+        ("nodes", NODES, NODE_FIELDS),
+        ("ways", WAYS, way_fields()),
+        ("relations", RELATIONS, way_fields()),
+        ("members", MEMBERS, MEMBER_FIELDS),
+        ("tags", TAGS, tag_fields()),
+        ("deletions", DELETIONS, DELETION_FIELDS),
+        ("changesets", CHANGESETS, CHANGESET_FIELDS),
+    )
+
+
+def way_fields():
+    """Return the columns of the ways and relations outputs, which end with those of
+    the GEOMETRY_FORMAT."""
+    return WAY_FIELDS[:-1] + geometry.fields(GEOMETRY_FORMAT)
+
+
+def tag_fields():
+    """Return the columns of the tags output, which has key ids with TAG_KEY_DICTIONARY."""
+    return KEYED_TAG_FIELDS if TAG_KEY_DICTIONARY else TAG_FIELDS
+
+
+class OutputFiles:
+    """One CSV file per output type in a directory, written in a single pass.
+
+    The file of each enabled type (all types if none is enabled) is
+    <directory>/<type>.csv, e.g. nodes.csv, and starts with its own header. An
+    existing named pipe at that path is written to as is, so another process can
+    read the output while it is produced. sinks maps the names of the types
+    written to their CsvRowWriter, ready to pass to process_diff_data.
+
+    filename is formatted with the type name and ext, the extension of the
+    OUTPUT_COMPRESSION, to name each file. With append set, existing files are
+    appended to, and only empty ones get a header. Compressed files are written
+    in frames (see framing), and paths then also has the index of every file,
+    under "<type>.idx".
+    """
+
+    def __init__(self, directory, filename="{name}.csv{ext}", append=False):
+        os.makedirs(directory, exist_ok=True)
+        types = output_types()
+        write_all = not any(enabled for _, enabled, _ in types)
+        ext = ""
+        if OUTPUT_COMPRESSION:
+            framing.require_codec(OUTPUT_COMPRESSION)
+            ext = framing.CODECS[OUTPUT_COMPRESSION]
+        self.paths = {}
+        self.streams = []
+        self.sinks = {}
+        self.frames = {}
+        try:
+            for name, enabled, fieldnames in types:
+                if not (enabled or write_all):
+                    continue
+                path = os.path.join(directory, filename.format(name=name, ext=ext))
+                index_path = None
+                if OUTPUT_COMPRESSION:
+                    index_path = os.path.join(
+                        directory,
+                        filename.format(name=name, ext=ext + framing.INDEX_SUFFIX),
+                    )
+                    self.paths[name + framing.INDEX_SUFFIX] = index_path
+                stream = open_text_output(
+                    path, "a" if append else "w", OUTPUT_COMPRESSION, index_path
+                )
+                self.paths[name] = path
+                self.streams.append(stream)
+                header = not append or os.path.getsize(path) == 0
+                self.sinks[name] = CsvRowWriter(stream, fieldnames, header)
+                if OUTPUT_COMPRESSION:
+                    self.frames[name] = (stream, 0)
+            # The header rows are frames of their own
+            self.end_frame()
+        except BaseException:
+            self.close()
+            raise
+
+    def end_frame(self, sequence_number=None):
+        """End the frame of every compressed file, indexed under sequence_number.
+
+        The frames hold the rows added since the last one. Does nothing without
+        OUTPUT_COMPRESSION.
+        """
+        for name, (stream, rows_before) in self.frames.items():
+            stream.flush()
+            rows = len(self.sinks[name])
+            stream.buffer.raw.end_frame(sequence_number, rows - rows_before)
+            self.frames[name] = (stream, rows)
+
+    def flush(self, sequence_number=None):
+        """Write out the rows added so far, ending a frame of sequence_number first."""
+        self.end_frame(sequence_number)
+        for stream in self.streams:
+            stream.flush()
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
+        self.streams = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StdoutSections:
+    """The CSV sections of the enabled types on stdout, one after the other.
+
+    Like OutputFiles for stdout: sinks maps the name of every enabled type to its
+    CsvRowWriter. To keep one contiguous section per type however many diffs are
+    written, the first enabled type is written to stdout directly and the others
+    to temporary files (in memory up to OUTPUT_BUFFER_SIZE bytes each) that are
+    copied after it on close. With header set, each section starts with its
+    header, even if no rows are written.
+    """
+
+    def __init__(self, header=True):
+        self.sinks = {}
+        self.spools = []
+        try:
+            for name, enabled, fieldnames in output_types():
+                if not enabled:
+                    continue
+                stream = sys.stdout
+                if self.sinks:
+                    stream = tempfile.SpooledTemporaryFile(
+                        max_size=OUTPUT_BUFFER_SIZE,
+                        mode="w+",
+                        encoding="utf-8",
+                        newline="",
+                    )
+                    self.spools.append(stream)
+                self.sinks[name] = CsvRowWriter(stream, fieldnames, header)
+        except BaseException:
+            self.discard()
+            raise
+
+    def close(self):
+        """Copy the sections after the first to stdout."""
+        try:
+            for spool in self.spools:
+                spool.seek(0)
+                shutil.copyfileobj(spool, sys.stdout)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Drop the sections after the first without writing them."""
+        for spool in self.spools:
+            spool.close()
+        self.spools = []
+
+
+def open_output_files(directory):
+    """Open the files of the output types in directory, in OUTPUT_FORMAT.
+
+    With REGIONS, the files of every region are opened in <directory>/<region>,
+    behind a regions.RegionOutputFiles.
+    """
+    if REGIONS:
+        return regions.RegionOutputFiles(
+            regions.load_regions(REGIONS),
+            lambda name: open_format_files(os.path.join(directory, name)),
+            entity_bounds,
+            REGION_GRID_DEGREES,
+        )
+    return open_format_files(directory)
+
+
+def open_format_files(directory):
+    if OUTPUT_FORMAT == "csv":
+        return OutputFiles(directory)
+    if OUTPUT_COMPRESSION:
+        raise ValueError(
+            f"OUTPUT_FORMAT={OUTPUT_FORMAT} does not support OUTPUT_COMPRESSION"
+        )
+    return columnar.ColumnarOutputFiles(directory, output_types(), OUTPUT_FORMAT)
+
+
+class RotatingOutputFiles:
+    """OutputFiles that start over every `sequences` sequence numbers.
+
+    The rows of the sequence numbers first..first + sequences - 1, where first is a
+    multiple of sequences, are appended to <directory>/<type>-<first>.csv.part.
+    When a diff from a later window arrives, the files of the window are closed
+    and renamed to <type>-<first>.csv, so a .csv file is complete and no longer
+    changes. Files of a window left unfinished by an earlier run are appended to,
+    and those of earlier windows, which that run never got to rotate, are renamed
+    when a window is opened. Compressed files and their indexes are renamed the
+    same way.
+    """
+
+    PART_FILE = re.compile(r"(?P<name>\w+)-(?P<first>\d+)\.csv[.\w]*\.part")
+
+    def __init__(self, directory, sequences):
+        self.directory = directory
+        self.sequences = max(sequences, 1)
+        self.first = None
+        self.files = None
+
+    def sinks(self, sequence_number):
+        """Return the sinks for the rows of sequence_number, rotating first if needed."""
+        first = sequence_number - sequence_number % self.sequences
+        if self.files is not None and first != self.first:
+            self.rotate()
+        if self.files is None:
+            self.first = first
+            self.finish_earlier(first)
+            self.files = OutputFiles(
+                self.directory, f"{{name}}-{first}.csv{{ext}}.part", append=True
+            )
+        return self.files.sinks
+
+    def rotate(self):
+        """Close the files of the current window and give them their final names."""
+        if self.files is None:
+            return
+        self.files.close()
+        for path in self.files.paths.values():
+            os.replace(path, path[: -len(".part")])
+        self.files = None
+
+    def finish_earlier(self, first):
+        """Give the .part files of the windows before first their final names."""
+        if not os.path.isdir(self.directory):
+            return
+        names = {name for name, _, _ in output_types()}
+        for filename in os.listdir(self.directory):
+            match = self.PART_FILE.fullmatch(filename)
+            if match and match["name"] in names and int(match["first"]) < first:
+                path = os.path.join(self.directory, filename)
+                os.replace(path, path[: -len(".part")])
+
+    def flush(self, sequence_number=None):
+        if self.files is not None:
+            self.files.flush(sequence_number)
+
+    def close(self):
+        """Close the files of the current window, which stay partial."""
+        if self.files is not None:
+            self.files.close()
+            self.files = None
+
+
+def stream_csv_data(adiff, header=True, route=None, services=None):
+    """Convert a diff and write the rows of every enabled type to stdout as they are built.
+
+    No row lists are kept: each converted row goes straight to a CsvRowWriter. The
+    diff is walked once, since a streamed diff cannot be read twice. The rows are
+    laid out in one contiguous CSV section per type, as output_csv_data does, by
+    a StdoutSections.
+
+    route and services are passed on to process_diff_data. Returns a dictionary
+    of the writers of the enabled types, keyed by type name.
+    """
+    if VERBOSE:
+        print("\n--- nodes.csv ---", file=sys.stderr)
+
+    sections = StdoutSections(header)
+    try:
+        process_diff_data(adiff, sections.sinks, route, services)
+    except BaseException:
+        sections.discard()
+        raise
+    sections.close()
+    return sections.sinks
+
+
+def log_processing_results(sinks, prefix=""):
+    """Log the number of rows written to each sink if in verbose mode."""
     if not VERBOSE:
         return
 
-    print("Processing complete")
-    if NODES:
-        print(f"Processed {len(nodes_rows)} nodes")
-    if WAYS:
-        print(f"Processed {len(ways_rows)} ways")
-    if RELATIONS:
-        print(f"Processed {len(relations_rows)} relations")
-    if MEMBERS:
-        print(f"Processed {len(members_rows)} members")
-    if TAGS:
-        print(f"Processed {len(tags_rows)} tags")
+    print(f"{prefix}Processing complete", file=sys.stderr)
+    for name, rows in sinks.items():
+        print(f"{prefix}Processed {len(rows)} {name}", file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+"""On-disk cache of downloaded augmented diffs for consumer.py.
+
+Every diff body is stored gzip-compressed as <directory>/<key>.xml.gz, where the
+key is made of the sequence number and the bounding box it was requested for.
+The cache holds at most max_bytes of compressed data; the least recently used
+diffs are removed first to make room. It can be shared by the threads of one
+process, and by several processes, since files are only ever created by renaming
+a complete temporary file and a cached diff that disappears is simply a miss.
+"""
+
+import gzip
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+SUFFIX = ".xml.gz"
+
+
+def cache_key(sequence_number, bbox):
+    """Return the cache key of a diff: its sequence number and (minlon, minlat, maxlon, maxlat)."""
+    return "_".join([str(sequence_number)] + [f"{value:g}" for value in bbox])
+
+
+class DiffCache:
+    """A size-capped LRU cache of diff bodies in a directory."""
+
+    def __init__(self, directory, max_bytes):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Least recently used first, as left by earlier runs
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith(SUFFIX):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, name[: -len(SUFFIX)], stat.st_size))
+        self.sizes = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.total = sum(self.sizes.values())
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def open(self, key):
+        """Return the cached body of key as a binary file, or None on a miss."""
+        path = self.path(key)
+        try:
+            body = gzip.open(path, "rb")
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+                self.total -= self.sizes.pop(key, 0)
+            return None
+        with self.lock:
+            self.hits += 1
+            if key in self.sizes:
+                self.sizes.move_to_end(key)
+        return body
+
+    def writer(self, key):
+        """Return a CacheWriter that stores the body of key once it is committed."""
+        return CacheWriter(self, key)
+
+    def add(self, key, temp_path):
+        """Move a complete compressed body into the cache and evict what no longer fits."""
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, self.path(key))
+        with self.lock:
+            self.total += size - self.sizes.pop(key, 0)
+            self.sizes[key] = size
+            while self.total > self.max_bytes and self.sizes:
+                evicted, evicted_size = self.sizes.popitem(last=False)
+                self.total -= evicted_size
+                self.evictions += 1
+                try:
+                    os.unlink(self.path(evicted))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        return (
+            f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+            f"{len(self.sizes)} diffs ({self.total / 2**20:.1f} MiB)"
+        )
+
+
+class CacheWriter:
+    """Compresses a diff body to a temporary file while it is downloaded.
+
+    commit() adds the body to the cache; abort() (or a commit that never happens)
+    leaves the cache as it was, so an interrupted download is never served.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        fd, self.temp_path = tempfile.mkstemp(
+            dir=cache.directory, prefix=".", suffix=".tmp"
+        )
+        self.raw = os.fdopen(fd, "wb")
+        self.file = gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=6)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close_file(self):
+        # GzipFile does not close a file object it was given
+        self.file.close()
+        self.raw.close()
+
+    def commit(self):
+        self.close_file()
+        self.cache.add(self.key, self.temp_path)
+
+    def abort(self):
+        self.close_file()
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,101 @@
+"""Entity filters, applied by consumer.py before any row of an entity is built.
+
+A filter is a list of expressions, separated by spaces. An entity is kept when
+any of them matches it:
+
+    highway                   has a highway tag, whatever its value
+    building=yes              has building=yes
+    amenity=cafe,restaurant   has amenity=cafe or amenity=restaurant
+    w/landuse=forest          a way with landuse=forest
+    nw/name                   a node or way with a name tag
+    r/                        any relation
+
+The types of an expression are any of n (node), w (way) and r (relation)
+before a slash; without them it matches all three. Values with spaces are
+quoted as in a shell (name="Main Street"); values cannot contain commas.
+
+EntityFilter compiles the expressions once into a rule per entity type (a
+list of (key, values) to check, or True for every entity of that type), so
+testing an entity takes a few dictionary lookups.
+"""
+
+import shlex
+
+TYPE_LETTERS = {"n": "node", "w": "way", "r": "relation"}
+TYPES = tuple(TYPE_LETTERS.values())
+
+
+def parse(expression):
+    """Return the (types, key, values) of every part of a filter expression.
+
+    key is None for a part that matches every entity of its types, and values
+    is None for one that matches every value of key.
+    """
+    parts = []
+    for text in shlex.split(expression):
+        types = None
+        if "/" in text:
+            letters, text = text.split("/", 1)
+            if not letters or any(letter not in TYPE_LETTERS for letter in letters):
+                raise ValueError(f"invalid entity types {letters!r} in filter")
+            types = tuple(TYPE_LETTERS[letter] for letter in letters)
+        key, equals, values = text.partition("=")
+        if not key and (equals or types is None):
+            raise ValueError(f"missing tag key in filter {text!r}")
+        if equals and not values:
+            raise ValueError(f"missing value of {key!r} in filter")
+        parts.append(
+            (
+                types or TYPES,
+                key or None,
+                frozenset(values.split(",")) if equals else None,
+            )
+        )
+    if not parts:
+        raise ValueError("empty filter")
+    return parts
+
+
+class EntityFilter:
+    """A compiled filter expression; matches(osm_type, tags) tests an entity."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        rules = {osm_type: {} for osm_type in TYPES}
+        # Types that match whatever their tags, which makes their rule True
+        any_tags = set()
+        for types, key, values in parse(expression):
+            for osm_type in types:
+                rule = rules[osm_type]
+                if key is None:
+                    any_tags.add(osm_type)
+                elif values is None or rule.get(key, ()) is None:
+                    rule[key] = None
+                else:
+                    rule[key] = rule.get(key, frozenset()) | values
+        # Each rule as a tuple of (key, values), or True or False
+        self.rules = {
+            osm_type: osm_type in any_tags or tuple(rule.items()) or False
+            for osm_type, rule in rules.items()
+        }
+        self.rejected = 0
+
+    def matches(self, osm_type, tags):
+        """Return whether an entity of osm_type with tags (a dict) is kept.
+
+        With tags None, for an entity whose tags are not known, every entity of
+        a type that any expression is about is kept.
+        """
+        rule = self.rules[osm_type]
+        if rule is True or rule is False:
+            return rule
+        if tags is None:
+            return True
+        if not tags:
+            return False
+        get = tags.get
+        for key, values in rule:
+            value = get(key)
+            if value is not None and (values is None or value in values):
+                return True
+        return False
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Compressed CSV output files of independently decompressible frames, one per diff.
+
+With OUTPUT_COMPRESSION set to "gzip" or "zstd", every file in OUTPUT_DIR is
+compressed (nodes.csv.gz, tags.csv.zst, ...). The rows of each diff are
+compressed on their own as a complete gzip member or zstd frame, and the
+frames follow each other in the file. Concatenated members and frames are a
+valid file in both formats, so zcat, zstdcat or any reader of the whole file
+sees one CSV file. Next to each file, a sidecar index (nodes.csv.gz.idx) has a
+row per frame:
+
+    sequence,offset,length,rows
+
+with the sequence number of the diff, the offset and length of the frame in
+bytes and the number of rows in it. The header row of the CSV file has a frame
+of its own, with an empty sequence and no rows. A reader can seek to the frames
+of a range of sequence numbers and decompress only those (read_range). The
+sequence of the frames of osmChange files is empty too.
+
+zstd needs the zstandard package, which is not installed by requirements.txt.
+"""
+
+import argparse
+import csv
+import io
+import sys
+import zlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Type checked as installed; at run time require_codec guards its use
+    import zstandard
+else:
+    try:
+        import zstandard
+    except ImportError:  # pragma: no cover - depends on the environment
+        zstandard = None
+
+# File name extension of every codec
+CODECS = {"gzip": ".gz", "zstd": ".zst"}
+INDEX_SUFFIX = ".idx"
+INDEX_FIELDS = ["sequence", "offset", "length", "rows"]
+
+
+def require_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(
+            f"unknown compression {codec!r}, expected one of {', '.join(CODECS)}"
+        )
+    if codec == "zstd" and zstandard is None:
+        raise RuntimeError(
+            "zstd compression requires zstandard (pip install zstandard)"
+        )
+
+
+def compressor(codec):
+    """Return a new compressor of codec, whose flush() ends its frame."""
+    if codec == "gzip":
+        # wbits 31 writes a gzip header and trailer around the deflate stream
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    return zstandard.ZstdCompressor().compressobj()
+
+
+def decompress(codec, data):
+    """Return the data of one frame of codec."""
+    if codec == "gzip":
+        return zlib.decompress(data, 31)
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+class FramedWriter(io.RawIOBase):
+    """A raw byte stream that compresses what is written to it into frames of raw.
+
+    raw is the file the frames are written to, and index_path the sidecar index,
+    which is appended to. Everything written since the last end_frame() goes into
+    the next frame.
+    """
+
+    def __init__(self, raw, index_path, codec):
+        require_codec(codec)
+        self.raw = raw
+        self.codec = codec
+        self.compressor = None
+        self.offset = raw.tell() if raw.seekable() else 0
+        self.length = 0
+        self.index = open(index_path, "a", newline="", encoding="utf-8")
+        self.index_writer = csv.writer(self.index)
+        if self.index.tell() == 0:
+            self.index_writer.writerow(INDEX_FIELDS)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.compressor is None:
+            self.compressor = compressor(self.codec)
+        self.put(self.compressor.compress(bytes(data)))
+        return len(data)
+
+    def flush(self):
+        super().flush()
+        self.raw.flush()
+
+    def put(self, data):
+        if data:
+            self.raw.write(data)
+            self.length += len(data)
+
+    def end_frame(self, sequence=None, rows=0):
+        """Close the current frame, if anything was written to it, and index it."""
+        if self.compressor is None:
+            return
+        self.put(self.compressor.flush())
+        self.compressor = None
+        self.index_writer.writerow(
+            ("" if sequence is None else sequence, self.offset, self.length, rows)
+        )
+        self.raw.flush()
+        self.index.flush()
+        self.offset += self.length
+        self.length = 0
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # Whatever was written after the last complete diff
+            self.end_frame()
+            super().close()
+        finally:
+            self.raw.close()
+            self.index.close()
+
+
+def read_index(path):
+    """Return the (sequence or None, offset, length, rows) of every frame of path."""
+    with open(path + INDEX_SUFFIX, newline="", encoding="utf-8") as fh:
+        rows = csv.reader(fh)
+        if next(rows, None) != INDEX_FIELDS:
+            raise ValueError(f"{path}{INDEX_SUFFIX}: not a frame index")
+        return [
+            (int(sequence) if sequence else None, int(offset), int(length), int(count))
+            for sequence, offset, length, count in rows
+        ]
+
+
+def read_range(path, first, last=None):
+    """Yield the decompressed header frame of path and its frames of first..last.
+
+    Only those frames are read from the file. last defaults to first.
+    """
+    codec = codec_of(path)
+    require_codec(codec)
+    if last is None:
+        last = first
+    with open(path, "rb") as fh:
+        for index, (sequence, offset, length, _) in enumerate(read_index(path)):
+            if (index == 0 and sequence is None) or (
+                sequence is not None and first <= sequence <= last
+            ):
+                fh.seek(offset)
+                yield decompress(codec, fh.read(length))
+
+
+def codec_of(path):
+    """Return the codec of a file by its extension."""
+    for codec, extension in CODECS.items():
+        if path.endswith(extension):
+            return codec
+    raise ValueError(f"{path}: not a {' or '.join(CODECS.values())} file")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write the CSV rows of a range of sequence numbers of a framed file."
+    )
+    parser.add_argument("path", help="a .csv.gz or .csv.zst file with a .idx index")
+    parser.add_argument("first", type=int, help="first sequence number")
+    parser.add_argument("last", type=int, nargs="?", help="last sequence number")
+    args = parser.parse_args()
+
+    for frame in read_range(args.path, args.first, args.last):
+        sys.stdout.buffer.write(frame)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Geometry columns of the ways and relations outputs of consumer.py.
+
+Augmented diffs carry the coordinates of the nodes of every way (<nd ref lat
+lon>) and the bounding box of every way and relation (<bounds>). A
+GeometryEncoder turns those into the trailing columns of a way or relation row,
+in one of these formats:
+
+- wkt: a geometry column in Well-Known Text, e.g. LINESTRING(9.99 53.45,...)
+- wkb-hex, wkb-base64: a geometry column in little-endian Well-Known Binary,
+  as hex or base64 text; base64 is about the size of WKT, hex 1.4 times it,
+  but both are read without parsing decimal numbers
+- bbox: minlon, minlat, maxlon and maxlat columns instead of a geometry
+- none: no geometry columns at all
+
+A way is a LINESTRING of its nodes, closed or not. A relation is a
+GEOMETRYCOLLECTION of the members that carry coordinates (only diffs queried
+with geometry have them). The nodes of osmChange files carry no coordinates;
+their locations are looked up in a nodestore.NodeStore, when one is given.
+Entities whose coordinates are not all known get empty geometry columns. A WKT geometry attribute set on
+an entity by whoever built it is written as it is in the wkt format.
+
+precision rounds coordinates to that many decimal places; 7 is what OSM stores,
+5 is about a metre. It shortens WKT and bbox columns (WKB coordinates are always
+8 byte doubles) at the cost of formatting every number.
+"""
+
+import base64
+import struct
+
+FORMATS = ("wkt", "wkb-hex", "wkb-base64", "bbox", "none")
+BBOX_FIELDS = ["minlon", "minlat", "maxlon", "maxlat"]
+
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_GEOMETRYCOLLECTION = 7
+
+
+def fields(format):
+    """Return the geometry columns of format."""
+    if format not in FORMATS:
+        raise ValueError(f"GEOMETRY_FORMAT must be one of {', '.join(FORMATS)}")
+    if format == "bbox":
+        return list(BBOX_FIELDS)
+    if format == "none":
+        return []
+    return ["geometry"]
+
+
+class GeometryEncoder:
+    """Encodes the geometry of ways and relations as the columns of a format."""
+
+    def __init__(self, format="wkt", precision=None, locations=None):
+        self.fields = fields(format)
+        if precision is not None and not 0 <= precision <= 15:
+            raise ValueError("GEOMETRY_PRECISION must be between 0 and 15")
+        self.format = format
+        self.precision = precision
+        self.locations = locations
+        self.empty = (None,) * len(self.fields)
+
+    def way(self, way):
+        """Return the geometry columns of a way as a tuple."""
+        if self.format == "bbox":
+            # Coordinates are only needed by ways without bounds
+            bounds = getattr(way, "bounds", None)
+            if bounds:
+                return self.bbox(bounds, ())
+            return self.bbox(None, [way_coordinates(way, self.locations)])
+        if self.format == "none":
+            return ()
+        if self.format == "wkt" and "geometry" in way.attribs:
+            return (way.attribs["geometry"],)
+        coordinates = way_coordinates(way, self.locations)
+        if not coordinates:
+            return self.empty
+        if self.format == "wkt":
+            return (f"LINESTRING({self.wkt_points(coordinates)})",)
+        return (self.text(self.wkb_linestring(coordinates)),)
+
+    def relation(self, relation):
+        """Return the geometry columns of a relation as a tuple."""
+        if self.format == "none":
+            return ()
+        if self.format == "wkt" and "geometry" in relation.attribs:
+            return (relation.attribs["geometry"],)
+        if self.format == "bbox":
+            bounds = getattr(relation, "bounds", None)
+            if bounds:
+                return self.bbox(bounds, ())
+            parts = member_coordinates(relation, self.locations)
+            return self.bbox(None, [c for _, c in parts])
+        parts = member_coordinates(relation, self.locations)
+        if not parts:
+            return self.empty
+        if self.format == "wkt":
+            return (
+                "GEOMETRYCOLLECTION("
+                + ",".join(
+                    f"{kind.upper()}({self.wkt_points(coordinates)})"
+                    for kind, coordinates in parts
+                )
+                + ")",
+            )
+        wkb = bytearray(struct.pack("<BII", 1, WKB_GEOMETRYCOLLECTION, len(parts)))
+        for kind, coordinates in parts:
+            if kind == "point":
+                wkb += struct.pack("<BI", 1, WKB_POINT)
+                wkb += self.pack(coordinates)
+            else:
+                wkb += self.wkb_linestring(coordinates)
+        return (self.text(wkb),)
+
+    def bbox(self, bounds, coordinate_lists):
+        """Return the bbox columns, from bounds or else from the coordinates."""
+        if bounds:
+            minlon, minlat, maxlon, maxlat = bounds
+        else:
+            points = [point for points in coordinate_lists for point in points]
+            if not points:
+                return self.empty
+            lons = [float(lon) for lon, _ in points]
+            lats = [float(lat) for _, lat in points]
+            minlon, minlat, maxlon, maxlat = min(lons), min(lats), max(lons), max(lats)
+        if self.precision is None:
+            return (minlon, minlat, maxlon, maxlat)
+        return tuple(self.number(v) for v in (minlon, minlat, maxlon, maxlat))
+
+    def number(self, value):
+        """Return a coordinate (text or float) as text, rounded to the precision."""
+        if self.precision is None:
+            return value
+        text = f"{float(value):.{self.precision}f}"
+        if "." in text:
+            text = text.rstrip("0").rstrip(".")
+        return "0" if text == "-0" else text
+
+    def wkt_points(self, coordinates):
+        number = self.number
+        return ",".join(f"{number(lon)} {number(lat)}" for lon, lat in coordinates)
+
+    def pack(self, coordinates):
+        """Return the coordinates as little-endian doubles, x before y."""
+        values = [float(v) for point in coordinates for v in point]
+        if self.precision is not None:
+            values = [round(v, self.precision) for v in values]
+        return struct.pack(f"<{len(values)}d", *values)
+
+    def wkb_linestring(self, coordinates):
+        header = struct.pack("<BII", 1, WKB_LINESTRING, len(coordinates))
+        return header + self.pack(coordinates)
+
+    def text(self, wkb):
+        if self.format == "wkb-hex":
+            return wkb.hex()
+        return base64.b64encode(wkb).decode("ascii")
+
+
+def node_coordinates(node, locations=None):
+    """Return the (lon, lat) text of a node or node reference, or None.
+
+    Coordinates missing from the diff are looked up in locations, a NodeStore.
+    """
+    get = node.attribs.get
+    lon = get("lon")
+    lat = get("lat")
+    if lon is not None and lat is not None:
+        return lon, lat
+    if locations is None:
+        return None
+    node_id = get("ref") or get("id")
+    return locations.location(node_id) if node_id else None
+
+
+def way_coordinates(way, locations=None):
+    """Return the (lon, lat) text pairs of the nodes of a way, or [] if any is unknown."""
+    coordinates = []
+    for node in getattr(way, "nodes", ()):
+        point = node_coordinates(node, locations)
+        if point is None:
+            return []
+        coordinates.append(point)
+    return coordinates
+
+
+def member_coordinates(relation, locations=None):
+    """Return (kind, coordinates) of the members of a relation that have coordinates.
+
+    kind is "point" for a node member, whose coordinates are one (lon, lat) pair,
+    and "linestring" for a way member, whose coordinates are a list of pairs.
+    """
+    parts = []
+    for member in getattr(relation, "members", ()):
+        get = member.attribs.get
+        if get("type") == "node":
+            point = node_coordinates(member, locations)
+            if point is not None:
+                parts.append(("point", [point]))
+        elif get("type") == "way":
+            coordinates = way_coordinates(member, locations)
+            if coordinates:
+                parts.append(("linestring", coordinates))
+    return parts
@@ -0,0 +1,271 @@
+"""Per-diff timings and counters of consumer.py.
+
+Converting a diff is split into four stages:
+
+- download: waiting for Overpass, i.e. for the response headers and for every
+  chunk of the body (measured by the streaming parser only)
+- parse: building entities from the XML (streaming parser only)
+- transform: building rows from the entities and formatting them as CSV,
+  which is everything not counted in another stage
+- write: blocking on the output, stdout or CSV files (see TimedWriter)
+
+With STREAM_PARSER=0 the download and parsing happen in the prefetch threads and
+are not reported; for osmChange files parsing counts as transform.
+
+The metrics of each diff are written as a JSON line, or as cumulative counters
+in the Prometheus text format, to stderr or to a file.
+"""
+
+import io
+import json
+import sys
+import time
+from datetime import datetime, timezone
+
+import atomicfile
+
+FORMATS = ("json", "prometheus")
+STAGES = ("download", "parse", "transform", "write")
+ENTITY_TYPES = ("node", "way", "relation")
+PREFIX = "osm_changes_"
+
+
+class Stopwatch:
+    """Accumulates the seconds spent in timed calls."""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+# Time blocked writing output, across every TimedWriter of the process
+WRITE_TIME = Stopwatch()
+
+
+class TimedWriter(io.RawIOBase):
+    """A raw binary stream that adds the time of every write to a Stopwatch.
+
+    It sits between a BufferedWriter and the file, so only the writes that reach
+    the file (a full buffer or a flush) are timed, not the formatting of rows.
+    """
+
+    def __init__(self, raw, stopwatch=WRITE_TIME):
+        self.raw = raw
+        self.stopwatch = stopwatch
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        start = time.perf_counter()
+        try:
+            return self.raw.write(data)
+        finally:
+            self.stopwatch.seconds += time.perf_counter() - start
+
+    def seekable(self):
+        return self.raw.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.raw.seek(offset, whence)
+
+    def tell(self):
+        return self.raw.tell()
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self.raw.close()
+
+
+class DiffMetrics:
+    """The timings and counters of converting one diff.
+
+    Call start() before converting, pass the changes of the diff through count()
+    (it has the signature of a process_diff_data route) and call finish() after.
+    """
+
+    def __init__(self, sequence_number=None):
+        self.sequence_number = sequence_number
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.bytes_downloaded = 0
+        self.entities = {name: 0 for name in ENTITY_TYPES}
+        self.rows = {}
+        self.max_changeset_id = 0
+        self.newest_timestamp = None
+        self.started = None
+        self.rows_before = {}
+        self.write_before = 0.0
+
+    def start(self, sinks=None):
+        """Start the clock; sinks are those rows will be added to, if they exist yet."""
+        self.rows_before = {name: len(sink) for name, sink in (sinks or {}).items()}
+        self.write_before = WRITE_TIME.seconds
+        self.started = time.perf_counter()
+
+    def count(self, changes):
+        """Yield the (action, entity) pairs of changes, counting them by type."""
+        entities = self.entities
+        newest = ""
+        try:
+            for action, entity in changes:
+                name = type(entity).__name__.lower()
+                entities[name] = entities.get(name, 0) + 1
+                # ISO 8601 timestamps in UTC compare like the times they stand for
+                timestamp = entity.attribs.get("timestamp") or ""
+                if timestamp > newest:
+                    newest = timestamp
+                yield action, entity
+        finally:
+            if newest and (self.newest_timestamp or "") < newest:
+                self.newest_timestamp = newest
+
+    def finish(self, adiff, sinks, max_changeset_id):
+        """Stop the clock and take the stage times of adiff and the rows in sinks."""
+        if self.started is None:
+            raise RuntimeError("finish() called before start()")
+        elapsed = time.perf_counter() - self.started
+        seconds = self.seconds
+        seconds["write"] += WRITE_TIME.seconds - self.write_before
+        seconds["download"] += getattr(adiff, "request_seconds", 0.0)
+        seconds["download"] += getattr(adiff, "read_seconds", 0.0)
+        seconds["parse"] += getattr(adiff, "parse_seconds", 0.0)
+        # The request was sent before the clock started, maybe in another thread
+        waited = getattr(adiff, "read_seconds", 0.0) + seconds["parse"]
+        seconds["transform"] += max(elapsed - waited - seconds["write"], 0.0)
+        self.bytes_downloaded += getattr(adiff, "bytes_downloaded", 0)
+        self.rows = {
+            name: len(sink) - self.rows_before.get(name, 0)
+            for name, sink in sinks.items()
+        }
+        self.max_changeset_id = max_changeset_id
+
+    def lag_seconds(self, now=None):
+        """Seconds from the newest entity timestamp of the diff until now, or None."""
+        if not self.newest_timestamp:
+            return None
+        newest = datetime.strptime(self.newest_timestamp, "%Y-%m-%dT%H:%M:%SZ")
+        now = now or datetime.now(timezone.utc)
+        return (now - newest.replace(tzinfo=timezone.utc)).total_seconds()
+
+    def record(self, now=None):
+        """Return the metrics as a dictionary ready for json.dumps."""
+        lag = self.lag_seconds(now)
+        return {
+            "sequence": self.sequence_number,
+            "seconds": {stage: round(s, 6) for stage, s in self.seconds.items()},
+            "bytes_downloaded": self.bytes_downloaded,
+            "entities": self.entities,
+            "rows": self.rows,
+            "max_changeset_id": self.max_changeset_id,
+            "newest_timestamp": self.newest_timestamp,
+            "lag_seconds": None if lag is None else round(lag, 3),
+        }
+
+
+class MetricsWriter:
+    """Writes DiffMetrics to stderr or to a file.
+
+    destination is "stderr" or a path. In the json format every diff is one line,
+    appended to the file. In the prometheus format, totals over all diffs since
+    the start of the process are kept and the file is replaced after every diff,
+    as the node_exporter textfile collector expects.
+    """
+
+    def __init__(self, destination, format="json"):
+        if format not in FORMATS:
+            raise ValueError(f"METRICS_FORMAT must be one of {', '.join(FORMATS)}")
+        self.destination = destination
+        self.format = format
+        self.totals = {
+            "diffs": 0,
+            "seconds": dict.fromkeys(STAGES, 0.0),
+            "bytes_downloaded": 0,
+            "entities": dict.fromkeys(ENTITY_TYPES, 0),
+            "rows": {},
+        }
+
+    def write(self, metrics):
+        if self.format == "json":
+            self.emit(json.dumps(metrics.record()) + "\n", append=True)
+            return
+        totals = self.totals
+        totals["diffs"] += 1
+        totals["bytes_downloaded"] += metrics.bytes_downloaded
+        for group in ("seconds", "entities", "rows"):
+            for name, value in getattr(metrics, group).items():
+                totals[group][name] = totals[group].get(name, 0) + value
+        self.emit(self.exposition(metrics), append=False)
+
+    def exposition(self, metrics):
+        """Return the totals and the gauges of the last diff in the text format."""
+        totals = self.totals
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP {PREFIX}{name} {help}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{PREFIX}{name}{labels} {value}")
+
+        metric("diffs_total", "counter", "Diffs converted.", [("", totals["diffs"])])
+        metric(
+            "stage_seconds_total",
+            "counter",
+            "Seconds spent in each stage of converting diffs.",
+            [(f'{{stage="{s}"}}', round(v, 6)) for s, v in totals["seconds"].items()],
+        )
+        metric(
+            "downloaded_bytes_total",
+            "counter",
+            "Bytes of diff bodies downloaded.",
+            [("", totals["bytes_downloaded"])],
+        )
+        metric(
+            "entities_total",
+            "counter",
+            "Entities converted, by type.",
+            [(f'{{type="{t}"}}', v) for t, v in totals["entities"].items()],
+        )
+        metric(
+            "rows_total",
+            "counter",
+            "Rows written, by output.",
+            [(f'{{output="{o}"}}', v) for o, v in totals["rows"].items()],
+        )
+        if metrics.sequence_number is not None:
+            metric(
+                "sequence_number",
+                "gauge",
+                "Sequence number of the last diff converted.",
+                [("", metrics.sequence_number)],
+            )
+        metric(
+            "max_changeset_id",
+            "gauge",
+            "Highest changeset id seen.",
+            [("", metrics.max_changeset_id)],
+        )
+        lag = metrics.lag_seconds()
+        if lag is not None:
+            metric(
+                "lag_seconds",
+                "gauge",
+                "Seconds between the newest change of the last diff and its conversion.",
+                [("", round(lag, 3))],
+            )
+        return "\n".join(lines) + "\n"
+
+    def emit(self, text, append):
+        if self.destination == "stderr":
+            sys.stderr.write(text)
+            sys.stderr.flush()
+        elif append:
+            with open(self.destination, "a", encoding="utf-8") as fh:
+                fh.write(text)
+        else:
+            # Replaced as a whole, so a scraper never sees a partial file
+            with atomicfile.atomic_write(self.destination, encoding="utf-8") as fh:
+                fh.write(text)
@@ -0,0 +1,180 @@
+"""A hash table of integer keys and pairs of 32-bit integers in a memory-mapped file.
+
+The version index and the node location store keep an entry for every entity
+of a region, hundreds of millions of them for a country, so neither fits in a
+dict. OSM ids are sparse (node ids reach 1.3e10, and a region's ids are spread
+over all of them), so an array indexed by id would be mostly holes. Instead
+the entries are kept in an open-addressing hash table in a file:
+
+    header   magic, capacity and count (64 bytes)
+    keys     capacity uint64, 0 for an empty slot
+    first    capacity 32-bit integers
+    second   capacity 32-bit integers
+
+so an entry takes 16 bytes per slot. The table is grown (rewritten at twice the
+capacity, to a temporary file that then replaces the old one) when it is more
+than MAX_LOAD full. Only the pages of the slots looked up are read in, and the
+file is in the native byte order.
+"""
+
+import mmap
+import os
+import struct
+
+import atomicfile
+
+HEADER = struct.Struct("=8sQQ")
+HEADER_SIZE = 64
+MAX_LOAD = 0.7
+MIN_CAPACITY = 1 << 10
+# Fibonacci hashing spreads consecutive ids over the whole table
+GOLDEN = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+def table_size(capacity):
+    """Return the size in bytes of a table file with capacity slots."""
+    return HEADER_SIZE + capacity * 16
+
+
+class MappedTable:
+    """The table in the file at path, created with room for capacity entries if missing.
+
+    magic identifies what the table holds; typecode is "I" for unsigned or "i"
+    for signed values.
+    """
+
+    def __init__(self, path, magic, capacity=1 << 20, typecode="I"):
+        if typecode not in ("I", "i"):
+            raise ValueError(f"typecode must be 'I' or 'i', not {typecode!r}")
+        self.path = path
+        self.magic = magic
+        self.typecode = typecode
+        if not os.path.exists(path):
+            capacity = int(capacity / MAX_LOAD) + 1
+            capacity = max(MIN_CAPACITY, 1 << (capacity - 1).bit_length())
+            self.write(path, capacity, (), 0)
+        self.open()
+
+    def open(self):
+        with open(self.path, "r+b") as fh:
+            self.map = mmap.mmap(fh.fileno(), 0)
+        magic, capacity, count = HEADER.unpack_from(self.map)
+        if (
+            magic != self.magic
+            or len(self.map) != table_size(capacity)
+            or capacity & (capacity - 1)
+        ):
+            self.map.close()
+            raise ValueError(f"{self.path}: not a {self.magic.decode()} file")
+        self.capacity = capacity
+        self.shift = 64 - (capacity.bit_length() - 1)
+        self.views = self.arrays(self.map, capacity)
+        self.header, self.keys, self.first, self.second = self.views[1:]
+
+    def arrays(self, table, capacity):
+        """Return a memoryview of a mapped table, its header fields, keys and values."""
+        view = memoryview(table)
+        end = HEADER_SIZE + capacity * 8
+        typecode = "i" if self.typecode == "i" else "I"
+        return (
+            view,
+            view[8:24].cast("Q"),
+            view[HEADER_SIZE:end].cast("Q"),
+            view[end : end + capacity * 4].cast(typecode),
+            view[end + capacity * 4 :].cast(typecode),
+        )
+
+    def slot(self, key):
+        """Return the slot of key, or the empty slot where it would go."""
+        keys = self.keys
+        mask = self.capacity - 1
+        slot = ((key * GOLDEN) & MASK64) >> self.shift
+        while True:
+            found = keys[slot]
+            if found == key or found == 0:
+                return slot
+            slot = (slot + 1) & mask
+
+    def get(self, key):
+        """Return the pair of values of key, or None."""
+        slot = self.slot(key)
+        if self.keys[slot] == 0:
+            return None
+        return self.first[slot], self.second[slot]
+
+    def put(self, key, first, second):
+        """Set the values of key, which must not be 0."""
+        slot = self.slot(key)
+        if self.keys[slot] == 0:
+            count = self.header[1] + 1
+            if count > self.capacity * MAX_LOAD:
+                self.reserve(1)
+                slot = self.slot(key)
+            self.keys[slot] = key
+            # The count is kept up to date in the file, so a table is never
+            # filled beyond MAX_LOAD whenever the process stops
+            self.header[1] += 1
+        self.first[slot] = first
+        self.second[slot] = second
+
+    def reserve(self, count):
+        """Grow the table, if needed, so that count more entries fit."""
+        needed = len(self) + count
+        capacity = self.capacity
+        while needed > capacity * MAX_LOAD:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        first = self.first
+        second = self.second
+        entries = (
+            (key, first[slot], second[slot])
+            for slot, key in enumerate(self.keys)
+            if key
+        )
+        self.write(self.path, capacity, entries, len(self))
+        self.close()
+        self.open()
+
+    def write(self, path, capacity, entries, count):
+        """Write a table of capacity slots holding count entries (key, first, second).
+
+        The table is built in a temporary file that then replaces path, so the
+        table at path is always complete.
+        """
+        with atomicfile.atomic_write(path, "wb") as fh:
+            os.ftruncate(fh.fileno(), table_size(capacity))
+            with mmap.mmap(fh.fileno(), 0) as table:
+                self.fill(table, capacity, entries, count)
+
+    def fill(self, table, capacity, entries, count):
+        HEADER.pack_into(table, 0, self.magic, capacity, count)
+        views = self.arrays(table, capacity)
+        _, _, keys, first, second = views
+        mask = capacity - 1
+        shift = 64 - (capacity.bit_length() - 1)
+        for key, a, b in entries:
+            slot = ((key * GOLDEN) & MASK64) >> shift
+            while keys[slot]:
+                slot = (slot + 1) & mask
+            keys[slot] = key
+            first[slot] = a
+            second[slot] = b
+        for view in reversed(views):
+            view.release()
+        table.flush()
+
+    def flush(self):
+        """Write the changed pages of the table to the file."""
+        self.map.flush()
+
+    def close(self):
+        if self.map.closed:
+            return
+        for view in reversed(self.views):
+            view.release()
+        self.map.close()
+
+    def __len__(self):
+        return self.header[1]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""A persistent store of node locations, to build the geometry of ways locally.
+
+Augmented diffs carry the coordinates of the nodes of every way, but osmChange
+files only their ids. With a node store, every node a diff creates or moves
+is recorded, and the ways of later diffs get their geometry from the
+locations of their nodes. The store is seeded from the nodes CSV written when
+the PBF snapshot was imported (epochMillis,id,...,lat,lon):
+
+    python3 nodestore.py /data/nodes.idx nodes.csv
+
+The store is a mmaptable.MappedTable from node id to longitude and latitude,
+each as a signed 32-bit number of 1e-7 degrees (the precision OSM stores), 16
+bytes per slot. Locations are written to the mapped file as they are
+recorded, so they survive the process; flush() writes them to disk. A diff
+converted again writes the same locations again. Deleted nodes keep their last
+location.
+"""
+
+import argparse
+import csv
+import sys
+
+import mmaptable
+
+MAGIC = b"OSMNLOC1"
+SCALE = 10_000_000
+
+
+class NodeStore:
+    """The node id -> (lon, lat) table in the file at path."""
+
+    def __init__(self, path, capacity=1 << 24):
+        self.path = path
+        self.table = mmaptable.MappedTable(path, MAGIC, capacity, "i")
+
+    def set(self, node_id, lon, lat):
+        """Record the location of a node; lon and lat may be text or numbers."""
+        self.table.put(
+            int(node_id), round(float(lon) * SCALE), round(float(lat) * SCALE)
+        )
+
+    def update(self, node):
+        """Record the location of a node entity, if it has one."""
+        get = node.attribs.get
+        lon = get("lon")
+        lat = get("lat")
+        if lon is not None and lat is not None:
+            self.set(get("id"), lon, lat)
+
+    def location(self, node_id):
+        """Return the (lon, lat) of a node as text with 7 decimals, or None."""
+        fixed = self.table.get(int(node_id))
+        if fixed is None:
+            return None
+        return f"{fixed[0] / SCALE:.7f}", f"{fixed[1] / SCALE:.7f}"
+
+    def seed(self, rows):
+        """Record the locations of rows of a nodes CSV (dictionaries); return their number."""
+        count = 0
+        for row in rows:
+            self.set(row["id"], row["lon"], row["lat"])
+            count += 1
+        return count
+
+    def flush(self):
+        self.table.flush()
+
+    def close(self):
+        self.table.close()
+
+    def __len__(self):
+        return len(self.table)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Seed a node store from nodes CSV files."
+    )
+    parser.add_argument("store", help="path of the node store, created if missing")
+    parser.add_argument(
+        "csv",
+        nargs="+",
+        help="nodes CSV files with id, lat and lon columns, - for stdin",
+    )
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        default=1 << 24,
+        help="number of nodes a new store has room for before it grows",
+    )
+    args = parser.parse_args()
+
+    store = NodeStore(args.store, args.capacity)
+    try:
+        for path in args.csv:
+            if path == "-":
+                count = store.seed(csv.DictReader(sys.stdin))
+            else:
+                with open(path, newline="", encoding="utf-8") as fh:
+                    count = store.seed(csv.DictReader(fh))
+            print(f"{path}: {count} nodes", file=sys.stderr)
+        store.flush()
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Route the entities of one global diff to any number of named regions.
+
+Regions are bounding boxes read from a JSON file that maps each region name to
+[minlon, minlat, maxlon, maxlat]:
+
+    {"berlin": [13.08, 52.33, 13.77, 52.68], "hamburg": [9.73, 53.39, 10.33, 53.74]}
+
+An entity belongs to every region whose box intersects its location (a point for
+nodes, the bounds of the diff for ways and relations). Candidate regions are
+looked up in a uniform grid over the region boxes, so routing costs the same
+with hundreds of regions as with a few.
+"""
+
+import json
+import math
+import re
+from collections import namedtuple
+
+Region = namedtuple("Region", ["name", "bbox"])
+
+# Region names become directory names
+REGION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+def load_regions(path):
+    """Read the regions of a JSON file, in file order."""
+    with open(path) as fh:
+        config = json.load(fh)
+    if not isinstance(config, dict) or not config:
+        raise ValueError(f"{path}: expected an object of region bounding boxes")
+    regions = []
+    for name, bbox in config.items():
+        if not REGION_NAME.match(name):
+            raise ValueError(f"{path}: invalid region name {name!r}")
+        try:
+            minlon, minlat, maxlon, maxlat = (float(value) for value in bbox)
+        except (TypeError, ValueError):
+            raise ValueError(
+                f"{path}: region {name} needs [minlon, minlat, maxlon, maxlat]"
+            )
+        if maxlon < minlon or maxlat < minlat:
+            raise ValueError(f"{path}: region {name} has an empty bounding box")
+        regions.append(Region(name, (minlon, minlat, maxlon, maxlat)))
+    return regions
+
+
+class GridIndex:
+    """A uniform grid of cell_degrees cells over a list of region boxes.
+
+    Every cell lists the regions whose box overlaps it. A query looks at the
+    cells under a box and checks the candidates found there exactly. Boxes that
+    cover more cells than there are regions are checked against every region
+    instead.
+    """
+
+    def __init__(self, regions, cell_degrees=1.0):
+        self.regions = regions
+        self.cell_degrees = cell_degrees
+        self.cells = {}
+        for index, region in enumerate(regions):
+            for cell in self.cells_of(region.bbox):
+                self.cells.setdefault(cell, []).append(index)
+
+    def cell_range(self, bbox):
+        minlon, minlat, maxlon, maxlat = bbox
+        size = self.cell_degrees
+        return (
+            range(math.floor(minlon / size), math.floor(maxlon / size) + 1),
+            range(math.floor(minlat / size), math.floor(maxlat / size) + 1),
+        )
+
+    def cells_of(self, bbox):
+        xs, ys = self.cell_range(bbox)
+        return [(x, y) for x in xs for y in ys]
+
+    def query(self, bbox):
+        """Return the indexes of the regions intersecting bbox, in region order."""
+        minlon, minlat, maxlon, maxlat = bbox
+        xs, ys = self.cell_range(bbox)
+        if len(xs) * len(ys) > len(self.regions):
+            candidates = range(len(self.regions))
+        elif len(xs) == 1 and len(ys) == 1:
+            # A point, or a box within one cell: no duplicates to remove
+            candidates = self.cells.get((xs[0], ys[0]), ())
+        else:
+            candidates = sorted(
+                {index for x in xs for y in ys for index in self.cells.get((x, y), ())}
+            )
+        matches = []
+        for index in candidates:
+            rminlon, rminlat, rmaxlon, rmaxlat = self.regions[index].bbox
+            if (
+                minlon <= rmaxlon
+                and rminlon <= maxlon
+                and minlat <= rmaxlat
+                and rminlat <= maxlat
+            ):
+                matches.append(index)
+        return matches
+
+
+class RoutedSink:
+    """A row sink that appends every row to the sinks of the current regions.
+
+    targets is a list, shared with the RegionOutputFiles, of the sinks that the
+    rows of the entity being converted go to. changesets.ChangesetRollup reads
+    it to roll up the entities of every region on their own.
+    """
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.count = 0
+
+    def append(self, row):
+        self.count += 1
+        for sink in self.targets:
+            sink.append(row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return self.count
+
+
+class RegionOutputFiles:
+    """One set of output files per region, fed through routed sinks.
+
+    open_files(name) opens the files of a region, e.g. OutputFiles in a directory
+    of that name. sinks maps every output type to a RoutedSink, to pass to
+    process_diff_data together with route, which picks the regions of each
+    entity before its rows are built.
+    """
+
+    def __init__(self, regions, open_files, locate, cell_degrees=1.0):
+        self.regions = regions
+        self.index = GridIndex(regions, cell_degrees)
+        self.locate = locate
+        self.files = []
+        try:
+            for region in regions:
+                self.files.append(open_files(region.name))
+        except BaseException:
+            self.close()
+            raise
+        self.targets = {name: [] for name in self.files[0].sinks}
+        self.sinks = {name: RoutedSink(self.targets[name]) for name in self.targets}
+        self.unlocated = 0
+
+    def route(self, changes):
+        """Yield the (action, entity) pairs of changes that fall in at least one region.
+
+        Before each pair is yielded, the routed sinks are pointed at the sinks of
+        its regions. Entities without a location in the diff are counted in
+        unlocated and skipped.
+        """
+        for action, entity in changes:
+            bbox = self.locate(entity)
+            if bbox is None:
+                self.unlocated += 1
+                continue
+            matches = self.index.query(bbox)
+            if not matches:
+                continue
+            for name, targets in self.targets.items():
+                targets[:] = [self.files[index].sinks[name] for index in matches]
+            yield action, entity
+
+    def end_frame(self, sequence_number=None):
+        """End the compressed frames of the files of every region."""
+        for files in self.files:
+            files.end_frame(sequence_number)
+
+    def region_sinks(self):
+        """Yield (region name, sinks) for every region."""
+        for region, files in zip(self.regions, self.files):
+            yield region.name, files.sinks
+
+    def close(self):
+        for files in self.files:
+            files.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
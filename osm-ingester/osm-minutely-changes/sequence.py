@@ -0,0 +1,94 @@
+"""Augmented diff sequence numbers, the times they stand for and the newest one.
+
+Overpass publishes one augmented diff per minute. Diff n holds the changes of
+the minute that ends (n + SEQUENCE_OFFSET) minutes after the Unix epoch, so
+converting between times and sequence numbers is arithmetic; only the newest
+published sequence number needs a request, to the augmented_diff_status URL.
+
+The etag of osm-ingester.sh is either the next sequence number to convert or,
+right after the PBF snapshot has been imported, the newest timestamp of the
+snapshot in epoch milliseconds with a minus sign. parse_etag turns both into a
+sequence number.
+"""
+
+import math
+import time
+
+import requests
+
+SEQUENCE_OFFSET = 22457216
+MINUTE_MILLIS = 60000
+
+
+def sequence_for_millis(epoch_millis):
+    """Return the sequence number of the first diff with changes after epoch_millis.
+
+    That is the diff of the minute the timestamp falls in; a timestamp on a full
+    minute belongs to the minute that ends there.
+    """
+    return math.ceil(epoch_millis / MINUTE_MILLIS) - SEQUENCE_OFFSET
+
+
+def millis_for_sequence(sequence_number):
+    """Return the end of the minute of diff sequence_number, in epoch milliseconds."""
+    return (sequence_number + SEQUENCE_OFFSET) * MINUTE_MILLIS
+
+
+def parse_etag(text):
+    """Return the sequence number to start from for an etag.
+
+    A non-negative number is a sequence number. A negative one is minus the
+    newest timestamp of a snapshot, in epoch milliseconds, and the diff after
+    that timestamp is the one to start from.
+    """
+    text = text.strip()
+    try:
+        value = int(text)
+    except ValueError:
+        raise ValueError(f"etag is neither a sequence number nor a timestamp: {text!r}")
+    if not text.startswith("-"):
+        return value
+    if value == 0:
+        # Written for a snapshot without any timestamp
+        raise ValueError(f"etag {text!r} has no snapshot timestamp")
+    sequence_number = sequence_for_millis(-value)
+    if sequence_number < 0:
+        raise ValueError(f"etag {text!r} is older than the first augmented diff")
+    return sequence_number
+
+
+class ReplicationState:
+    """The newest published sequence number, cached for max_age seconds.
+
+    Diffs are published once a minute, so asking again within max_age seconds
+    returns the number of the last request instead of making another one.
+    """
+
+    def __init__(self, url, max_age=30, timeout=30):
+        self.url = url
+        self.max_age = max_age
+        self.timeout = timeout
+        self.sequence_number = None
+        self.fetched_at = None
+
+    def latest(self, session: requests.Session | None = None, refresh=False):
+        """Return the newest published sequence number, requesting it if it is stale.
+
+        The request goes through session, or without one through requests.
+        """
+        now = time.monotonic()
+        if (
+            refresh
+            or self.sequence_number is None
+            or self.fetched_at is None
+            or now - self.fetched_at >= self.max_age
+        ):
+            response = (session or requests).get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            self.sequence_number = int(response.text.strip())
+            self.fetched_at = now
+        return self.sequence_number
+
+    def latest_millis(self, session: requests.Session | None = None):
+        """Return the end of the minute of the newest published diff, in epoch milliseconds."""
+        return millis_for_sequence(self.latest(session))
@@ -0,0 +1,57 @@
+"""A persistent dictionary of tag keys for the tags output of consumer.py.
+
+Tags are the largest output, and most of it is the same few keys (highway,
+name, building, ...) repeated on every row. With a key dictionary, each tag row
+carries the integer id of its key instead, and every key is written once to a
+CSV file of keyId,key rows. Ids are assigned in the order keys are first seen
+and never change, so the tags of every run and every rotated output file are
+joined with the same dictionary.
+
+The file is replaced as a whole when keys were added, so it is always complete.
+It is saved before the etag: a diff that is converted again after a crash adds
+its new keys again, in the same order, with the same ids.
+"""
+
+import csv
+
+import atomicfile
+
+FIELDS = ["keyId", "key"]
+
+
+class TagKeyDictionary:
+    """The key ids of a dictionary file, with the keys added since it was saved."""
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = {}
+        self.added = False
+        try:
+            with open(path, newline="", encoding="utf-8") as fh:
+                rows = csv.reader(fh)
+                if next(rows, None) != FIELDS:
+                    raise ValueError(f"{path}: not a tag key dictionary")
+                for key_id, key in rows:
+                    self.ids[key] = int(key_id)
+        except FileNotFoundError:
+            pass
+        if sorted(self.ids.values()) != list(range(1, len(self.ids) + 1)):
+            raise ValueError(f"{path}: key ids are not 1..{len(self.ids)}")
+
+    def key_id(self, key):
+        """Return the id of key, adding the key if it is new."""
+        key_id = self.ids.get(key)
+        if key_id is None:
+            key_id = self.ids[key] = len(self.ids) + 1
+            self.added = True
+        return key_id
+
+    def save(self):
+        """Write the dictionary to its file atomically, if keys were added."""
+        if not self.added:
+            return
+        with atomicfile.atomic_write(self.path, newline="", encoding="utf-8") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(FIELDS)
+            writer.writerows((key_id, key) for key, key_id in self.ids.items())
+        self.added = False
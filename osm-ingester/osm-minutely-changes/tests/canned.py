@@ -0,0 +1,17 @@
+"""The canned augmented diff that the tests convert."""
+import os
+
+from osmdiff import AugmentedDiff
+
+CANNED_DIFF = os.path.join(os.path.dirname(__file__), 'data', 'augmented_diff.xml')
+
+
+def load_canned_diff(sequence_number=None):
+    """Parse tests/data/augmented_diff.xml with osmdiff, as diff sequence_number if given.
+
+    Tests that mock osmdiff.AugmentedDiff still get the real one here.
+    """
+    adiff = AugmentedDiff(file=CANNED_DIFF)
+    if sequence_number is not None:
+        adiff.sequence_number = sequence_number
+    return adiff
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import unittest
+import sys
+import os
+import shutil
+import stat
+import tempfile
+
+# Add parent directory to path so we can import atomicfile.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import atomicfile
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'etag.txt')
+        with open(self.path, 'w') as fh:
+            fh.write('100')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replaces_file(self):
+        with atomicfile.atomic_write(self.path) as fh:
+            fh.write('101')
+            # Not replaced before the block completes
+            with open(self.path) as current:
+                self.assertEqual(current.read(), '100')
+
+        with open(self.path) as fh:
+            self.assertEqual(fh.read(), '101')
+        self.assertEqual(os.listdir(self.directory), ['etag.txt'])
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o644)
+
+    def test_failure_keeps_old_file(self):
+        with self.assertRaises(RuntimeError):
+            with atomicfile.atomic_write(self.path, 'wb') as fh:
+                fh.write(b'10')
+                raise RuntimeError('disk full')
+
+        with open(self.path) as fh:
+            self.assertEqual(fh.read(), '100')
+        self.assertEqual(os.listdir(self.directory), ['etag.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
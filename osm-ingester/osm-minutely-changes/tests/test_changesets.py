@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import csv
+import io
+from contextlib import redirect_stdout
+
+# Add parent directory to path so we can import changesets.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import changesets
+import regions
+from canned import load_canned_diff
+
+
+class TestChangesetRollup(unittest.TestCase):
+    def test_rollup_of_canned_diff(self):
+        rows = consumer.process_diff_data(load_canned_diff(), {'changesets': []})['changesets']
+        rows = [consumer.ChangesetRow._make(row) for row in rows]
+
+        self.assertEqual([row.changeset for row in rows], [167326499, 167326512, 167326520])
+        first = rows[0]
+        self.assertEqual((first.uid, first.username), ('8292344', 'Wolfgang Holtz'))
+        self.assertEqual((first.nodesCreated, first.nodesModified, first.waysCreated, first.relationsCreated),
+                         (2, 1, 1, 0))
+        self.assertEqual((first.minEpochMillis, first.maxEpochMillis), (1749327901000, 1749327901000))
+        self.assertEqual((first.minlon, first.minlat, first.maxlon, first.maxlat),
+                         (9.9865314, 53.4522237, 9.9963102, 53.4569215))
+        # The deleted node is placed where its last version was
+        self.assertEqual((rows[2].nodesDeleted, rows[2].minlon, rows[2].maxlat), (1, 9.98, 53.45))
+
+    def test_counts_times_and_bbox_are_combined(self):
+        rows = []
+        rollup = changesets.ChangesetRollup(rows)
+        rollup.add('modify', 'way', 7, '1', 'u', 2000, (1.0, 2.0, 3.0, 4.0))
+        rollup.add('create', 'node', 7, '1', 'u', 1000, (0.5, 2.5, 0.5, 2.5))
+        rollup.add('delete', 'relation', 7, '1', 'u', 3000, None)
+        rollup.add('create', 'node', 5, '2', 'v', None, None)
+        rollup.write()
+
+        self.assertEqual(len(rollup), 0)
+        first, second = [consumer.ChangesetRow._make(row) for row in rows]
+        self.assertEqual(first, consumer.ChangesetRow(5, '2', 'v', None, None, 1, 0, 0, 0, 0, 0, 0, 0, 0,
+                                                      None, None, None, None))
+        self.assertEqual(second, consumer.ChangesetRow(7, '1', 'u', 1000, 3000, 1, 0, 0, 0, 1, 0, 0, 0, 1,
+                                                       0.5, 2.0, 3.0, 4.0))
+
+    def test_regions_get_their_own_rollups(self):
+        north, south = [], []
+        targets = []
+        rollup = changesets.ChangesetRollup(regions.RoutedSink(targets))
+        targets[:] = [north, south]
+        rollup.add('create', 'node', 7, '1', 'u', 1000, (0.0, 0.0, 0.0, 0.0))
+        targets[:] = [north]
+        rollup.add('create', 'node', 7, '1', 'u', 2000, (0.0, 1.0, 0.0, 1.0))
+        rollup.write()
+
+        # The targets of the rows being converted are left alone
+        self.assertEqual(targets, [north])
+        self.assertEqual(len(rollup.sink), 2)
+
+        self.assertEqual([(row[4], row[5], row[-1]) for row in north], [(2000, 2, 1.0)])
+        self.assertEqual([(row[4], row[5], row[-1]) for row in south], [(1000, 1, 0.0)])
+
+    def test_stdout_output(self):
+        with mock.patch('consumer.CHANGESETS', 1), redirect_stdout(io.StringIO()) as stdout:
+            consumer.convert_diff(load_canned_diff())
+
+        rows = list(csv.reader(io.StringIO(stdout.getvalue())))
+        self.assertEqual(rows[0], consumer.CHANGESET_FIELDS)
+        self.assertEqual([row[0] for row in rows[1:]], ['167326499', '167326512', '167326520'])
+
+
+if __name__ == '__main__':
+    unittest.main()
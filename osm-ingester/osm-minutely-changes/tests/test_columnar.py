@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import io
+import shutil
+import tempfile
+from contextlib import redirect_stderr
+
+# Add parent directory to path so we can import consumer.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import columnar
+import consumer
+from canned import load_canned_diff
+
+
+EXAMPLE_OSC = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'example', '343.osc')
+
+
+@unittest.skipUnless(columnar.pyarrow, 'pyarrow is not installed')
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        flags = mock.patch.multiple('consumer', VERBOSE=0, NODES=0, WAYS=0, RELATIONS=0, MEMBERS=0, TAGS=0,
+                                    DELETIONS=0, OUTPUT_DIR=consumer.OUTPUT_DIR, OUTPUT_FORMAT=consumer.OUTPUT_FORMAT)
+        flags.start()
+        self.addCleanup(flags.stop)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_batch_parses_typed_columns(self):
+        nodes = consumer.process_diff_data(load_canned_diff(), {'nodes': []})['nodes']
+        batch = columnar.record_batch(nodes, columnar.arrow_schema(consumer.NODE_FIELDS))
+
+        self.assertEqual(batch.schema.names, consumer.NODE_FIELDS)
+        self.assertEqual(str(batch.schema.field('id').type), 'int64')
+        self.assertEqual(str(batch.schema.field('version').type), 'int32')
+        self.assertEqual(str(batch.schema.field('lat').type), 'double')
+        self.assertEqual(batch.num_rows, 3)
+        self.assertEqual(batch.to_pylist()[0], {
+            'epochMillis': 1749327901000, 'id': 12895640020, 'version': 1, 'changeset': 167326499,
+            'username': 'Wolfgang Holtz', 'uid': 8292344, 'lat': 53.4522237, 'lon': 9.9962891,
+        })
+
+    def test_missing_values_are_null(self):
+        schema = columnar.arrow_schema(consumer.MEMBER_FIELDS)
+        batch = columnar.record_batch([('1', '2', None, 'way'), ('1', None, '', 'node')], schema)
+        self.assertEqual(batch.column('memberId').to_pylist(), [2, None])
+        self.assertEqual(batch.column('memberRole').to_pylist(), [None, ''])
+
+    def test_parquet_files_for_every_type(self):
+        sinks = {name: [] for name, _, _ in consumer.output_types()}
+        consumer.process_diff_data(load_canned_diff(), sinks)
+
+        with columnar.ColumnarOutputFiles(self.directory, consumer.output_types(), 'parquet') as files:
+            consumer.process_diff_data(load_canned_diff(), files.sinks)
+
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            'changesets.parquet', 'deletions.parquet', 'members.parquet', 'nodes.parquet', 'relations.parquet', 'tags.parquet',
+            'ways.parquet'])
+        for name, _, fieldnames in consumer.output_types():
+            table = columnar.pyarrow.parquet.read_table(os.path.join(self.directory, name + '.parquet'))
+            self.assertEqual(table.schema.names, fieldnames)
+            self.assertEqual(table.num_rows, len(sinks[name]))
+            self.assertEqual(len(files.sinks[name]), len(sinks[name]))
+
+    def test_arrow_file_is_written_in_batches(self):
+        consumer.NODES = 1
+        path = os.path.join(self.directory, 'nodes.arrow')
+        writer = columnar.ColumnarRowWriter(path, consumer.NODE_FIELDS, 'arrow', batch_rows=2)
+        consumer.process_diff_data(load_canned_diff(), {'nodes': writer})
+        writer.close()
+
+        with columnar.pyarrow.ipc.open_file(path) as reader:
+            self.assertEqual(reader.num_record_batches, 2)
+            self.assertEqual(reader.read_all().column('id').to_pylist(), [12895640020, 12895640021, 33820695])
+
+    def test_main_with_parquet_output(self):
+        consumer.OUTPUT_DIR = os.path.join(self.directory, 'out')
+        consumer.OUTPUT_FORMAT = 'parquet'
+        consumer.TAGS = 1
+        with mock.patch('sys.argv', ['consumer.py', '--osc', EXAMPLE_OSC]):
+            consumer.main()
+
+        self.assertEqual(os.listdir(consumer.OUTPUT_DIR), ['tags.parquet'])
+        tags = columnar.pyarrow.parquet.read_table(os.path.join(consumer.OUTPUT_DIR, 'tags.parquet'))
+        self.assertEqual(tags.schema.names, consumer.TAG_FIELDS)
+        self.assertGreater(tags.num_rows, 0)
+
+    def test_columnar_output_requires_output_dir(self):
+        consumer.OUTPUT_DIR = ''
+        consumer.OUTPUT_FORMAT = 'arrow'
+        consumer.NODES = 1
+        stderr = io.StringIO()
+        with mock.patch('sys.argv', ['consumer.py', '--osc', EXAMPLE_OSC]), redirect_stderr(stderr), \
+                self.assertRaises(SystemExit):
+            consumer.main()
+        self.assertIn('requires OUTPUT_DIR', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,20 +4,33 @@ from unittest import mock
 import sys
 import os
 import csv
+import gzip
 import io
+import json
+import shutil
+import tempfile
 import time
+import threading
 from contextlib import redirect_stdout, redirect_stderr
 from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 
 # Add parent directory to path so we can import consumer.py
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import consumer
+from canned import CANNED_DIFF, load_canned_diff
+
+def as_dicts(rows, fieldnames):
+    """Turn converted row tuples into dictionaries keyed by their schema fields."""
+    return [dict(zip(fieldnames, row)) for row in rows]
+
 
 class TestConsumer(unittest.TestCase):
     def setUp(self):
         # Save original environment variables
         self.original_env = {}
-        for var in ['VERBOSE', 'NODES', 'WAYS', 'RELATIONS', 'MEMBERS', 'TAGS']:
+        for var in ['VERBOSE', 'NODES', 'WAYS', 'RELATIONS', 'MEMBERS', 'TAGS', 'DELETIONS']:
             self.original_env[var] = os.environ.get(var)
         
         # Set environment variables for testing
@@ -38,8 +51,13 @@ class TestConsumer(unittest.TestCase):
         consumer.RELATIONS = int(os.environ['RELATIONS'])
         consumer.MEMBERS = int(os.environ['MEMBERS'])
         consumer.TAGS = int(os.environ['TAGS'])
+
+        # These tests mock osmdiff.AugmentedDiff, so diffs are retrieved with osmdiff
+        self.original_stream_parser = consumer.STREAM_PARSER
+        consumer.STREAM_PARSER = 0
     
     def tearDown(self):
+        consumer.STREAM_PARSER = self.original_stream_parser
         # Restore original environment variables
         for var, value in self.original_env.items():
             if value is None:
@@ -64,10 +82,49 @@ class TestConsumer(unittest.TestCase):
         # Test with invalid string
         self.assertIsNone(consumer.to_epoch_millis('invalid-date'))
 
+        # Test with float seconds as a string
+        self.assertEqual(consumer.to_epoch_millis('1640995200.5'), 1640995200500)
+
+    def test_parse_osm_timestamp_matches_strptime(self):
+        for ts in ['1970-01-01T00:00:00Z', '2000-02-29T23:59:59Z', '2025-03-31T20:24:52Z',
+                   '2038-01-19T03:14:08Z', '1969-12-31T23:59:59Z']:
+            expected = int(datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ')
+                           .replace(tzinfo=timezone.utc).timestamp() * 1000)
+            self.assertEqual(consumer.parse_osm_timestamp(ts), expected)
+            self.assertEqual(consumer.to_epoch_millis(ts), expected)
+
+        # Anything else is left to the fallback parsing
+        for ts in ['2025-13-01T00:00:00Z', '2025-02-30T00:00:00Z', '2025-03-31 20:24:52Z',
+                   '2025-03-31T20:24:52', '2025-03-31T20:24:52+00:00', '']:
+            self.assertIsNone(consumer.parse_osm_timestamp(ts))
+            self.assertIsNone(consumer.to_epoch_millis(ts))
+
+    def test_to_epoch_millis_matches_strptime(self):
+        # The fast path (parser plus per-diff memo) against the strptime-based
+        # conversion; benchmarks/bench_timestamps.py compares their speed
+        timestamps = ['2025-06-07T20:25:%02dZ' % (i % 60) for i in range(120)]
+
+        def reference(ts):
+            dt = datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ')
+            return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+        consumer._epoch_millis_memo.clear()
+        self.assertEqual([consumer.to_epoch_millis(ts) for ts in timestamps],
+                         [reference(ts) for ts in timestamps])
+
+    def test_to_epoch_millis_parses_each_timestamp_once(self):
+        # The entities of a diff share a few timestamps: only the first of each is parsed
+        timestamps = ['2025-06-07T20:25:%02dZ' % (i % 60) for i in range(30000)]
+        consumer._epoch_millis_memo.clear()
+        with mock.patch('consumer.parse_osm_timestamp', wraps=consumer.parse_osm_timestamp) as parse:
+            for ts in timestamps:
+                consumer.to_epoch_millis(ts)
+        self.assertEqual(parse.call_count, 60)
+
     def test_write_csv_stdout(self):
         rows = [
-            {'id': '1', 'value': 'test1', 'extra': 'should_not_appear'},
-            {'id': '2', 'value': 'test2'}
+            ('1', 'test1'),
+            ('2', 'test2')
         ]
         fieldnames = ['id', 'value']
         
@@ -85,7 +142,7 @@ class TestConsumer(unittest.TestCase):
         self.assertEqual(len(result_rows), 2)
         self.assertEqual(result_rows[0]['id'], '1')
         self.assertEqual(result_rows[0]['value'], 'test1')
-        self.assertNotIn('extra', result_rows[0])
+        self.assertEqual(list(result_rows[0].keys()), fieldnames)
         self.assertEqual(result_rows[1]['id'], '2')
         self.assertEqual(result_rows[1]['value'], 'test2')
 
@@ -109,6 +166,7 @@ class TestConsumer(unittest.TestCase):
         
         # Process the node
         consumer.process_node(node, nodes_rows)
+        nodes_rows = as_dicts(nodes_rows, consumer.NODE_FIELDS)
         
         # Check the result
         self.assertEqual(len(nodes_rows), 1)
@@ -140,6 +198,7 @@ class TestConsumer(unittest.TestCase):
         
         # Process the way
         consumer.process_way(way, ways_rows)
+        ways_rows = as_dicts(ways_rows, consumer.WAY_FIELDS)
         
         # Check the result
         self.assertEqual(len(ways_rows), 1)
@@ -184,6 +243,8 @@ class TestConsumer(unittest.TestCase):
         
         # Process the relation
         consumer.process_relation(relation, relations_rows, members_rows)
+        relations_rows = as_dicts(relations_rows, consumer.RELATION_FIELDS)
+        members_rows = as_dicts(members_rows, consumer.MEMBER_FIELDS)
         
         # Check relation result
         self.assertEqual(len(relations_rows), 1)
@@ -232,9 +293,12 @@ class TestConsumer(unittest.TestCase):
                 def __init__(self):
                     self.attribs = {
                         'id': '123',
+                        'version': '2',
+                        'timestamp': '2022-01-01T00:00:00Z'
+                    }
+                    self.tags = {
                         'name': 'Test Node',
                         'amenity': 'restaurant',
-                        'timestamp': '2022-01-01T00:00:00Z'
                     }
             
             node = MockNode()
@@ -242,9 +306,10 @@ class TestConsumer(unittest.TestCase):
             
             # Process the tags
             consumer.process_tags(node, tags_rows)
+            tags_rows = as_dicts(tags_rows, consumer.TAG_FIELDS)
             
-            # Check the result
-            self.assertEqual(len(tags_rows), 3)  # One for each attribute except 'id'
+            # Check the result: the tags, not the attributes
+            self.assertEqual(len(tags_rows), 2)
             
             # Check each tag
             name_tag = next(tag for tag in tags_rows if tag['key'] == 'name')
@@ -258,12 +323,11 @@ class TestConsumer(unittest.TestCase):
             self.assertEqual(amenity_tag['id'], '123')
             self.assertEqual(amenity_tag['value'], 'restaurant')
             self.assertEqual(amenity_tag['epochMillis'], 1640995200000)
-            
-            timestamp_tag = next(tag for tag in tags_rows if tag['key'] == 'timestamp')
-            self.assertEqual(timestamp_tag['type'], 'node')
-            self.assertEqual(timestamp_tag['id'], '123')
-            self.assertEqual(timestamp_tag['value'], '2022-01-01T00:00:00Z')
-            self.assertEqual(timestamp_tag['epochMillis'], 1640995200000)
+
+            # Entities without tags add no rows
+            node.tags = {}
+            consumer.process_tags(node, tags_rows)
+            self.assertEqual(len(tags_rows), 2)
         finally:
             # Restore original osmdiff types
             if original_node is not None:
@@ -276,22 +340,19 @@ class TestConsumer(unittest.TestCase):
     def test_output_csv_data(self):
         # Create test data for each entity type
         nodes_rows = [
-            {'id': '123', 'version': '1', 'lat': '51.5074', 'lon': '-0.1278', 
-             'changeset': '456', 'username': 'test', 'uid': '789', 'epochMillis': 1640995200000}
+            (1640995200000, '123', '1', '456', 'test', '789', '51.5074', '-0.1278')
         ]
         ways_rows = [
-            {'id': '456', 'version': '1', 'geometry': 'LINESTRING(0 0, 1 1)', 
-             'changeset': '789', 'username': 'test', 'uid': '123', 'epochMillis': 1640995200000}
+            (1640995200000, '456', '1', '789', 'test', '123', 'LINESTRING(0 0, 1 1)')
         ]
         relations_rows = [
-            {'id': '789', 'version': '1', 'geometry': 'MULTILINESTRING((0 0, 1 1))', 
-             'changeset': '123', 'username': 'test', 'uid': '456', 'epochMillis': 1640995200000}
+            (1640995200000, '789', '1', '123', 'test', '456', 'MULTILINESTRING((0 0, 1 1))')
         ]
         members_rows = [
-            {'relationId': '789', 'memberId': '456', 'memberRole': 'outer', 'memberType': 'way'}
+            ('789', '456', 'outer', 'way')
         ]
         tags_rows = [
-            {'type': 'node', 'id': '123', 'key': 'name', 'value': 'Test', 'epochMillis': 1640995200000}
+            (1640995200000, 'node', '123', 'name', 'Test')
         ]
         
         # Capture stdout
@@ -354,6 +415,7 @@ class TestConsumer(unittest.TestCase):
                         'lon': '-0.1278',
                         'timestamp': '2022-01-01T00:00:00Z'
                     }
+                    self.tags = {'amenity': 'bench'}
             
             class MockWay(MockWayType):
                 def __init__(self, id_, changeset):
@@ -366,6 +428,7 @@ class TestConsumer(unittest.TestCase):
                         'geometry': 'LINESTRING(0 0, 1 1)',
                         'timestamp': '2022-01-01T00:00:00Z'
                     }
+                    self.tags = {'highway': 'residential', 'name': 'Main Street'}
             
             class MockRelation(MockRelationType):
                 def __init__(self, id_, changeset):
@@ -379,6 +442,7 @@ class TestConsumer(unittest.TestCase):
                         'timestamp': '2022-01-01T00:00:00Z'
                     }
                     self.members = []
+                    self.tags = {}
             
             # Configure mock data
             node1 = MockNode('101', '1001')
@@ -390,6 +454,9 @@ class TestConsumer(unittest.TestCase):
             
             # Process the mock data
             nodes_rows, ways_rows, relations_rows, members_rows, tags_rows = consumer.process_diff_data(mock_adiff)
+            nodes_rows = as_dicts(nodes_rows, consumer.NODE_FIELDS)
+            ways_rows = as_dicts(ways_rows, consumer.WAY_FIELDS)
+            relations_rows = as_dicts(relations_rows, consumer.RELATION_FIELDS)
             
             # Check max_changeset_id was updated correctly
             self.assertEqual(consumer.max_changeset_id, 3001)
@@ -404,6 +471,9 @@ class TestConsumer(unittest.TestCase):
             self.assertEqual(nodes_rows[1]['id'], '102')
             self.assertEqual(ways_rows[0]['id'], '201')
             self.assertEqual(relations_rows[0]['id'], '301')
+            self.assertEqual([(row[1], row[2], row[3]) for row in tags_rows], [
+                ('node', '101', 'amenity'), ('node', '102', 'amenity'),
+                ('way', '201', 'highway'), ('way', '201', 'name')])
         finally:
             # Restore original osmdiff types
             if original_node is not None:
@@ -415,31 +485,904 @@ class TestConsumer(unittest.TestCase):
 
     @mock.patch('consumer.process_diff_data')
     @mock.patch('osmdiff.AugmentedDiff')
-    @mock.patch('builtins.open', new_callable=mock.mock_open)
+    @mock.patch('consumer.write_etag')
     @mock.patch('sys.argv', ['consumer.py', '12345', 'etag_output.txt'])
-    def test_main(self, mock_open, MockAugmentedDiff, mock_process_diff_data):
-        # Set up mock return values
-        mock_process_diff_data.return_value = ([], [], [], [], [])
-        
+    def test_main(self, mock_write_etag, MockAugmentedDiff, mock_process_diff_data):
         # Configure the mock AugmentedDiff
         mock_adiff_instance = MockAugmentedDiff.return_value
+        mock_adiff_instance.retrieve.return_value = 200
         
         # Set max_changeset_id for testing
         consumer.max_changeset_id = 9999
         
         # Run the main function
-        consumer.main()
+        stdout_buffer = io.StringIO()
+        with redirect_stdout(stdout_buffer):
+            consumer.main()
         
         # Verify AugmentedDiff was configured correctly
         self.assertEqual(mock_adiff_instance.sequence_number, 12345)
         mock_adiff_instance.retrieve.assert_called_once()
         
-        # Verify process_diff_data was called
-        mock_process_diff_data.assert_called_once_with(mock_adiff_instance)
+        # Verify the diff was converted and the headers written
+        mock_process_diff_data.assert_called_once_with(mock_adiff_instance, mock.ANY, None, consumer.diff_services())
+        self.assertEqual(stdout_buffer.getvalue().count(','.join(consumer.MEMBER_FIELDS)), 1)
         
-        # Verify file was opened and written correctly
-        mock_open.assert_called_once_with('etag_output.txt', 'w')
-        mock_open().write.assert_called_once_with('9999')
+        # Verify the next sequence number was written to the etag file
+        mock_write_etag.assert_called_once_with('etag_output.txt', 12346)
+
+    @mock.patch('osmdiff.AugmentedDiff')
+    @mock.patch('sys.argv', ['consumer.py', '100', 'etag_output.txt', '102'])
+    def test_main_catch_up_range(self, MockAugmentedDiff):
+        retrieved = []
+
+        def make_adiff(*args, **kwargs):
+            adiff = load_canned_diff()
+            self.enterContext(mock.patch.object(
+                adiff, 'retrieve', side_effect=lambda **kw: retrieved.append(adiff.sequence_number) or 200))
+            return adiff
+
+        MockAugmentedDiff.side_effect = make_adiff
+
+        stdout_buffer = io.StringIO()
+        with mock.patch('consumer.write_etag') as mock_write_etag, redirect_stdout(stdout_buffer):
+            consumer.main()
+
+        # All three sequence numbers are fetched in one run
+        self.assertEqual(sorted(retrieved), [100, 101, 102])
+
+        # Headers are written once, so each type forms a single CSV section that
+        # holds the rows of that type from every diff
+        single = io.StringIO()
+        with redirect_stdout(single):
+            consumer.stream_csv_data(load_canned_diff())
+        rows = self.csv_sections(single.getvalue())
+        self.assertEqual(self.csv_sections(stdout_buffer.getvalue()),
+                         {name: 3 * section for name, section in rows.items()})
+        self.assertEqual(len(rows['nodes']), 3)
+
+        # The etag points past the whole batch
+        mock_write_etag.assert_called_once_with('etag_output.txt', 103)
+
+    def csv_sections(self, text):
+        """Split CSV output into the rows of each enabled type, which must follow
+        its header in output order."""
+        types = [(name, ','.join(fields)) for name, enabled, fields in consumer.output_types() if enabled]
+        lines = text.splitlines()
+        sections = {}
+        i = 0
+        for index, (name, header) in enumerate(types):
+            self.assertEqual(lines[i], header)
+            i += 1
+            next_header = types[index + 1][1] if index + 1 < len(types) else None
+            sections[name] = []
+            while i < len(lines) and lines[i] != next_header:
+                sections[name].append(lines[i])
+                i += 1
+        self.assertEqual(i, len(lines))
+        return sections
+
+    @mock.patch('sequence.ReplicationState.latest', return_value=105)
+    @mock.patch('consumer.process_diff_data')
+    @mock.patch('osmdiff.AugmentedDiff')
+    @mock.patch('sys.argv', ['consumer.py', '100', 'etag_output.txt', 'latest'])
+    def test_main_catch_up_stops_at_unpublished_diff(self, MockAugmentedDiff, mock_process_diff_data, mock_latest):
+        def make_adiff(*args, **kwargs):
+            # 100 and 101 are available, 102 onwards is not published yet
+            adiff = mock.MagicMock()
+            adiff.retrieve.side_effect = lambda **kw: 200 if adiff.sequence_number < 102 else 404
+            return adiff
+
+        MockAugmentedDiff.side_effect = make_adiff
+
+        with mock.patch('consumer.write_etag') as mock_write_etag, \
+                redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            consumer.main()
+
+        self.assertEqual(mock_process_diff_data.call_count, 2)
+        mock_write_etag.assert_called_once_with('etag_output.txt', 102)
+
+    @mock.patch('sequence.ReplicationState.latest', return_value=500)
+    def test_resolve_end_sequence(self, mock_latest):
+        self.assertEqual(consumer.resolve_end_sequence(100, None), 100)
+        self.assertEqual(consumer.resolve_end_sequence(100, '120'), 120)
+        self.assertEqual(consumer.resolve_end_sequence(100, 'latest'), 500)
+
+        original_max_batch = consumer.MAX_BATCH
+        consumer.MAX_BATCH = 60
+        try:
+            self.assertEqual(consumer.resolve_end_sequence(100, 'latest'), 159)
+        finally:
+            consumer.MAX_BATCH = original_max_batch
+
+
+# Kept aside so canned diffs can still be parsed while osmdiff.AugmentedDiff is mocked
+AugmentedDiff = consumer.osmdiff.AugmentedDiff
+
+
+OUTPUT_FLAGS = ['NODES', 'WAYS', 'RELATIONS', 'MEMBERS', 'TAGS', 'DELETIONS']
+
+
+class PatchFlagsMixin(unittest.TestCase):
+    """Sets flags of consumer for the duration of each test."""
+
+    def patch_flags(self, outputs=None, **flags):
+        """Patch flags, and with outputs, set the output flags not in flags to it."""
+        if outputs is not None:
+            flags = {**dict.fromkeys(OUTPUT_FLAGS, outputs), **flags}
+        patcher = mock.patch.multiple('consumer', **flags)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestStreaming(PatchFlagsMixin, unittest.TestCase):
+    def setUp(self):
+        self.patch_flags(0, VERBOSE=0)
+
+    def test_csv_row_writer_writes_on_append(self):
+        stream = io.StringIO()
+        writer = consumer.CsvRowWriter(stream, ['id', 'value'])
+        self.assertEqual(stream.getvalue(), 'id,value\r\n')
+
+        writer.append(('1', 'a'))
+        self.assertEqual(stream.getvalue(), 'id,value\r\n1,a\r\n')
+        self.assertEqual(len(writer), 1)
+
+        consumer.CsvRowWriter(stream, ['id', 'value'], header=False).append(('2', None))
+        self.assertTrue(stream.getvalue().endswith('1,a\r\n2,\r\n'))
+
+        writer.extend([('3', 'c'), ('4', 'd')])
+        self.assertEqual(len(writer), 3)
+        self.assertTrue(stream.getvalue().endswith('3,c\r\n4,d\r\n'))
+
+    def test_buffered_stdout(self):
+        # Streams without a file descriptor are used as they are
+        stdout_buffer = io.StringIO()
+        with redirect_stdout(stdout_buffer):
+            self.assertIs(consumer.buffered_stdout(), stdout_buffer)
+
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            stream = consumer.buffered_stdout(buffer_size=1 << 16)
+            self.assertIsNot(stream, devnull)
+            csv.writer(stream).writerow(['epochMillis', 'id'])
+            stream.flush()
+            self.assertFalse(devnull.closed)
+
+    def test_process_diff_data_skips_disabled_sinks(self):
+        nodes_rows = []
+        with mock.patch('consumer.process_tags') as mock_process_tags, \
+                mock.patch('consumer.process_way') as mock_process_way:
+            sinks = consumer.process_diff_data(load_canned_diff(), {'nodes': nodes_rows, 'ways': None})
+
+        self.assertIs(sinks['nodes'], nodes_rows)
+        self.assertEqual([row[1] for row in nodes_rows], ['12895640020', '12895640021', '33820695'])
+        mock_process_tags.assert_not_called()
+        mock_process_way.assert_not_called()
+
+    def test_rows_are_laid_out_as_records(self):
+        records = {'nodes': consumer.NodeRow, 'ways': consumer.WayRow, 'relations': consumer.RelationRow,
+                   'members': consumer.MemberRow, 'tags': consumer.TagRow, 'deletions': consumer.DeletionRow,
+                   'changesets': consumer.ChangesetRow}
+        sinks = consumer.process_diff_data(load_canned_diff(), {name: [] for name in records})
+
+        for name, fieldnames in [(name, fields) for name, _, fields in consumer.output_types()]:
+            self.assertEqual(fieldnames, list(records[name]._fields))
+            for row in sinks[name]:
+                self.assertIs(type(row), tuple)
+                self.assertEqual(len(row), len(fieldnames))
+
+        node = consumer.NodeRow._make(sinks['nodes'][0])
+        self.assertEqual((node.id, node.lat, node.lon), ('12895640020', '53.4522237', '9.9962891'))
+        member = consumer.MemberRow._make(sinks['members'][0])
+        self.assertEqual((member.relationId, member.memberRole), ('19012345', 'outer'))
+
+    def test_iter_entities_covers_all_actions(self):
+        changes = [(action, entity.attribs['id']) for action, entity in consumer.iter_entities(load_canned_diff())]
+        self.assertEqual(changes, [
+            ('create', '12895640020'),
+            ('create', '12895640021'),
+            ('create', '1389012345'),
+            ('create', '19012345'),
+            ('modify', '33820695'),
+            ('delete', '4711'),
+        ])
+
+    def test_modified_and_deleted_entities(self):
+        sinks = {'nodes': [], 'tags': [], 'deletions': []}
+        consumer.process_diff_data(load_canned_diff(), sinks)
+
+        # The new version of a modified node is a regular row
+        modified = as_dicts(sinks['nodes'], consumer.NODE_FIELDS)[2]
+        self.assertEqual(modified['id'], '33820695')
+        self.assertEqual(modified['version'], '20')
+        self.assertEqual(modified['changeset'], '167326499')
+
+        # A deleted node only shows up in the deletions output, in its deleting version
+        self.assertEqual(as_dicts(sinks['deletions'], consumer.DELETION_FIELDS), [{
+            'epochMillis': 1749327940000,
+            'type': 'node',
+            'id': '4711',
+            'version': '4',
+            'changeset': '167326520',
+            'username': 'Wolfgang Holtz',
+            'uid': '8292344',
+        }])
+        self.assertNotIn('4711', [row[2] for row in sinks['tags']])
+        self.assertEqual(consumer.max_changeset_id, 167326520)
+
+    def test_stream_csv_data_single_type(self):
+        consumer.NODES = 1
+        stdout_buffer = io.StringIO()
+        with redirect_stdout(stdout_buffer):
+            sinks = consumer.stream_csv_data(load_canned_diff())
+
+        lines = stdout_buffer.getvalue().splitlines()
+        self.assertEqual(lines[0], 'epochMillis,id,version,changeset,username,uid,lat,lon')
+        self.assertEqual(lines[1], '1749327901000,12895640020,1,167326499,Wolfgang Holtz,8292344,53.4522237,9.9962891')
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(list(sinks), ['nodes'])
+        self.assertEqual(len(sinks['nodes']), 3)
+
+    def test_stream_csv_data_keeps_sections_per_type(self):
+        consumer.NODES = 1
+        consumer.MEMBERS = 1
+        stdout_buffer = io.StringIO()
+        with redirect_stdout(stdout_buffer):
+            consumer.stream_csv_data(load_canned_diff(), header=False)
+
+        self.assertEqual(stdout_buffer.getvalue().splitlines()[3:], [
+            '19012345,1389012345,outer,way',
+            '19012345,12895640020,label,node',
+        ])
+
+
+class TestOutputFiles(PatchFlagsMixin, unittest.TestCase):
+    def setUp(self):
+        self.patch_flags(0, VERBOSE=0, OUTPUT_DIR=consumer.OUTPUT_DIR)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), newline='') as fh:
+            return list(csv.reader(fh))
+
+    def test_all_types_in_one_pass(self):
+        with mock.patch('consumer.iter_entities', wraps=consumer.iter_entities) as mock_iter_entities:
+            with consumer.OutputFiles(self.directory) as files:
+                consumer.process_diff_data(load_canned_diff(), files.sinks)
+
+        mock_iter_entities.assert_called_once()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['changesets.csv', 'deletions.csv', 'members.csv', 'nodes.csv', 'relations.csv', 'tags.csv',
+                          'ways.csv'])
+        nodes = self.read('nodes.csv')
+        self.assertEqual(nodes[0], consumer.NODE_FIELDS)
+        self.assertEqual([row[1] for row in nodes[1:]], ['12895640020', '12895640021', '33820695'])
+        self.assertEqual(self.read('ways.csv')[0], consumer.WAY_FIELDS)
+        self.assertEqual(len(self.read('ways.csv')), 2)
+        self.assertEqual(self.read('members.csv')[1], ['19012345', '1389012345', 'outer', 'way'])
+        self.assertEqual(self.read('tags.csv')[0], consumer.TAG_FIELDS)
+
+    def test_only_enabled_types(self):
+        consumer.WAYS = 1
+        consumer.TAGS = 1
+        with consumer.OutputFiles(self.directory) as files:
+            self.assertEqual(sorted(files.sinks), ['tags', 'ways'])
+            consumer.process_diff_data(load_canned_diff(), files.sinks)
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['tags.csv', 'ways.csv'])
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'named pipes are not supported')
+    def test_named_pipe(self):
+        consumer.NODES = 1
+        fifo = os.path.join(self.directory, 'nodes.csv')
+        os.mkfifo(fifo)
+        received = []
+
+        def read_pipe():
+            with open(fifo, newline='') as fh:
+                received.extend(csv.reader(fh))
+
+        reader = threading.Thread(target=read_pipe)
+        reader.start()
+        with consumer.OutputFiles(self.directory) as files:
+            consumer.process_diff_data(load_canned_diff(), files.sinks)
+        reader.join(5)
+
+        self.assertEqual(received[0], consumer.NODE_FIELDS)
+        self.assertEqual(len(received), 4)
+
+    @mock.patch('consumer.STREAM_PARSER', 0)
+    @mock.patch('osmdiff.AugmentedDiff')
+    def test_main_writes_batch_to_output_dir(self, MockAugmentedDiff):
+        consumer.OUTPUT_DIR = os.path.join(self.directory, 'out')
+        consumer.NODES = 1
+        consumer.TAGS = 1
+        etag_path = os.path.join(self.directory, 'etag.txt')
+
+        def make_adiff(*args, **kwargs):
+            adiff = load_canned_diff()
+            self.enterContext(mock.patch.object(adiff, 'retrieve', return_value=200))
+            return adiff
+
+        MockAugmentedDiff.side_effect = make_adiff
+        stdout_buffer = io.StringIO()
+        with mock.patch('sys.argv', ['consumer.py', '100', etag_path, '101']), redirect_stdout(stdout_buffer):
+            consumer.main()
+
+        self.assertNotIn('epochMillis', stdout_buffer.getvalue())
+        nodes = self.read(os.path.join('out', 'nodes.csv'))
+        self.assertEqual(nodes.count(consumer.NODE_FIELDS), 1)
+        self.assertEqual(len(nodes), 7)  # header plus three nodes from each of two diffs
+        self.assertEqual(sorted(os.listdir(consumer.OUTPUT_DIR)), ['nodes.csv', 'tags.csv'])
+        with open(etag_path) as fh:
+            self.assertEqual(fh.read(), '102')
+
+
+EXAMPLE_OSC = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'example', '343.osc')
+
+
+class TestOsmChangeFiles(PatchFlagsMixin, unittest.TestCase):
+    def setUp(self):
+        self.patch_flags(0, VERBOSE=0, OUTPUT_DIR=consumer.OUTPUT_DIR)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reads_every_action(self):
+        changes = list(consumer.OsmChangeFile(EXAMPLE_OSC))
+        counts = {}
+        for action, entity in changes:
+            key = (action, consumer.entity_type(entity))
+            counts[key] = counts.get(key, 0) + 1
+
+        self.assertEqual(counts, {
+            ('create', 'node'): 1187, ('create', 'way'): 220, ('create', 'relation'): 2,
+            ('modify', 'node'): 98, ('modify', 'way'): 110, ('modify', 'relation'): 7,
+            ('delete', 'node'): 6, ('delete', 'way'): 1,
+        })
+        action, node = changes[0]
+        self.assertEqual(action, 'modify')
+        self.assertEqual(node.attribs['id'], '389841631')
+        self.assertEqual(node.attribs['lat'], '41.7194118')
+
+        way = next(entity for _, entity in changes if entity.attribs['id'] == '8003743')
+        assert isinstance(way, consumer.osmdiff.Way)
+        self.assertEqual(way.tags['highway'], 'service')
+        self.assertEqual(len(way.nodes), 32)
+
+    def test_rows_from_gzip_file(self):
+        path = os.path.join(self.directory, '343.osc.gz')
+        with open(EXAMPLE_OSC, 'rb') as src, gzip.open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+        sinks = consumer.process_diff_data(consumer.OsmChangeFile(path), {'nodes': [], 'deletions': []})
+        self.assertEqual(len(sinks['nodes']), 1187 + 98)
+        self.assertEqual(len(sinks['deletions']), 7)
+        self.assertEqual(sinks['nodes'][0][:3], (1743452692000, '389841631', '5'))
+
+    def test_osc_paths(self):
+        for name in ['000/001/344.osc.gz', '000/001/343.osc', '000/002/000.osc', '000/001/state.txt']:
+            path = os.path.join(self.directory, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+        self.assertEqual(consumer.osc_paths([self.directory, EXAMPLE_OSC]), [
+            os.path.join(self.directory, '000/001/343.osc'),
+            os.path.join(self.directory, '000/001/344.osc.gz'),
+            os.path.join(self.directory, '000/002/000.osc'),
+            EXAMPLE_OSC,
+        ])
+
+    def test_main_with_osc_files(self):
+        consumer.OUTPUT_DIR = os.path.join(self.directory, 'out')
+        consumer.WAYS = 1
+        with mock.patch('sys.argv', ['consumer.py', '--osc', EXAMPLE_OSC, EXAMPLE_OSC]):
+            consumer.main()
+
+        with open(os.path.join(consumer.OUTPUT_DIR, 'ways.csv'), newline='') as fh:
+            ways = list(csv.reader(fh))
+        self.assertEqual(ways[0], consumer.WAY_FIELDS)
+        self.assertEqual(len(ways), 1 + 2 * (220 + 110))
+
+    def test_parse_args_requires_sequence_without_osc(self):
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            consumer.parse_args(['12345'])
+        self.assertEqual(consumer.parse_args(['--osc', 'a.osc']).osc, ['a.osc'])
+
+
+class CannedDiffHandler(BaseHTTPRequestHandler):
+    """Serves tests/data/augmented_diff.xml for the sequence numbers in server.available."""
+
+    def do_GET(self):
+        server = self.server
+        assert isinstance(server, CannedDiffServer)
+        if urlparse(self.path).path.endswith('/augmented_diff_status'):
+            # The newest published sequence number
+            body = str(max(server.available, default=0)).encode()
+            with server.lock:
+                server.status_requests += 1
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        sequence_number = int(parse_qs(urlparse(self.path).query)['id'][0])
+        with server.lock:
+            server.asked.append(sequence_number)
+        if sequence_number not in server.available:
+            self.send_response(404)
+            self.end_headers()
+            return
+        # Earlier sequence numbers answer more slowly, so downloads complete out of order
+        time.sleep(server.delays.get(sequence_number, 0))
+        with server.lock:
+            server.requested.append(sequence_number)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+        # Optionally hold back the rest of the body after the first action, or drop
+        # the connection there once
+        split = server.body.index(b'</action>') + len(b'</action>')
+        if sequence_number in server.drop:
+            server.drop.discard(sequence_number)
+            self.wfile.write(server.body[:split])
+            return
+        if not server.hold:
+            split = 0
+        self.wfile.write(server.body[:split])
+        self.wfile.flush()
+        if server.hold:
+            server.hold.wait(5)
+        self.wfile.write(server.body[split:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CannedDiffServer(ThreadingHTTPServer):
+    """A CannedDiffHandler server on a free local port, with what it serves and was asked."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), CannedDiffHandler)
+        with open(CANNED_DIFF, 'rb') as fh:
+            self.body = fh.read()
+        self.available = set(range(100, 106))
+        self.delays = {100: 0.2, 101: 0.1}
+        self.hold: threading.Event | None = None
+        self.drop = set()
+        self.requested = []
+        self.status_requests = 0
+        # Every diff request, published or not (requested has the published ones)
+        self.asked = []
+        self.lock = threading.Lock()
+
+
+class CannedDiffServerTestCase(PatchFlagsMixin, unittest.TestCase):
+    """Runs a local stand-in for the Overpass augmented diff endpoint."""
+
+    def setUp(self):
+        self.server = CannedDiffServer()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        self.patch_flags(
+            OVERPASS_URL='http://127.0.0.1:%d/api/augmented_diff?id={sequence_number}' % self.server.server_port)
+
+    def tearDown(self):
+        if self.server.hold:
+            self.server.hold.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, sequence_number):
+        return consumer.OVERPASS_URL.format(sequence_number=sequence_number)
+
+
+class TestAugmentedDiffStream(CannedDiffServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch_flags(1, VERBOSE=0)
+
+    def test_rows_match_osmdiff(self):
+        names = [name for name, _, _ in consumer.output_types()]
+        streamed = consumer.process_diff_data(
+            consumer.AugmentedDiffStream(self.url(100), 100), {name: [] for name in names})
+        parsed = consumer.process_diff_data(load_canned_diff(), {name: [] for name in names})
+
+        self.assertEqual(streamed, parsed)
+        self.assertEqual([len(streamed[name]) for name in ['nodes', 'ways', 'relations', 'members', 'deletions']],
+                         [3, 1, 1, 2, 1])
+
+    def test_yields_before_the_body_is_complete(self):
+        self.server.hold = threading.Event()
+        diff = consumer.AugmentedDiffStream(self.url(100), 100)
+        entities = iter(diff)
+
+        action, node = next(entities)
+        self.assertEqual((action, node.attribs['id']), ('create', '12895640020'))
+        self.assertEqual(node.tags, {'highway': 'street_lamp'})
+        self.assertFalse(self.server.hold.is_set())
+
+        self.server.hold.set()
+        self.assertEqual([a for a, _ in entities], ['create', 'create', 'create', 'modify', 'delete'])
+
+    def test_deletion_keeps_location_of_last_version(self):
+        action, deleted = list(consumer.AugmentedDiffStream(self.url(100), 100))[-1]
+        self.assertEqual((action, deleted.attribs['version']), ('delete', '4'))
+        self.assertEqual(consumer.entity_bounds(deleted), (9.98, 53.45, 9.98, 53.45))
+
+    def test_body_can_only_be_read_once(self):
+        diff = consumer.AugmentedDiffStream(self.url(100), 100)
+        self.assertEqual(len(list(diff)), 6)
+        self.assertIsNone(diff.body)
+        with self.assertRaises(RuntimeError):
+            list(diff)
+
+    @mock.patch('consumer.FETCH_RETRIES', 0)
+    def test_no_retries_still_requests_once(self):
+        diff = consumer.AugmentedDiffStream(self.url(100), 100)
+        self.assertEqual(diff.status, 200)
+        self.assertEqual(len(list(diff)), 6)
+        self.assertEqual(self.server.requested, [100])
+
+    def test_unpublished_diff(self):
+        diff = consumer.AugmentedDiffStream(self.url(200), 200)
+        self.assertEqual(diff.status, 404)
+        self.assertIsNone(diff.body)
+
+    def test_cached_diff_is_read_without_request(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with mock.patch('consumer.DIFF_CACHE_DIR', cache_dir):
+            first, status = consumer.retrieve_diff(100)
+            downloaded = list(consumer.iter_entities(first))
+            self.assertEqual(self.server.requested, [100])
+
+            second, status = consumer.retrieve_diff(100)
+            assert isinstance(second, consumer.AugmentedDiffStream)
+            self.assertEqual(status, 200)
+            self.assertIsNone(second.response)
+            cached = list(consumer.iter_entities(second))
+            self.assertEqual(self.server.requested, [100])
+            cache = consumer.diff_cache()
+            assert cache is not None
+            self.assertEqual(cache.hits, 1)
+
+        self.assertEqual([(a, e.attribs) for a, e in cached], [(a, e.attribs) for a, e in downloaded])
+
+    def test_partly_read_diff_is_not_cached(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with mock.patch('consumer.DIFF_CACHE_DIR', cache_dir):
+            diff, status = consumer.retrieve_diff(101)
+            assert isinstance(diff, consumer.AugmentedDiffStream)
+            entities = iter(diff)
+            next(entities)
+            entities.close()
+
+            self.assertEqual(os.listdir(cache_dir), [])
+            diff, status = consumer.retrieve_diff(101)
+            assert isinstance(diff, consumer.AugmentedDiffStream)
+            self.assertIsNotNone(diff.response)
+
+    def test_stream_csv_data_keeps_sections_per_type(self):
+        consumer.WAYS = consumer.RELATIONS = consumer.MEMBERS = consumer.TAGS = 0
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            sinks = consumer.stream_csv_data(consumer.AugmentedDiffStream(self.url(100), 100))
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], ','.join(consumer.NODE_FIELDS))
+        self.assertEqual(lines[4], ','.join(consumer.DELETION_FIELDS))
+        self.assertEqual(len(lines), 6)
+        self.assertEqual({name: len(rows) for name, rows in sinks.items()}, {'nodes': 3, 'deletions': 1})
+
+
+class TestPrefetch(CannedDiffServerTestCase):
+    def test_prefetch_yields_in_sequence_order(self):
+        results = list(consumer.prefetch_diffs(range(100, 106), workers=4, window=4))
+
+        self.assertEqual([r[0] for r in results], [100, 101, 102, 103, 104, 105])
+        for sequence_number, adiff, status in results:
+            self.assertEqual(status, 200)
+            self.assertEqual(adiff.sequence_number, sequence_number)
+            self.assertEqual(len(list(consumer.iter_entities(adiff))), 6)
+
+        # The slow first diffs did not hold back the downloads behind them
+        self.assertNotEqual(self.server.requested[0], 100)
+
+    def test_prefetch_window_bounds_in_flight_downloads(self):
+        diffs = consumer.prefetch_diffs(range(100, 106), workers=4, window=2)
+        sequence_number, adiff, status = next(diffs)
+        self.assertEqual(sequence_number, 100)
+        diffs.close()
+
+        # Only the window (plus the one refill after 100 was consumed) was requested
+        self.assertLessEqual(len(self.server.requested), 3)
+
+    def test_prefetch_reports_unpublished_diff(self):
+        results = list(consumer.prefetch_diffs(range(104, 108), workers=2, window=4))
+        self.assertEqual([r[2] for r in results], [200, 200, 404, 404])
+
+    def test_prefetch_sequential(self):
+        results = list(consumer.prefetch_diffs(range(100, 103), workers=1))
+        self.assertEqual([r[0] for r in results], [100, 101, 102])
+        self.assertEqual(self.server.requested, [100, 101, 102])
+
+    def test_prefetch_reads_bodies_ahead(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with mock.patch('consumer.DIFF_CACHE_DIR', cache_dir):
+            results = list(consumer.prefetch_diffs(range(100, 103), workers=2, window=4))
+
+            cache = consumer.diff_cache()
+            assert cache is not None
+            for sequence_number, adiff, status in results:
+                assert isinstance(adiff, consumer.AugmentedDiffStream)
+                # Downloaded, cached and closed before anything was parsed
+                self.assertIsNone(adiff.response)
+                self.assertGreater(adiff.bytes_downloaded, 0)
+                cached = cache.open(adiff.cache_key)
+                assert cached is not None
+                cached.close()
+                self.assertEqual(len(list(consumer.iter_entities(adiff))), 6)
+
+    @mock.patch('consumer.STREAM_PARSER', 0)
+    def test_prefetch_with_osmdiff_parser(self):
+        results = list(consumer.prefetch_diffs(range(100, 103), workers=2))
+        self.assertEqual([r[0] for r in results], [100, 101, 102])
+        for _, adiff, status in results:
+            assert isinstance(adiff, AugmentedDiff)
+            self.assertEqual(len(adiff.create), 4)
+
+
+class TestFollow(CannedDiffServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.available = set(range(100, 103))
+        self.server.delays = {}
+        self.directory = tempfile.mkdtemp()
+        self.patch_flags(0, VERBOSE=0, NODES=1, FOLLOW_MIN_INTERVAL=0.01, FOLLOW_MAX_INTERVAL=0.05,
+                         ROTATE_SEQUENCES=2, OUTPUT_DIR=os.path.join(self.directory, 'out'))
+        self.etag_path = os.path.join(self.directory, 'etag.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def start(self, start_sequence):
+        self.stop = threading.Event()
+        self.result = []
+        self.thread = threading.Thread(
+            target=lambda: self.result.append(consumer.follow(start_sequence, self.etag_path, self.stop)))
+        self.thread.start()
+
+    def wait_for_etag(self, expected):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if os.path.exists(self.etag_path):
+                with open(self.etag_path) as fh:
+                    if fh.read() == str(expected):
+                        return
+            time.sleep(0.01)
+        self.fail(f'etag never reached {expected}')
+
+    def finish(self):
+        self.stop.set()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+
+    def read(self, name):
+        with open(os.path.join(consumer.OUTPUT_DIR, name), newline='') as fh:
+            return list(csv.reader(fh))
+
+    def test_follows_new_diffs_and_rotates_files(self):
+        self.start(100)
+        self.wait_for_etag(103)
+
+        # 100 and 101 form a complete window, 102 starts the next one
+        self.assertEqual(sorted(os.listdir(consumer.OUTPUT_DIR)), ['nodes-100.csv', 'nodes-102.csv.part'])
+        self.assertEqual(len(self.read('nodes-100.csv')), 1 + 2 * 3)
+
+        # A diff published later is picked up by polling
+        self.server.available.add(103)
+        self.wait_for_etag(104)
+        self.finish()
+
+        self.assertEqual(self.result, [104])
+        self.assertEqual(self.server.requested.count(103), 1)
+        # Only the polls asked for a diff beyond the newest published one
+        self.assertLessEqual(set(self.server.asked), {100, 101, 102, 103, 104})
+        self.assertGreater(self.server.status_requests, 0)
+        self.assertEqual(sorted(os.listdir(consumer.OUTPUT_DIR)), ['nodes-100.csv', 'nodes-102.csv.part'])
+        self.assertEqual(len(self.read('nodes-102.csv.part')), 1 + 2 * 3)
+
+    def test_restart_appends_to_unfinished_window(self):
+        self.server.available = {100}
+        self.start(100)
+        self.wait_for_etag(101)
+        self.finish()
+
+        self.server.available = {101, 102}
+        self.start(101)
+        self.wait_for_etag(103)
+        self.finish()
+
+        nodes = self.read('nodes-100.csv')
+        self.assertEqual(nodes.count(consumer.NODE_FIELDS), 1)
+        self.assertEqual(len(nodes), 1 + 2 * 3)
+
+    def test_restart_in_later_window_finishes_earlier_one(self):
+        self.server.available = {100}
+        self.start(100)
+        self.wait_for_etag(101)
+        self.finish()
+
+        self.server.available = {102}
+        self.start(102)
+        self.wait_for_etag(103)
+        self.finish()
+
+        self.assertEqual(sorted(os.listdir(consumer.OUTPUT_DIR)), ['nodes-100.csv', 'nodes-102.csv.part'])
+        self.assertEqual(self.read('nodes-100.csv').count(consumer.NODE_FIELDS), 1)
+
+    def test_dropped_connection_is_converted_again(self):
+        self.server.drop = {100}
+        self.server.available = {100}
+        with mock.patch.multiple('consumer', VERSION_INDEX=os.path.join(self.directory, 'versions.idx'),
+                                 CHANGESETS=1), redirect_stderr(io.StringIO()) as stderr:
+            self.start(100)
+            self.wait_for_etag(101)
+            self.finish()
+            versions = consumer.version_index()
+            assert versions is not None
+            versions.close()
+
+        self.assertIn('Retrying sequence 100', stderr.getvalue())
+        self.assertEqual(self.server.requested, [100, 100])
+        # The entities read before the connection dropped were not skipped
+        self.assertEqual({row[1] for row in self.read('nodes-100.csv.part')[1:]},
+                         {'12895640020', '12895640021', '33820695'})
+        # and are counted in the changesets
+        expected = consumer.process_diff_data(
+            load_canned_diff(),
+            {'changesets': []})['changesets']
+        self.assertEqual(self.read('changesets-100.csv.part')[1:],
+                         [['' if value is None else str(value) for value in row] for row in expected])
+
+    def test_writes_single_type_to_stdout(self):
+        consumer.OUTPUT_DIR = ''
+        with redirect_stdout(io.StringIO()) as stdout:
+            self.start(100)
+            self.wait_for_etag(103)
+            self.finish()
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], ','.join(consumer.NODE_FIELDS))
+        self.assertEqual(len(lines), 1 + 3 * 3)
+
+    def test_rejects_several_types_on_stdout(self):
+        consumer.OUTPUT_DIR = ''
+        consumer.TAGS = 1
+        with redirect_stdout(io.StringIO()) as stdout, self.assertRaises(ValueError):
+            consumer.follow(100, self.etag_path, threading.Event())
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(self.server.asked, [])
+
+    def test_write_etag_replaces_file(self):
+        consumer.write_etag(self.etag_path, 100)
+        consumer.write_etag(self.etag_path, 101)
+
+        with open(self.etag_path) as fh:
+            self.assertEqual(fh.read(), '101')
+        self.assertEqual(os.listdir(self.directory), ['etag.txt'])
+
+    def test_parse_args_follow(self):
+        args = consumer.parse_args(['--follow', '100', 'etag.txt'])
+        self.assertTrue(args.follow)
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            consumer.parse_args(['--follow', '100', 'etag.txt', 'latest'])
+
+
+class TestParallelBatch(CannedDiffServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.delays = {}
+        self.patch_flags(1, VERBOSE=0, OUTPUT_DIR='')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def run_batch(self, run, start_sequence, end_sequence):
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            next_sequence = run(start_sequence, end_sequence)
+        return next_sequence, stdout.getvalue()
+
+    def test_output_matches_sequential_batch(self):
+        sequential = self.run_batch(consumer.run_batch, 100, 103)
+        parallel = self.run_batch(lambda start, end: consumer.run_parallel_batch(start, end, 2), 100, 103)
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(parallel[0], 104)
+
+        # The rows of every diff are in the section of their type
+        lines = parallel[1].splitlines()
+        self.assertEqual(lines[0], ','.join(consumer.NODE_FIELDS))
+        self.assertEqual(lines[1 + 4 * 3], ','.join(consumer.way_fields()))
+
+    def test_stops_at_first_unpublished_diff(self):
+        self.server.available = {100, 101, 103}
+        consumer.OUTPUT_DIR = os.path.join(self.directory, 'out')
+        with redirect_stderr(io.StringIO()) as stderr:
+            next_sequence = consumer.run_parallel_batch(100, 103, 2)
+
+        # 103 may have been converted, but the etag must not skip over 102
+        self.assertEqual(next_sequence, 102)
+        self.assertIn('Stopping at sequence 102', stderr.getvalue())
+        with open(os.path.join(consumer.OUTPUT_DIR, 'nodes.csv'), newline='') as fh:
+            self.assertEqual(len(list(csv.reader(fh))), 1 + 2 * 3)
+
+    def test_rejects_columnar_output(self):
+        consumer.OUTPUT_DIR = os.path.join(self.directory, 'out')
+        with mock.patch('consumer.OUTPUT_FORMAT', 'parquet'), self.assertRaises(ValueError):
+            consumer.run_parallel_batch(100, 101, 2)
+
+    def test_parse_args_workers(self):
+        self.assertEqual(consumer.parse_args(['--workers', '4', '100', 'etag.txt']).workers, 4)
+        for argv in [['--workers', '0', '100', 'etag.txt'], ['--workers', '2', '--follow', '100', 'etag.txt']]:
+            with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                consumer.parse_args(argv)
+
+
+class TestMetrics(CannedDiffServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.delays = {}
+        self.directory = tempfile.mkdtemp()
+        self.patch_flags(0, VERBOSE=0, NODES=1, OUTPUT_DIR=os.path.join(self.directory, 'out'),
+                         METRICS=os.path.join(self.directory, 'metrics.jsonl'), METRICS_FORMAT='json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def records(self):
+        with open(consumer.METRICS) as fh:
+            return [json.loads(line) for line in fh]
+
+    def check_records(self, records):
+        self.assertEqual([r['sequence'] for r in records], [100, 101, 102])
+        for record in records:
+            self.assertEqual(record['entities'], {'node': 4, 'way': 1, 'relation': 1})
+            self.assertEqual(record['rows'], {'nodes': 3})
+            self.assertEqual(record['bytes_downloaded'], len(self.server.body))
+            self.assertEqual(record['newest_timestamp'], '2025-06-07T20:25:40Z')
+            self.assertGreater(record['seconds']['parse'], 0)
+            self.assertGreater(record['lag_seconds'], 0)
+
+    def test_batch_writes_one_record_per_diff(self):
+        self.assertEqual(consumer.run_batch(100, 102), 103)
+        self.check_records(self.records())
+
+    def test_parallel_batch_records_worker_metrics(self):
+        self.assertEqual(consumer.run_parallel_batch(100, 102, 2), 103)
+        self.check_records(self.records())
+
+    def test_metrics_to_stderr(self):
+        consumer.METRICS = 'stderr'
+        consumer.OUTPUT_DIR = ''
+        with redirect_stdout(io.StringIO()) as stdout, redirect_stderr(io.StringIO()) as stderr:
+            consumer.run_batch(100, 100)
+
+        self.assertEqual(json.loads(stderr.getvalue())['sequence'], 100)
+        self.assertNotIn('sequence', stdout.getvalue())
 
 
 if __name__ == '__main__':
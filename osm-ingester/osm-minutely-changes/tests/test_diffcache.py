@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+# Add parent directory to path so we can import diffcache.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import diffcache
+
+
+class TestDiffCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store(self, cache, key, body):
+        writer = cache.writer(key)
+        writer.write(body)
+        writer.commit()
+
+    def test_cache_key(self):
+        self.assertEqual(diffcache.cache_key(6698250, (0.0, 0.0, 0.0, 0.0)), '6698250_0_0_0_0')
+        self.assertEqual(diffcache.cache_key(6698250, (13.1, 52.3, 13.8, 52.7)), '6698250_13.1_52.3_13.8_52.7')
+
+    def test_round_trip(self):
+        cache = diffcache.DiffCache(self.directory, 1 << 20)
+        self.assertIsNone(cache.open('100_0_0_0_0'))
+
+        self.store(cache, '100_0_0_0_0', b'<osm>100</osm>')
+        body = cache.open('100_0_0_0_0')
+        assert body is not None
+        with body:
+            self.assertEqual(body.read(), b'<osm>100</osm>')
+
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(os.listdir(self.directory), ['100_0_0_0_0.xml.gz'])
+
+    def test_aborted_body_is_not_cached(self):
+        cache = diffcache.DiffCache(self.directory, 1 << 20)
+        writer = cache.writer('100_0_0_0_0')
+        writer.write(b'<osm>')
+        writer.abort()
+
+        self.assertIsNone(cache.open('100_0_0_0_0'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_least_recently_used_is_evicted(self):
+        body = os.urandom(1000)  # does not compress
+        cache = diffcache.DiffCache(self.directory, 2500)
+        for key in ['100', '101']:
+            self.store(cache, key, body)
+        opened = cache.open('100')
+        assert opened is not None
+        opened.close()
+        self.store(cache, '102', body)
+
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.open('101'))
+        self.assertEqual(sorted(os.listdir(self.directory)), ['100.xml.gz', '102.xml.gz'])
+        self.assertLessEqual(cache.total, 2500)
+
+    def test_reopened_cache_keeps_usage_order(self):
+        body = os.urandom(1000)
+        cache = diffcache.DiffCache(self.directory, 1 << 20)
+        for key in ['100', '101', '102']:
+            self.store(cache, key, body)
+        past = time.time() - 60
+        os.utime(cache.path('101'), (past, past))
+
+        reopened = diffcache.DiffCache(self.directory, 2500)
+        self.assertEqual(list(reopened.sizes), ['101', '100', '102'])
+        self.store(reopened, '103', body)
+        self.assertEqual(list(reopened.sizes), ['102', '103'])
+
+
+if __name__ == '__main__':
+    unittest.main()
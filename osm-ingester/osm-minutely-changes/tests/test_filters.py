@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+
+# Add parent directory to path so we can import filters.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import filters
+from canned import load_canned_diff
+
+
+class TestEntityFilter(unittest.TestCase):
+    def test_expressions(self):
+        keep = filters.EntityFilter('highway building=yes amenity=cafe,restaurant w/landuse=forest nw/name r/')
+
+        self.assertTrue(keep.matches('node', {'highway': 'crossing'}))
+        self.assertTrue(keep.matches('way', {'building': 'yes', 'levels': '2'}))
+        self.assertFalse(keep.matches('way', {'building': 'house'}))
+        self.assertTrue(keep.matches('node', {'amenity': 'restaurant'}))
+        self.assertFalse(keep.matches('node', {'amenity': 'bench'}))
+        self.assertTrue(keep.matches('way', {'landuse': 'forest'}))
+        self.assertFalse(keep.matches('node', {'landuse': 'forest'}))
+        self.assertTrue(keep.matches('node', {'name': 'Hamburg'}))
+        self.assertTrue(keep.matches('relation', {}))
+        self.assertFalse(keep.matches('node', {}))
+
+    def test_values_combine_and_are_quoted(self):
+        keep = filters.EntityFilter('n/amenity=cafe amenity=bar w/amenity \'name=Main Street\'')
+
+        self.assertEqual(keep.rules['node'], (('amenity', frozenset({'cafe', 'bar'})), ('name', frozenset({'Main Street'}))))
+        self.assertEqual(keep.rules['way'], (('amenity', None), ('name', frozenset({'Main Street'}))))
+        self.assertTrue(keep.matches('node', {'name': 'Main Street'}))
+
+    def test_unknown_tags_match_by_type(self):
+        keep = filters.EntityFilter('w/highway')
+        self.assertTrue(keep.matches('way', None))
+        self.assertFalse(keep.matches('node', None))
+
+    def test_invalid_expressions(self):
+        for expression in ['', 'x/highway', '/highway', '=yes', 'highway=', 'n/=yes']:
+            with self.assertRaises(ValueError):
+                filters.EntityFilter(expression)
+
+    def test_rows_of_matching_entities_only(self):
+        outputs = ['nodes', 'ways', 'relations', 'tags', 'deletions', 'changesets']
+        with mock.patch('consumer.FILTER', 'highway=crossing,footway'):
+            sinks = consumer.process_diff_data(load_canned_diff(), {name: [] for name in outputs})
+            keep = consumer.entity_filter()
+            assert keep is not None
+            rejected = keep.rejected
+
+        self.assertEqual([row[1] for row in sinks['nodes']], ['33820695'])
+        self.assertEqual([row[1] for row in sinks['ways']], ['1389012345'])
+        self.assertEqual(sinks['relations'], [])
+        self.assertEqual({row[2] for row in sinks['tags']}, {'33820695', '1389012345'})
+        self.assertEqual(len(sinks['tags']), 5)
+        # The deleted node has no tags to go by
+        self.assertEqual([row[2] for row in sinks['deletions']], ['4711'])
+        self.assertEqual([consumer.ChangesetRow._make(row).nodesModified for row in sinks['changesets']], [1, 0])
+        self.assertEqual(rejected, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
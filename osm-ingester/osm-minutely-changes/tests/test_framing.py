@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import csv
+import gzip
+import io
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from functools import partial
+
+# Add parent directory to path so we can import framing.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import framing
+from canned import load_canned_diff
+
+
+def parse_csv(data):
+    return list(csv.reader(io.StringIO(data.decode('utf-8'))))
+
+
+class TestFraming(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.flags = {'OUTPUT_DIR': self.directory, 'OUTPUT_COMPRESSION': 'gzip', 'NODES': 1, 'WAYS': 0,
+                      'RELATIONS': 0, 'MEMBERS': 0, 'TAGS': 1, 'DELETIONS': 0, 'CHANGESETS': 0}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, sequence_numbers, **flags):
+        with mock.patch.multiple('consumer', **{**self.flags, **flags}):
+            consumer.write_diffs(load_canned_diff(n) for n in sequence_numbers)
+
+    def test_one_gzip_member_per_diff(self):
+        self.write([100, 101, 102])
+
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['nodes.csv.gz', 'nodes.csv.gz.idx', 'tags.csv.gz', 'tags.csv.gz.idx'])
+        # The file as a whole is one CSV file
+        with gzip.open(self.path('nodes.csv.gz'), 'rt', newline='') as fh:
+            rows = list(csv.reader(fh))
+        self.assertEqual(rows[0], consumer.NODE_FIELDS)
+        self.assertEqual(len(rows), 1 + 3 * 3)
+
+        index = framing.read_index(self.path('nodes.csv.gz'))
+        self.assertEqual([(sequence, rows) for sequence, _, _, rows in index],
+                         [(None, 0), (100, 3), (101, 3), (102, 3)])
+        offsets = [offset + length for _, offset, length, _ in index]
+        self.assertEqual([offset for _, offset, _, _ in index[1:]], offsets[:-1])
+        self.assertEqual(offsets[-1], os.path.getsize(self.path('nodes.csv.gz')))
+
+    def test_read_range(self):
+        self.write([100, 101, 102])
+
+        frames = list(framing.read_range(self.path('tags.csv.gz'), 101))
+        rows = parse_csv(b''.join(frames))
+        self.assertEqual(rows[0], consumer.TAG_FIELDS)
+        self.assertEqual(len(rows) - 1, framing.read_index(self.path('tags.csv.gz'))[2][3])
+        self.assertEqual(len(parse_csv(b''.join(framing.read_range(self.path('tags.csv.gz'), 101, 200)))),
+                         1 + 2 * (len(rows) - 1))
+
+        with mock.patch('sys.argv', ['framing.py', self.path('tags.csv.gz'), '101']), \
+                redirect_stdout(io.TextIOWrapper(io.BytesIO())) as stdout:
+            framing.main()
+            stdout.seek(0)
+            self.assertEqual(list(csv.reader(stdout)), rows)
+
+    @unittest.skipUnless(framing.zstandard, 'zstandard is not installed')
+    def test_zstd_frames(self):
+        self.write([100, 101], OUTPUT_COMPRESSION='zstd')
+
+        with open(self.path('nodes.csv.zst'), 'rb') as fh:
+            reader = framing.zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True)
+            rows = parse_csv(reader.read())
+        self.assertEqual(len(rows), 1 + 2 * 3)
+        self.assertEqual(parse_csv(b''.join(framing.read_range(self.path('nodes.csv.zst'), 101)))[1:], rows[4:])
+
+    def test_rotated_files_keep_their_index(self):
+        with mock.patch.multiple('consumer', **self.flags):
+            files = consumer.RotatingOutputFiles(self.directory, 2)
+            for sequence_number in (100, 101, 102):
+                consumer.convert_diff(load_canned_diff(sequence_number), files.sinks(sequence_number),
+                                      flush=partial(files.flush, sequence_number))
+            # Stopped halfway through 103: its rows are not indexed as 103
+            files.sinks(103)['nodes'].append(('1', '2', '3', '4', '5', '6', '7', '8'))
+            files.close()
+            # A restart appends to the partial window
+            files = consumer.RotatingOutputFiles(self.directory, 2)
+            consumer.convert_diff(load_canned_diff(103), files.sinks(103), flush=partial(files.flush, 103))
+            files.close()
+
+        self.assertIn('nodes-100.csv.gz.idx', os.listdir(self.directory))
+        self.assertIn('nodes-102.csv.gz.idx.part', os.listdir(self.directory))
+        self.assertEqual([(sequence, rows) for sequence, _, _, rows in
+                          framing.read_index(self.path('nodes-100.csv.gz'))], [(None, 0), (100, 3), (101, 3)])
+        with open(self.path('nodes-102.csv.gz.idx.part'), newline='') as fh:
+            self.assertEqual([row[0] for row in csv.reader(fh)], ['sequence', '', '102', '', '103'])
+        with gzip.open(self.path('nodes-102.csv.gz.part'), 'rt') as fh:
+            self.assertEqual(len(fh.read().splitlines()), 1 + 3 + 1 + 3)
+
+    def test_requires_output_dir_and_csv(self):
+        with self.assertRaises(ValueError):
+            self.write([100], OUTPUT_DIR='')
+        with self.assertRaises(ValueError):
+            self.write([100], OUTPUT_FORMAT='parquet')
+        with self.assertRaises(ValueError):
+            self.write([100], OUTPUT_COMPRESSION='bz2')
+
+
+if __name__ == '__main__':
+    unittest.main()
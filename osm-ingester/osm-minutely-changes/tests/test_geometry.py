@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import io
+import base64
+import struct
+from xml.etree import ElementTree
+
+# Add parent directory to path so we can import geometry.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import geometry
+from canned import load_canned_diff
+
+
+def canned_entities():
+    """Return the way and the relation of the canned diff."""
+    entities = [entity for _, entity in consumer.iter_entities(load_canned_diff())]
+    way = next(e for e in entities if isinstance(e, consumer.osmdiff.Way))
+    relation = next(e for e in entities if isinstance(e, consumer.osmdiff.Relation))
+    return way, relation
+
+
+def relation_with_geometry():
+    """A relation as Overpass returns it with out geom: members carry coordinates."""
+    return consumer.OSMObject.from_xml(ElementTree.fromstring(
+        '<relation id="7" version="1" timestamp="2025-06-07T20:25:30Z" changeset="1" uid="2" user="u">'
+        '<member type="way" ref="1" role="outer">'
+        '<nd ref="10" lat="53.5" lon="9.5"/><nd ref="11" lat="53.6" lon="9.75"/>'
+        '</member>'
+        '<member type="node" ref="12" role="label" lat="53.55" lon="9.6"/>'
+        '<member type="way" ref="2" role="inner"/>'
+        '</relation>'))
+
+
+def wkb_column(columns):
+    """Return the one column of WKB geometry columns."""
+    assert len(columns) == 1 and isinstance(columns[0], str)
+    return columns[0]
+
+
+def read_wkb_linestring(wkb, offset=0):
+    byte_order, kind, count = struct.unpack_from('<BII', wkb, offset)
+    values = struct.unpack_from(f'<{2 * count}d', wkb, offset + 9)
+    return (byte_order, kind, list(zip(values[::2], values[1::2])))
+
+
+class TestGeometryEncoder(unittest.TestCase):
+    def test_wkt(self):
+        way, relation = canned_entities()
+        encoder = geometry.GeometryEncoder()
+        self.assertEqual(encoder.fields, ['geometry'])
+        self.assertEqual(encoder.way(way), ('LINESTRING(9.9962891 53.4522237,9.9963102 53.4523001)',))
+        # The members of the canned relation carry no coordinates
+        self.assertEqual(encoder.relation(relation), (None,))
+        self.assertEqual(encoder.relation(relation_with_geometry()),
+                         ('GEOMETRYCOLLECTION(LINESTRING(9.5 53.5,9.75 53.6),POINT(9.6 53.55))',))
+
+    def test_precision(self):
+        way, _ = canned_entities()
+        encoder = geometry.GeometryEncoder('wkt', 5)
+        self.assertEqual(encoder.way(way), ('LINESTRING(9.99629 53.45222,9.99631 53.4523)',))
+        self.assertEqual(geometry.GeometryEncoder('bbox', 3).way(way), ('9.996', '53.452', '9.996', '53.452'))
+        self.assertEqual(geometry.GeometryEncoder('wkt', 0).number('-0.2'), '0')
+
+    def test_wkb(self):
+        way, _ = canned_entities()
+        wkb = bytes.fromhex(wkb_column(geometry.GeometryEncoder('wkb-hex').way(way)))
+        self.assertEqual(read_wkb_linestring(wkb),
+                         (1, 2, [(9.9962891, 53.4522237), (9.9963102, 53.4523001)]))
+        self.assertEqual(base64.b64decode(wkb_column(geometry.GeometryEncoder('wkb-base64').way(way))), wkb)
+
+        collection = bytes.fromhex(wkb_column(geometry.GeometryEncoder('wkb-hex').relation(relation_with_geometry())))
+        self.assertEqual(struct.unpack_from('<BII', collection), (1, 7, 2))
+        self.assertEqual(read_wkb_linestring(collection, 9), (1, 2, [(9.5, 53.5), (9.75, 53.6)]))
+        self.assertEqual(struct.unpack_from('<BIdd', collection, 9 + 9 + 32), (1, 1, 9.6, 53.55))
+
+    def test_bbox(self):
+        way, relation = canned_entities()
+        encoder = geometry.GeometryEncoder('bbox')
+        self.assertEqual(encoder.fields, geometry.BBOX_FIELDS)
+        self.assertEqual(encoder.way(way), ('9.9962891', '53.4522237', '9.9963102', '53.4523001'))
+        self.assertEqual(encoder.relation(relation), ('9.9962891', '53.4522237', '9.9963102', '53.4523001'))
+        # Without <bounds>, the box of the coordinates
+        self.assertEqual(encoder.relation(relation_with_geometry()), (9.5, 53.5, 9.75, 53.6))
+        # The coordinates of entities with <bounds> are not looked at
+        with mock.patch('geometry.way_coordinates') as coordinates, \
+                mock.patch('geometry.member_coordinates') as members:
+            encoder.way(way)
+            encoder.relation(relation)
+        coordinates.assert_not_called()
+        members.assert_not_called()
+
+    def test_none(self):
+        way, relation = canned_entities()
+        encoder = geometry.GeometryEncoder('none')
+        self.assertEqual((encoder.fields, encoder.way(way), encoder.relation(relation)), ([], (), ()))
+
+    def test_ways_without_coordinates(self):
+        osc = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'example', '343.osc')
+        way = next(e for _, e in consumer.OsmChangeFile(osc) if isinstance(e, consumer.osmdiff.Way))
+        for format in geometry.FORMATS:
+            encoder = geometry.GeometryEncoder(format)
+            self.assertEqual(encoder.way(way), (None,) * len(encoder.fields))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            geometry.GeometryEncoder('geojson')
+        with self.assertRaises(ValueError):
+            geometry.GeometryEncoder('wkt', 16)
+
+
+class TestGeometryOutput(unittest.TestCase):
+    def test_rows_match_the_fields(self):
+        for format in geometry.FORMATS:
+            with mock.patch.multiple('consumer', GEOMETRY_FORMAT=format, GEOMETRY_PRECISION='5'):
+                fields = consumer.way_fields()
+                _, ways, relations, _, _ = consumer.process_diff_data(load_canned_diff())
+                types = dict((name, names) for name, _, names in consumer.output_types())
+            self.assertEqual(fields[:6], consumer.WAY_FIELDS[:6])
+            self.assertEqual((types['ways'], types['relations']), (fields, fields))
+            self.assertEqual([len(row) for row in ways + relations], [len(fields)] * 2)
+
+    def test_bbox_header_on_stdout(self):
+        with mock.patch.multiple('consumer', GEOMETRY_FORMAT='bbox', WAYS=1, NODES=0, RELATIONS=0,
+                                 MEMBERS=0, TAGS=0, VERBOSE=0), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            consumer.output_csv_data(*consumer.process_diff_data(load_canned_diff()))
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'epochMillis,id,version,changeset,username,uid,minlon,minlat,maxlon,maxlat',
+            '1749327901000,1389012345,1,167326499,Wolfgang Holtz,8292344,9.9962891,53.4522237,9.9963102,53.4523001',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
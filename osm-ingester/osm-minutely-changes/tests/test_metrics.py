@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import unittest
+import sys
+import os
+import io
+import json
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+# Add parent directory to path so we can import metrics.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import metrics
+from canned import load_canned_diff
+
+
+class TestDiffMetrics(unittest.TestCase):
+    def measure(self):
+        adiff = load_canned_diff()
+        measure = metrics.DiffMetrics(100)
+        sinks = {'nodes': [], 'deletions': []}
+        measure.start(sinks)
+        consumer.process_diff_data(adiff, sinks, measure.count)
+        measure.finish(adiff, sinks, 167326512)
+        return measure
+
+    def test_counts_entities_and_rows(self):
+        measure = self.measure()
+        self.assertEqual(measure.entities, {'node': 4, 'way': 1, 'relation': 1})
+        self.assertEqual(measure.rows, {'nodes': 3, 'deletions': 1})
+        self.assertEqual(measure.newest_timestamp, '2025-06-07T20:25:40Z')
+        # osmdiff diffs carry no download or parse times
+        self.assertEqual((measure.seconds['download'], measure.seconds['parse']), (0.0, 0.0))
+        self.assertGreater(measure.seconds['transform'], 0.0)
+
+    def test_rows_of_this_diff_only(self):
+        sinks = {'nodes': [None] * 10}
+        measure = metrics.DiffMetrics()
+        measure.start(sinks)
+        sinks['nodes'].extend([None] * 3)
+        measure.finish(None, sinks, 0)
+        self.assertEqual(measure.rows, {'nodes': 3})
+
+    def test_record(self):
+        record = self.measure().record(now=datetime(2025, 6, 7, 20, 26, 10, tzinfo=timezone.utc))
+        self.assertEqual(record['sequence'], 100)
+        self.assertEqual(record['lag_seconds'], 30.0)
+        self.assertEqual(record['max_changeset_id'], 167326512)
+        self.assertEqual(sorted(record['seconds']), sorted(metrics.STAGES))
+        json.dumps(record)
+
+
+class TestMetricsWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def diff_metrics(self, sequence_number, nodes):
+        measure = metrics.DiffMetrics(sequence_number)
+        measure.entities['node'] = nodes
+        measure.rows = {'nodes': nodes}
+        measure.seconds['download'] = 0.5
+        return measure
+
+    def test_json_lines_are_appended(self):
+        path = os.path.join(self.directory, 'metrics.jsonl')
+        writer = metrics.MetricsWriter(path)
+        writer.write(self.diff_metrics(100, 3))
+        writer.write(self.diff_metrics(101, 5))
+
+        with open(path) as fh:
+            records = [json.loads(line) for line in fh]
+        self.assertEqual([r['sequence'] for r in records], [100, 101])
+        self.assertEqual(records[1]['entities']['node'], 5)
+
+    def test_prometheus_totals_replace_the_file(self):
+        path = os.path.join(self.directory, 'consumer.prom')
+        writer = metrics.MetricsWriter(path, 'prometheus')
+        writer.write(self.diff_metrics(100, 3))
+        writer.write(self.diff_metrics(101, 5))
+
+        with open(path) as fh:
+            lines = fh.read().splitlines()
+        self.assertIn('osm_changes_diffs_total 2', lines)
+        self.assertIn('osm_changes_entities_total{type="node"} 8', lines)
+        self.assertIn('osm_changes_rows_total{output="nodes"} 8', lines)
+        self.assertIn('osm_changes_stage_seconds_total{stage="download"} 1.0', lines)
+        self.assertIn('osm_changes_sequence_number 101', lines)
+        self.assertIn('# TYPE osm_changes_diffs_total counter', lines)
+        self.assertEqual(os.listdir(self.directory), ['consumer.prom'])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            metrics.MetricsWriter('stderr', 'xml')
+
+
+class TestTimedWriter(unittest.TestCase):
+    def test_times_writes_that_reach_the_file(self):
+        stopwatch = metrics.Stopwatch()
+        raw = io.BytesIO()
+        stream = io.TextIOWrapper(io.BufferedWriter(metrics.TimedWriter(raw, stopwatch), 16), newline='')
+        stream.write('x' * 4)
+        self.assertEqual(stopwatch.seconds, 0.0)
+        stream.write('y' * 100)
+        stream.flush()
+        self.assertGreater(stopwatch.seconds, 0.0)
+        self.assertEqual(raw.getvalue(), b'x' * 4 + b'y' * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import io
+import shutil
+import tempfile
+from contextlib import redirect_stderr
+
+# Add parent directory to path so we can import nodestore.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import nodestore
+
+# Nodes 1 and 2 are created, node 3 is only known from the snapshot
+OSC = '''<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6">
+<create>
+  <node id="1" version="1" timestamp="2025-06-07T20:25:01Z" changeset="5" uid="7" user="u" lat="53.4522237" lon="9.9962891"/>
+  <node id="2" version="1" timestamp="2025-06-07T20:25:01Z" changeset="5" uid="7" user="u" lat="53.4523001" lon="9.9963102"/>
+  <way id="10" version="1" timestamp="2025-06-07T20:25:01Z" changeset="5" uid="7" user="u">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/>
+  </way>
+</create>
+</osmChange>
+'''
+
+# As the snapshot import writes it
+NODES_CSV = '''epochMillis,id,version,changeset,username,uid,lat,lon
+1749327901000,3,2,4,u,7,53.4524,9.99635
+1749327901000,4,1,4,u,7,-33.8688197,1.0E-4
+'''
+
+
+class TestNodeStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'nodes.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_locations_are_kept(self):
+        store = nodestore.NodeStore(self.path, capacity=10)
+        store.set('12895640020', '9.9962891', '53.4522237')
+        store.set(4, -151.2092955, -33.8688197)
+        store.set(4, -151.2092956, -33.8688197)
+        self.assertEqual(store.location('12895640020'), ('9.9962891', '53.4522237'))
+        self.assertIsNone(store.location(5))
+        store.close()
+
+        reopened = nodestore.NodeStore(self.path)
+        self.assertEqual((reopened.location(4), len(reopened)), (('-151.2092956', '-33.8688197'), 2))
+        reopened.close()
+
+    def test_seed_from_nodes_csv(self):
+        csv_path = os.path.join(self.directory, 'nodes.csv')
+        with open(csv_path, 'w') as fh:
+            fh.write(NODES_CSV)
+        with mock.patch('sys.argv', ['nodestore.py', self.path, csv_path]), redirect_stderr(io.StringIO()) as stderr:
+            nodestore.main()
+        self.assertIn('2 nodes', stderr.getvalue())
+
+        store = nodestore.NodeStore(self.path)
+        self.assertEqual(store.location(3), ('9.9963500', '53.4524000'))
+        self.assertEqual(store.location(4), ('0.0001000', '-33.8688197'))
+        store.close()
+
+    def test_way_geometry_of_osmchange_files(self):
+        osc_path = os.path.join(self.directory, 'change.osc')
+        with open(osc_path, 'w') as fh:
+            fh.write(OSC)
+        seed = nodestore.NodeStore(self.path)
+        seed.set(3, '9.99635', '53.4524')
+        seed.close()
+
+        without = consumer.process_diff_data(consumer.OsmChangeFile(osc_path), {'ways': []})
+        flags = mock.patch.multiple('consumer', NODE_LOCATIONS=self.path, GEOMETRY_FORMAT='wkt', GEOMETRY_PRECISION='')
+        with flags, mock.patch.dict('consumer._services', clear=True):
+            ways = consumer.process_diff_data(consumer.OsmChangeFile(osc_path), {'ways': []})['ways']
+            consumer.save_state()
+            locations = consumer.node_store()
+            assert locations is not None
+            locations.close()
+
+        self.assertIsNone(without['ways'][0][-1])
+        self.assertEqual(ways[0][-1], 'LINESTRING(9.9962891 53.4522237,9.9963102 53.4523001,9.9963500 53.4524000)')
+        # The nodes of the diff were recorded
+        store = nodestore.NodeStore(self.path)
+        self.assertEqual(len(store), 3)
+        store.close()
+
+    def test_header_does_not_open_store(self):
+        flags = mock.patch.multiple('consumer', NODE_LOCATIONS=self.path, GEOMETRY_FORMAT='bbox')
+        with flags, mock.patch.dict('consumer._services', clear=True):
+            self.assertEqual(consumer.way_fields()[-4:], ['minlon', 'minlat', 'maxlon', 'maxlat'])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_workers_reject_store(self):
+        with mock.patch('consumer.NODE_LOCATIONS', self.path), self.assertRaises(ValueError):
+            consumer.run_parallel_batch(100, 101, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import csv
+import json
+import random
+import shutil
+import tempfile
+
+# Add parent directory to path so we can import consumer.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import regions
+from canned import load_canned_diff
+
+
+class TestRegions(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_config(self, config):
+        path = os.path.join(self.directory, 'regions.json')
+        with open(path, 'w') as fh:
+            json.dump(config, fh)
+        return path
+
+    def test_load_regions(self):
+        path = self.write_config({'berlin': [13.08, 52.33, 13.77, 52.68], 'hamburg': [9.73, 53.39, 10.33, 53.74]})
+        self.assertEqual(regions.load_regions(path), [
+            regions.Region('berlin', (13.08, 52.33, 13.77, 52.68)),
+            regions.Region('hamburg', (9.73, 53.39, 10.33, 53.74)),
+        ])
+
+    def test_invalid_regions(self):
+        for config in [{}, [], {'../berlin': [0, 0, 1, 1]}, {'berlin': [0, 0, 1]}, {'berlin': [1, 0, 0, 1]}]:
+            with self.assertRaises(ValueError):
+                regions.load_regions(self.write_config(config))
+
+    def test_grid_index_matches_linear_scan(self):
+        rng = random.Random(1)
+        boxes = []
+        for i in range(300):
+            lon, lat = rng.uniform(-180, 175), rng.uniform(-90, 85)
+            boxes.append(regions.Region(f'r{i}', (lon, lat, lon + rng.uniform(0, 5), lat + rng.uniform(0, 5))))
+        index = regions.GridIndex(boxes, 2.0)
+
+        for _ in range(2000):
+            lon, lat = rng.uniform(-180, 180), rng.uniform(-90, 90)
+            size = rng.choice([0, 0.01, 3, 400])
+            bbox = (lon, lat, lon + size, lat + size)
+            expected = [i for i, r in enumerate(boxes)
+                        if bbox[0] <= r.bbox[2] and r.bbox[0] <= bbox[2] and bbox[1] <= r.bbox[3] and r.bbox[1] <= bbox[3]]
+            self.assertEqual(index.query(bbox), expected)
+
+    def test_box_edges_belong_to_the_region(self):
+        index = regions.GridIndex([regions.Region('a', (9.0, 53.0, 10.0, 54.0))])
+        self.assertEqual(index.query((10.0, 54.0, 10.0, 54.0)), [0])
+        self.assertEqual(index.query((-9.5, 53.5, -9.5, 53.5)), [])
+
+    def test_entity_bounds(self):
+        changes = list(consumer.iter_entities(load_canned_diff()))
+        bounds = {entity.attribs['id']: consumer.entity_bounds(entity) for _, entity in changes}
+
+        self.assertEqual(bounds['12895640020'], (9.9962891, 53.4522237, 9.9962891, 53.4522237))
+        self.assertEqual(bounds['1389012345'], (9.9962891, 53.4522237, 9.9963102, 53.4523001))
+        # The deletion has no coordinates of its own, only those of its last version
+        self.assertEqual(bounds['4711'], (9.98, 53.45, 9.98, 53.45))
+
+
+class TestRegionOutput(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        flags = mock.patch.multiple('consumer', VERBOSE=0, NODES=1, WAYS=0, RELATIONS=0, MEMBERS=0, TAGS=0,
+                                    DELETIONS=1, OUTPUT_DIR=os.path.join(self.directory, 'out'),
+                                    REGIONS=os.path.join(self.directory, 'regions.json'))
+        flags.start()
+        self.addCleanup(flags.stop)
+        with open(consumer.REGIONS, 'w') as fh:
+            json.dump({
+                'harburg': [9.97, 53.44, 10.0, 53.46],
+                'streetlamps': [9.996, 53.452, 9.997, 53.453],
+                'berlin': [13.08, 52.33, 13.77, 52.68],
+            }, fh)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, region, name):
+        with open(os.path.join(consumer.OUTPUT_DIR, region, name), newline='') as fh:
+            return list(csv.reader(fh))
+
+    def test_rows_are_routed_to_every_matching_region(self):
+        consumer.write_diffs([load_canned_diff(), load_canned_diff()])
+
+        self.assertEqual(sorted(os.listdir(consumer.OUTPUT_DIR)), ['berlin', 'harburg', 'streetlamps'])
+        harburg = self.read('harburg', 'nodes.csv')
+        self.assertEqual(harburg[0], consumer.NODE_FIELDS)
+        self.assertEqual([row[1] for row in harburg[1:]], ['12895640020', '12895640021', '33820695'] * 2)
+        self.assertEqual([row[2] for row in self.read('harburg', 'deletions.csv')[1:]], ['4711', '4711'])
+
+        streetlamps = self.read('streetlamps', 'nodes.csv')
+        self.assertEqual([row[1] for row in streetlamps[1:]], ['12895640020', '12895640021'] * 2)
+        self.assertEqual(len(self.read('streetlamps', 'deletions.csv')), 1)
+
+        self.assertEqual(self.read('berlin', 'nodes.csv'), [consumer.NODE_FIELDS])
+
+    def test_route_skips_unlocated_entities(self):
+        with consumer.open_output_files(consumer.OUTPUT_DIR) as files:
+            assert isinstance(files, regions.RegionOutputFiles)
+            consumer.process_diff_data(consumer.OsmChangeFile(os.path.join(
+                os.path.dirname(__file__), '..', '..', '..', 'example', '343.osc')), files.sinks, files.route)
+
+        # osmChange ways and relations have no bounds; nodes, even deleted ones, have coordinates
+        self.assertEqual(files.unlocated, 220 + 110 + 2 + 7 + 1)
+
+    def test_regions_require_output_dir(self):
+        consumer.OUTPUT_DIR = ''
+        with self.assertRaises(ValueError):
+            consumer.write_diffs([load_canned_diff()])
+
+    def test_follow_rejects_regions(self):
+        with self.assertRaises(ValueError), mock.patch('consumer.retrieve_diff') as retrieve_diff:
+            consumer.follow(100, os.path.join(self.directory, 'etag.txt'), None)
+        retrieve_diff.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import io
+import shutil
+import tempfile
+import threading
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Add parent directory to path so we can import sequence.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import sequence
+from canned import CANNED_DIFF
+
+
+def epoch_millis(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class TestConversion(unittest.TestCase):
+    def test_sequence_for_millis(self):
+        # The diff of 2025-06-07 20:26 UTC
+        self.assertEqual(sequence.sequence_for_millis(epoch_millis(2025, 6, 7, 20, 25, 1)), 6698250)
+        self.assertEqual(sequence.sequence_for_millis(epoch_millis(2025, 6, 7, 20, 26)), 6698250)
+        self.assertEqual(sequence.sequence_for_millis(epoch_millis(2025, 6, 7, 20, 26) + 1), 6698251)
+
+    def test_millis_for_sequence(self):
+        self.assertEqual(sequence.millis_for_sequence(6698250), epoch_millis(2025, 6, 7, 20, 26))
+        for sequence_number in [0, 1, 6698250]:
+            millis = sequence.millis_for_sequence(sequence_number)
+            self.assertEqual(sequence.sequence_for_millis(millis), sequence_number)
+            self.assertEqual(sequence.sequence_for_millis(millis - 59999), sequence_number)
+
+    def test_matches_the_shell_conversion(self):
+        # (seconds + 59) / 60 - 22457216, as osm-ingester.sh computed it
+        for millis in [epoch_millis(2024, 1, 1), epoch_millis(2025, 6, 7, 20, 25, 1), 1749327901000]:
+            seconds = millis // 1000
+            self.assertEqual(sequence.sequence_for_millis(millis), (seconds + 59) // 60 - 22457216)
+
+    def test_parse_etag(self):
+        self.assertEqual(sequence.parse_etag('6698250\n'), 6698250)
+        self.assertEqual(sequence.parse_etag('0'), 0)
+        self.assertEqual(sequence.parse_etag('-1749327901000\n'), 6698250)
+        for etag in ['-0', '', 'latest', '-1000']:
+            with self.assertRaises(ValueError):
+                sequence.parse_etag(etag)
+
+    def test_etag_argument(self):
+        self.assertEqual(consumer.parse_args(['-1749327901000', 'etag.txt']).sequence_number, 6698250)
+        with redirect_stderr(io.StringIO()) as stderr, self.assertRaises(SystemExit):
+            consumer.parse_args(['-0', 'etag.txt'])
+        self.assertIn('no snapshot timestamp', stderr.getvalue())
+
+
+class StateHandler(BaseHTTPRequestHandler):
+    """A stand-in for Overpass: the status endpoint and the canned diff for every published sequence."""
+
+    def do_GET(self):
+        server = self.server
+        assert isinstance(server, StateServer)
+        url = urlparse(self.path)
+        with server.lock:
+            server.requested.append(url.path)
+        if url.path == '/api/augmented_diff_status':
+            body = b'%d\n' % server.latest
+        elif url.path == '/api/augmented_diff' and int(parse_qs(url.query)['id'][0]) <= server.latest:
+            body = server.body
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StateServer(ThreadingHTTPServer):
+    """A StateHandler server on a free local port, with the paths it was asked for."""
+
+    def __init__(self, latest):
+        super().__init__(('127.0.0.1', 0), StateHandler)
+        with open(CANNED_DIFF, 'rb') as fh:
+            self.body = fh.read()
+        self.latest = latest
+        self.requested = []
+        self.lock = threading.Lock()
+
+
+class TestReplicationState(unittest.TestCase):
+    def setUp(self):
+        self.server = StateServer(6698251)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = 'http://127.0.0.1:%d/api/' % self.server.server_port
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_latest_is_cached(self):
+        state = sequence.ReplicationState(self.base + 'augmented_diff_status', max_age=60)
+        self.assertEqual(state.latest(), 6698251)
+        self.server.latest = 6698252
+        self.assertEqual(state.latest(), 6698251)
+        self.assertEqual(state.latest(refresh=True), 6698252)
+        self.assertEqual(state.latest_millis(), epoch_millis(2025, 6, 7, 20, 28))
+        self.assertEqual(self.server.requested, ['/api/augmented_diff_status'] * 2)
+
+    def test_state_url_follows_overpass_url(self):
+        with mock.patch.multiple('consumer', OVERPASS_URL=self.base + 'augmented_diff?id={sequence_number}',
+                                 OVERPASS_STATE_URL=''):
+            self.assertEqual(consumer.state_url(), self.base + 'augmented_diff_status')
+        with mock.patch.multiple('consumer', OVERPASS_URL='', OVERPASS_STATE_URL=''):
+            self.assertEqual(consumer.state_url(), 'https://overpass-api.de/api/augmented_diff_status')
+
+    def test_main_starts_after_snapshot_timestamp(self):
+        etag_path = os.path.join(self.directory, 'etag.txt')
+        flags = {'OVERPASS_URL': self.base + 'augmented_diff?id={sequence_number}', 'OVERPASS_STATE_URL': '',
+                 'NODES': 1, 'VERBOSE': 0, 'FETCH_WORKERS': 1}
+        argv = ['consumer.py', '-1749327901000', etag_path, 'latest']
+        with mock.patch.multiple('consumer', **flags), mock.patch.dict('consumer._services', clear=True), \
+                mock.patch('sys.argv', argv), \
+                redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            consumer.main()
+
+        with open(etag_path) as fh:
+            self.assertEqual(fh.read(), '6698252')
+        self.assertEqual(self.server.requested, [
+            '/api/augmented_diff_status', '/api/augmented_diff', '/api/augmented_diff'])
+
+
+if __name__ == '__main__':
+    unittest.main()
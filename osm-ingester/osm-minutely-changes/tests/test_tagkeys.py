@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import csv
+import shutil
+import tempfile
+
+# Add parent directory to path so we can import tagkeys.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import tagkeys
+from canned import load_canned_diff
+
+
+class TestTagKeyDictionary(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tag_keys.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, newline='') as fh:
+            return list(csv.reader(fh))
+
+    def test_ids_are_kept_across_runs(self):
+        dictionary = tagkeys.TagKeyDictionary(self.path)
+        self.assertEqual([dictionary.key_id(key) for key in ['highway', 'name', 'highway']], [1, 2, 1])
+        dictionary.save()
+
+        reopened = tagkeys.TagKeyDictionary(self.path)
+        self.assertEqual(reopened.key_id('name'), 2)
+        self.assertEqual(reopened.key_id('building'), 3)
+        reopened.save()
+
+        self.assertEqual(self.read(self.path), [['keyId', 'key'], ['1', 'highway'], ['2', 'name'], ['3', 'building']])
+        self.assertEqual(os.listdir(self.directory), ['tag_keys.csv'])
+
+    def test_unchanged_dictionary_is_not_written(self):
+        dictionary = tagkeys.TagKeyDictionary(self.path)
+        dictionary.save()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_invalid_file(self):
+        for content in ['id,name\n1,highway\n', 'keyId,key\n1,highway\n3,name\n']:
+            with open(self.path, 'w') as fh:
+                fh.write(content)
+            with self.assertRaises(ValueError):
+                tagkeys.TagKeyDictionary(self.path)
+
+    def test_process_tags_with_key_ids(self):
+        dictionary = tagkeys.TagKeyDictionary(self.path)
+        dictionary.key_id('highway')
+        sinks = consumer.process_diff_data(load_canned_diff(), {'tags': []})
+        plain = sinks['tags']
+
+        services = consumer.diff_services()._replace(tag_keys=dictionary)
+        keyed = consumer.process_diff_data(load_canned_diff(), {'tags': []}, services=services)['tags']
+
+        self.assertEqual([row[3] for row in keyed[:3]], [1, 1, 2])
+        names = {key_id: key for key, key_id in dictionary.ids.items()}
+        self.assertEqual([row[:3] + (names[row[3]],) + row[4:] for row in keyed], plain)
+
+    def test_batch_writes_key_ids_and_dictionary(self):
+        output_dir = os.path.join(self.directory, 'out')
+        flags = {'TAG_KEY_DICTIONARY': self.path, 'OUTPUT_DIR': output_dir, 'TAGS': 1, 'VERBOSE': 0,
+                 'NODES': 0, 'WAYS': 0, 'RELATIONS': 0, 'MEMBERS': 0, 'DELETIONS': 0}
+        with mock.patch.multiple('consumer', **flags), mock.patch.dict('consumer._services', clear=True):
+            consumer.write_diffs([load_canned_diff()])
+            consumer.save_tag_keys()
+
+        tags = self.read(os.path.join(output_dir, 'tags.csv'))
+        self.assertEqual(tags[0], consumer.KEYED_TAG_FIELDS)
+        self.assertEqual(tags[1], ['1749327901000', 'node', '12895640020', '1', 'street_lamp'])
+        self.assertEqual(self.read(self.path)[1:3], [['1', 'highway'], ['2', 'surface']])
+
+    def test_workers_reject_dictionary(self):
+        with mock.patch('consumer.TAG_KEY_DICTIONARY', self.path), self.assertRaises(ValueError):
+            consumer.run_parallel_batch(100, 101, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
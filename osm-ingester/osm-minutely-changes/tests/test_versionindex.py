@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import sys
+import os
+import shutil
+import tempfile
+
+# Add parent directory to path so we can import versionindex.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import consumer
+import mmaptable
+import versionindex
+from canned import load_canned_diff
+
+
+class TestVersionIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'versions.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_only_newer_versions_pass(self):
+        index = versionindex.VersionIndex(self.path)
+        self.assertTrue(index.is_newer('node', '42', '3'))
+        # Not recorded yet
+        self.assertTrue(index.is_newer('node', '42', '3'))
+        index.record('node', '42', '3', '100')
+        self.assertFalse(index.is_newer('node', '42', '3'))
+        self.assertFalse(index.is_newer('node', '42', '2'))
+        self.assertTrue(index.is_newer('node', '42', '4'))
+        index.record('node', '42', '4', '110')
+        # Types have their own id spaces
+        self.assertTrue(index.is_newer('way', '42', '1'))
+        index.record('node', '43', None)
+        self.assertTrue(index.is_newer('node', '43', None))
+        self.assertEqual(index.skipped, 2)
+        self.assertEqual(index.get('node', '42'), (4, 110))
+        self.assertIsNone(index.get('node', '43'))
+
+    def test_versions_are_kept_from_commit_on(self):
+        index = versionindex.VersionIndex(self.path)
+        index.record('relation', '7', '2', '5')
+        index.close()
+        # Not committed: the rows may not have been written out
+        self.assertIsNone(versionindex.VersionIndex(self.path).get('relation', '7'))
+
+        index = versionindex.VersionIndex(self.path)
+        index.record('relation', '7', '2', '5')
+        index.commit()
+        index.close()
+        reopened = versionindex.VersionIndex(self.path)
+        self.assertEqual((reopened.get('relation', '7'), len(reopened)), ((2, 5), 1))
+        self.assertFalse(reopened.is_newer('relation', '7', '2'))
+
+    def test_grows(self):
+        index = versionindex.VersionIndex(self.path, capacity=16)
+        self.assertEqual(index.table.capacity, mmaptable.MIN_CAPACITY)
+        ids = range(1, 5000, 3)
+        for osm_id in ids:
+            index.record('node', osm_id, 1, osm_id)
+        index.commit()
+        self.assertEqual(index.table.capacity, 4096)
+        self.assertEqual(os.path.getsize(self.path), mmaptable.table_size(4096))
+        self.assertEqual(os.listdir(self.directory), ['versions.idx'])
+        self.assertTrue(all(index.get('node', osm_id) == (1, osm_id) for osm_id in ids))
+        self.assertIsNone(index.get('node', 2))
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as fh:
+            fh.write(b'\0' * 128)
+        with self.assertRaises(ValueError):
+            versionindex.VersionIndex(self.path)
+
+
+class TestRerun(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'versions.idx')
+        services = mock.patch.dict('consumer._services', clear=True)
+        services.start()
+        self.addCleanup(services.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def close_index(self):
+        index = consumer.version_index()
+        assert index is not None
+        index.close()
+
+    def convert(self):
+        sinks = {'nodes': [], 'ways': [], 'relations': [], 'members': [], 'tags': [], 'deletions': []}
+        return consumer.process_diff_data(load_canned_diff(), sinks)
+
+    def test_rows_of_a_diff_written_before_are_skipped(self):
+        with mock.patch.multiple('consumer', VERSION_INDEX=self.path):
+            first = self.convert()
+            # The run failed before it got to commit the versions
+            self.close_index()
+            consumer._services.clear()
+            self.assertEqual(self.convert(), first)
+            consumer.commit_versions()
+
+            again = self.convert()
+            self.close_index()
+        self.assertEqual([len(first[name]) for name in first], [3, 1, 1, 2, 8, 1])
+        self.assertEqual(again, {name: [] for name in first})
+
+    def test_filtered_out_entities_are_not_recorded(self):
+        with mock.patch.multiple('consumer', FILTER='w/highway', VERSION_INDEX=self.path):
+            self.convert()
+            consumer.commit_versions()
+        with mock.patch.multiple('consumer', VERSION_INDEX=self.path):
+            index = consumer.version_index()
+            assert index is not None
+            self.assertEqual(len(index), 1)
+            self.assertIsNotNone(index.get('way', '1389012345'))
+            # Written out once they are no longer filtered out
+            again = self.convert()
+            index.close()
+        self.assertEqual([len(again[name]) for name in again], [3, 0, 1, 2, 6, 1])
+
+    def test_workers_reject_index(self):
+        with mock.patch.multiple('consumer', VERSION_INDEX=self.path), self.assertRaises(ValueError):
+            consumer.run_parallel_batch(100, 101, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
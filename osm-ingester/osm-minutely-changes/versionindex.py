@@ -0,0 +1,86 @@
+"""A persistent index of the last version of every entity written out.
+
+A run that fails after writing its rows but before writing the etag leaves the
+etag it started with, so the next run writes the same rows again. With a
+version index, every entity is looked up by (type, id) before its rows are
+built (is_newer), and skipped when the version written last is the same or
+newer. Entities that do get rows are recorded with record().
+
+The index is a mmaptable.MappedTable from id << 2 | type code to the version
+and its changeset, 16 bytes per slot.
+
+Versions seen while converting are kept aside until commit(), which is called
+once the rows of those versions have been flushed and before the etag is
+written: a run that fails before then writes the rows again, one that fails
+after skips them. A diff that fails halfway and is retried in the same run
+calls rollback() first, so that its entities are not skipped the second time.
+"""
+
+import mmaptable
+
+MAGIC = b"OSMVIDX1"
+TYPE_CODES = {"node": 1, "way": 2, "relation": 3}
+
+
+class VersionIndex:
+    """The (type, id) -> (version, changeset) table in the file at path."""
+
+    def __init__(self, path, capacity=1 << 20):
+        self.path = path
+        self.table = mmaptable.MappedTable(path, MAGIC, capacity)
+        self.pending = {}
+        self.skipped = 0
+
+    def get(self, osm_type, osm_id):
+        """Return the (version, changeset) last recorded for an entity, or None."""
+        key = int(osm_id) << 2 | TYPE_CODES[osm_type]
+        pending = self.pending.get(key)
+        if pending is not None:
+            return pending
+        return self.table.get(key)
+
+    def is_newer(self, osm_type, osm_id, version):
+        """Return whether version is newer than the one recorded.
+
+        Entities without a version are always newer.
+        """
+        if version is None or osm_id is None:
+            return True
+        key = int(osm_id) << 2 | TYPE_CODES[osm_type]
+        last = self.pending.get(key) or self.table.get(key)
+        if last is not None and last[0] >= int(version):
+            self.skipped += 1
+            return False
+        return True
+
+    def record(self, osm_type, osm_id, version, changeset=None):
+        """Record version as written out, from the next commit() on.
+
+        Entities without a version are not recorded.
+        """
+        if version is None or osm_id is None:
+            return
+        key = int(osm_id) << 2 | TYPE_CODES[osm_type]
+        self.pending[key] = (int(version), int(changeset or 0))
+
+    def commit(self):
+        """Write the versions recorded since the last commit to the file."""
+        if not self.pending:
+            return
+        table = self.table
+        table.reserve(len(self.pending))
+        put = table.put
+        for key, (version, changeset) in self.pending.items():
+            put(key, version, changeset)
+        table.flush()
+        self.pending.clear()
+
+    def rollback(self):
+        """Forget the versions recorded since the last commit."""
+        self.pending.clear()
+
+    def close(self):
+        self.table.close()
+
+    def __len__(self):
+        return len(self.table)